@@ -1,5 +1,14 @@
+from threading import Lock
+from typing import Any, Sequence
+
+from pydantic import ValidationError
+
 from mibi.model import PartialAnswer, Question, Answer, PartiallyAnsweredQuestion
 from mibi.modules import DocumentsModule, SnippetsModule, ExactAnswerModule, IdealAnswerModule
+from mibi.stage_cache import STAGE_ADAPTERS, StageCache, StageType
+
+
+_StageModule = DocumentsModule | SnippetsModule | ExactAnswerModule | IdealAnswerModule
 
 
 class AnswerBuilder:
@@ -9,6 +18,8 @@ class AnswerBuilder:
     _ideal_answer_module: IdealAnswerModule
     _question: Question
     _partial_answer: PartialAnswer
+    _stage_cache: StageCache | None
+    _lock: Lock
 
     def __init__(
         self,
@@ -17,68 +28,153 @@ class AnswerBuilder:
         snippets_module: SnippetsModule,
         exact_answer_module: ExactAnswerModule,
         ideal_answer_module: IdealAnswerModule,
+        stage_cache: StageCache | None = None,
     ) -> None:
         self._question = question
         if isinstance(question, PartiallyAnsweredQuestion):
-            self._partial_answer = question
+            # The question's fields are already validated.
+            self._partial_answer = PartialAnswer.model_construct(
+                documents=question.documents,
+                snippets=question.snippets,
+                ideal_answer=question.ideal_answer,
+                exact_answer=question.exact_answer,
+            )
         else:
             self._partial_answer = PartialAnswer()
         self._documents_module = documents_module
         self._snippets_module = snippets_module
         self._exact_answer_module = exact_answer_module
         self._ideal_answer_module = ideal_answer_module
+        self._stage_cache = stage_cache
+        self._lock = Lock()
 
-    def make_documents(self) -> None:
-        print(f"Making documents for question '{self.question.body}'...")
-        self._partial_answer = PartialAnswer(
-            documents=self._documents_module.forward(
-                question=self._question,
-                partial_answer=self._partial_answer,
-            ),
-            snippets=self._partial_answer.snippets,
-            exact_answer=self._partial_answer.exact_answer,
-            ideal_answer=self._partial_answer.ideal_answer,
+    def _update_partial_answer(self, stage: StageType, value: Any) -> Any:
+        # Only validate the new value, as the other fields of the partial answer are already validated.
+        value = STAGE_ADAPTERS[stage].validate_python(value)
+        # Stages can run concurrently, so replace only the stage's field of the latest partial answer.
+        with self._lock:
+            self._partial_answer = self._partial_answer.model_copy(
+                update={stage: value},
+            )
+        return value
+
+    def _module(self, stage: StageType) -> _StageModule:
+        if stage == "documents":
+            return self._documents_module
+        elif stage == "snippets":
+            return self._snippets_module
+        elif stage == "exact_answer":
+            return self._exact_answer_module
+        elif stage == "ideal_answer":
+            return self._ideal_answer_module
+        else:
+            raise ValueError(f"Unknown stage type: {stage}")
+
+    @staticmethod
+    def make_batch(
+        builders: Sequence["AnswerBuilder"],
+        stage: StageType,
+        partial_answers: Sequence[PartialAnswer] | None = None,
+    ) -> Sequence[Any | Exception]:
+        """
+        Make the stage for multiple builders (of the same answer module) at once, using the stage module's batched prediction.
+
+        :param builders: The builders to make the stage for.
+        :param stage: The stage to make.
+        :param partial_answers: The partial answers to make the stage from, per builder. Defaults to the builders' current partial answers.
+        :return: For each builder, the stage output, or the exception if making the stage failed.
+        """
+        if partial_answers is None:
+            partial_answers = [builder._partial_answer for builder in builders]
+        print(f"Making {stage.replace('_', ' ')} for {len(builders)} questions...")
+        results: list[Any | Exception] = [None] * len(builders)
+        pending: list[tuple[int, PartialAnswer]] = []
+        for index, (builder, partial_answer) in enumerate(
+                zip(builders, partial_answers)):
+            if builder._stage_cache is not None:
+                value = builder._stage_cache.get(
+                    stage, builder._module(stage), builder._question, partial_answer)
+                if value is not None:
+                    results[index] = builder._update_partial_answer(
+                        stage, value)
+                    continue
+            pending.append((index, partial_answer))
+        if len(pending) == 0:
+            return results
+
+        module = builders[pending[0][0]]._module(stage)
+        values = module.forward_batch(
+            [builders[index]._question for index, _ in pending],
+            [partial_answer for _, partial_answer in pending],
         )
-        print("Made documents.")
+        for (index, partial_answer), value in zip(pending, values):
+            builder = builders[index]
+            if isinstance(value, Exception):
+                results[index] = value
+                continue
+            try:
+                results[index] = builder._update_partial_answer(stage, value)
+            except ValidationError as error:
+                results[index] = error
+                continue
+            if builder._stage_cache is not None:
+                builder._stage_cache.put(
+                    stage, module, builder._question, partial_answer, value)
+        print(f"Made {stage.replace('_', ' ')} for {len(builders)} questions.")
+        return results
 
-    def make_snippets(self) -> None:
-        print(f"Making snippets for question '{self.question.body}'...")
-        self._partial_answer = PartialAnswer(
-            documents=self._partial_answer.documents,
-            snippets=self._snippets_module.forward(
-                question=self._question,
-                partial_answer=self._partial_answer,
-            ),
-            exact_answer=self._partial_answer.exact_answer,
-            ideal_answer=self._partial_answer.ideal_answer,
+    def _make(
+        self,
+        stage: StageType,
+        module: _StageModule,
+        partial_answer: PartialAnswer,
+    ) -> Any:
+        if self._stage_cache is not None:
+            value = self._stage_cache.get(
+                stage, module, self._question, partial_answer)
+            if value is not None:
+                print(f"Using cached {stage.replace('_', ' ')}.")
+                return value
+        value = module.forward(
+            question=self._question,
+            partial_answer=partial_answer,
         )
-        print("Made snippets.")
+        if self._stage_cache is not None:
+            self._stage_cache.put(
+                stage, module, self._question, partial_answer, value)
+        return value
+
+    def make(
+        self,
+        stage: StageType,
+        partial_answer: PartialAnswer | None = None,
+    ) -> Any:
+        """
+        Make the stage and update the current partial answer with its output.
+
+        :param stage: The stage to make.
+        :param partial_answer: The partial answer to make the stage from. Defaults to the current partial answer.
+        :return: The stage output.
+        """
+        if partial_answer is None:
+            partial_answer = self._partial_answer
+        print(f"Making {stage.replace('_', ' ')} for question '{self.question.body}'...")
+        value = self._update_partial_answer(
+            stage, self._make(stage, self._module(stage), partial_answer))
+        print(f"Made {stage.replace('_', ' ')}.")
+        return value
+
+    def make_documents(self) -> None:
+        self.make("documents")
+
+    def make_snippets(self) -> None:
+        self.make("snippets")
 
     def make_exact_answer(self) -> None:
-        print(f"Making exact answer for question '{self.question.body}'...")
-        self._partial_answer = PartialAnswer(
-            documents=self._partial_answer.documents,
-            snippets=self._partial_answer.snippets,
-            exact_answer=self._exact_answer_module.forward(
-                question=self._question,
-                partial_answer=self._partial_answer,
-            ),
-            ideal_answer=self._partial_answer.ideal_answer,
-        )
-        print("Made exact answer.")
+        self.make("exact_answer")
 
     def make_ideal_answer(self) -> None:
-        print(f"Making ideal answer for question '{self.question.body}'...")
-        self._partial_answer = PartialAnswer(
-            documents=self._partial_answer.documents,
-            snippets=self._partial_answer.snippets,
-            exact_answer=self._partial_answer.exact_answer,
-            ideal_answer=self._ideal_answer_module.forward(
-                question=self._question,
-                partial_answer=self._partial_answer,
-            ),
-        )
-        print("Made ideal answer.")
+        self.make("ideal_answer")
 
     @property
     def question(self) -> Question:
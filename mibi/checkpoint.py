@@ -0,0 +1,120 @@
+from contextlib import contextmanager
+from json import dumps, loads
+from pathlib import Path
+from typing import IO, Iterable, Iterator
+
+from pydantic import ValidationError
+
+from mibi.model import AnsweredQuestion
+
+
+class AnsweredQuestionsCheckpoint:
+    """
+    JSONL sidecar file that stores each answered question as soon as it is answered, so that an interrupted run can be resumed.
+    Only the byte offsets of the answered questions are kept in memory.
+    """
+
+    _path: Path
+    _offsets: dict[str, int]
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+        self._offsets = {}
+        self._scan()
+
+    def _scan(self) -> None:
+        if not self._path.exists():
+            return
+        with self._path.open("rb") as file:
+            offset = file.tell()
+            for line_number, line in enumerate(iter(file.readline, b""), start=1):
+                try:
+                    question = AnsweredQuestion.model_validate_json(line)
+                except ValidationError:
+                    # The last line can be incomplete if the previous run crashed while writing it.
+                    print(
+                        f"Skipping invalid line {line_number} "
+                        f"in checkpoint: {self._path}")
+                else:
+                    self._offsets[question.id] = offset
+                offset = file.tell()
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def answered_question_ids(self) -> set[str]:
+        return set(self._offsets.keys())
+
+    @contextmanager
+    def open(self) -> Iterator["_CheckpointWriter"]:
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        with self._path.open("ab") as file:
+            if file.tell() > 0:
+                # Terminate an incomplete last line from a previous run.
+                with self._path.open("rb") as read_file:
+                    read_file.seek(-1, 2)
+                    if read_file.read(1) != b"\n":
+                        file.write(b"\n")
+            yield _CheckpointWriter(self, file)
+
+    def write_data(
+        self,
+        question_ids: Iterable[str],
+        output_path: Path,
+    ) -> int:
+        """
+        Assemble the BioASQ JSON data from the checkpoint, streaming one question at a time.
+        The questions are written in the given order and questions not in the checkpoint are skipped.
+
+        :param question_ids: IDs of the questions to write, in the order they should appear in the output.
+        :param output_path: Path of the JSON file to write.
+        :return: Number of written questions.
+        """
+        count = 0
+        with self._path.open("rb") as checkpoint_file, \
+                output_path.open("wt") as output_file:
+            output_file.write("{\n  \"questions\": [")
+            for question_id in question_ids:
+                offset = self._offsets.get(question_id)
+                if offset is None:
+                    continue
+                checkpoint_file.seek(offset)
+                # Re-format the serialized question instead of re-validating it, as validation is not lossless for all exact answer types.
+                question_json = dumps(
+                    loads(checkpoint_file.readline()),
+                    indent=2,
+                    ensure_ascii=False,
+                )
+                output_file.write(",\n" if count > 0 else "\n")
+                output_file.write("\n".join(
+                    f"    {line}"
+                    for line in question_json.splitlines()
+                ))
+                count += 1
+            if count > 0:
+                output_file.write("\n  ]\n}")
+            else:
+                output_file.write("]\n}")
+        return count
+
+
+class _CheckpointWriter:
+    _checkpoint: AnsweredQuestionsCheckpoint
+    _file: IO[bytes]
+
+    def __init__(
+        self,
+        checkpoint: AnsweredQuestionsCheckpoint,
+        file: IO[bytes],
+    ) -> None:
+        self._checkpoint = checkpoint
+        self._file = file
+
+    def write(self, question: AnsweredQuestion) -> None:
+        offset = self._file.tell()
+        self._file.write(question.model_dump_json(by_alias=True).encode())
+        self._file.write(b"\n")
+        self._file.flush()
+        self._checkpoint._offsets[question.id] = offset
@@ -1,7 +1,7 @@
 from pathlib import Path
-from typing import Literal, cast
+from typing import Literal, Sequence, cast
 
-from click import Choice, IntRange, echo, option, Path as PathType, argument, command
+from click import Choice, FloatRange, IntRange, echo, option, Path as PathType, argument, command
 
 from mibi.metrics import DefaultMeasure
 from mibi.model import Question
@@ -86,6 +86,8 @@ from mibi.model import Question
         "text-davinci-003",
         "Mixtral-8x7B-Instruct-v0.1",
         "Mistral-7B-Instruct-v0.2",
+        "local/Mixtral-8x7B-Instruct-v0.1",
+        "local/Mistral-7B-Instruct-v0.2",
     ]),
     default="gpt-3.5-turbo-0125",
 )
@@ -123,6 +125,164 @@ from mibi.model import Question
     type=str,
     envvar="ELASTICSEARCH_INDEX_PUBMED",
 )
+@option(
+    "--reranker-inference-backend", "reranker_inference_backend",
+    type=Choice([
+        "torch",
+        "torch-int8",
+    ]),
+    default="torch",
+    envvar="RERANKER_INFERENCE_BACKEND",
+)
+@option(
+    "--pairwise-strategy", "pairwise_strategy",
+    type=Choice([
+        "all-pairs",
+        "sliding-window",
+    ]),
+    default="all-pairs",
+)
+@option(
+    "--pairwise-cutoff", "pairwise_cutoff",
+    type=IntRange(min=2),
+    default=5,
+)
+@option(
+    "--pairwise-window-size", "pairwise_window_size",
+    type=IntRange(min=2),
+    default=4,
+)
+@option(
+    "--pairwise-stride", "pairwise_stride",
+    type=IntRange(min=1),
+    default=2,
+)
+@option(
+    "--pairwise-max-comparisons", "pairwise_max_comparisons",
+    type=IntRange(min=2),
+)
+@option(
+    "--pairwise-skip-margin", "pairwise_skip_margin",
+    type=FloatRange(min=0),
+)
+@option(
+    "--preload-models/--no-preload-models", "preload_models",
+    default=False,
+)
+@option(
+    "--local-llm-inference-backend", "local_llm_inference_backend",
+    type=Choice([
+        "torch",
+        "torch-int8",
+    ]),
+    default="torch",
+)
+@option(
+    "--local-llm-max-batch-size", "local_llm_max_batch_size",
+    type=IntRange(min=1),
+    default=8,
+)
+@option(
+    "--llm-timeout", "llm_timeout_seconds",
+    type=FloatRange(min=0, min_open=True),
+)
+@option(
+    "--llm-max-retries", "llm_max_retries",
+    type=IntRange(min=0),
+    default=0,
+)
+@option(
+    "--hedge-llm-requests/--no-hedge-llm-requests", "hedge_llm_requests",
+    default=False,
+)
+@option(
+    "--rate-limits-config", "rate_limits_config_path",
+    type=PathType(
+        path_type=Path,
+        exists=True,
+        file_okay=True,
+        dir_okay=False,
+        readable=True,
+        writable=False,
+        resolve_path=True,
+        allow_dash=False
+    ),
+)
+@option(
+    "--max-planning-calls", "max_planning_calls",
+    type=IntRange(min=0),
+    default=10,
+)
+@option(
+    "--draft-llm", "draft_language_model_name",
+    type=str,
+)
+@option(
+    "--draft-samples", "draft_samples",
+    type=IntRange(min=1),
+    default=3,
+)
+@option(
+    "--draft-confidence", "draft_confidence",
+    type=FloatRange(min=0, max=1),
+    default=1.0,
+)
+@option(
+    "--cascade-question-types", "cascade_question_types",
+    type=Choice(["yesno", "factoid", "list"]),
+    multiple=True,
+    default=["yesno", "factoid"],
+)
+@option(
+    "--stream-ideal-answers/--no-stream-ideal-answers", "stream_ideal_answers",
+    default=False,
+)
+@option(
+    "--ideal-answer-max-sentences", "ideal_answer_max_sentences",
+    type=IntRange(min=1),
+    default=3,
+)
+@option(
+    "--ideal-answer-max-tokens", "ideal_answer_max_tokens",
+    type=IntRange(min=1),
+)
+@option(
+    "--joint-llm-answers/--no-joint-llm-answers", "joint_llm_answers",
+    default=False,
+)
+@option(
+    "--instrument-llm/--no-instrument-llm", "instrument_llm",
+    default=False,
+)
+@option(
+    "--context-token-budget", "context_token_budget",
+    type=IntRange(min=1),
+)
+@option(
+    "--constrained-decoding/--no-constrained-decoding", "constrained_decoding",
+    default=False,
+)
+@option(
+    "--llm-cache-path", "llm_cache_path",
+    type=PathType(
+        path_type=Path,
+        exists=False,
+        file_okay=True,
+        dir_okay=False,
+        readable=True,
+        writable=True,
+        resolve_path=True,
+        allow_dash=False
+    ),
+)
+@option(
+    "--llm-cache-ttl", "llm_cache_ttl_hours",
+    type=FloatRange(min=0, min_open=True),
+)
+@option(
+    "--llm-cache-max-size", "llm_cache_max_size_megabytes",
+    type=IntRange(min=1),
+)
 def compile(
     training_data_path: Path,
     model_path: Path,
@@ -162,12 +322,56 @@ def compile(
     elasticsearch_username: str | None,
     elasticsearch_password: str | None,
     elasticsearch_index: str | None,
+    reranker_inference_backend: Literal[
+        "torch",
+        "torch-int8",
+    ],
+    pairwise_strategy: Literal[
+        "all-pairs",
+        "sliding-window",
+    ],
+    pairwise_cutoff: int,
+    pairwise_window_size: int,
+    pairwise_stride: int,
+    pairwise_max_comparisons: int | None,
+    pairwise_skip_margin: float | None,
+    preload_models: bool,
+    local_llm_inference_backend: Literal[
+        "torch",
+        "torch-int8",
+    ],
+    local_llm_max_batch_size: int,
+    llm_timeout_seconds: float | None,
+    llm_max_retries: int,
+    hedge_llm_requests: bool,
+    rate_limits_config_path: Path | None,
+    max_planning_calls: int,
+    draft_language_model_name: str | None,
+    draft_samples: int,
+    draft_confidence: float,
+    cascade_question_types: Sequence[Literal[
+        "yesno",
+        "factoid",
+        "list",
+    ]],
+    stream_ideal_answers: bool,
+    ideal_answer_max_sentences: int,
+    ideal_answer_max_tokens: int | None,
+    joint_llm_answers: bool,
+    instrument_llm: bool,
+    context_token_budget: int | None,
+    constrained_decoding: bool,
+    llm_cache_path: Path | None,
+    llm_cache_ttl_hours: float | None,
+    llm_cache_max_size_megabytes: int | None,
 ) -> None:
-    from dspy import Module, Example
+    from datetime import timedelta
+    from dspy import Module, Example, settings as dspy_settings
     from dspy.teleprompt import Teleprompter, BootstrapFewShot, BootstrapFewShotWithRandomSearch, MIPRO, COPRO
     from mibi.model import PartiallyAnsweredQuestionData, Answer
     from mibi.modules import JsonAnswerModule
     from mibi.modules.build import build_answer_module
+    from mibi.utils.language_models import CachedLM, InstrumentedLM, find_language_model
 
     answer_module = build_answer_module(
         documents_module_type=documents_module_type,
@@ -180,6 +384,41 @@ def compile(
         elasticsearch_username=elasticsearch_username,
         elasticsearch_password=elasticsearch_password,
         elasticsearch_index=elasticsearch_index,
+        reranker_inference_backend=reranker_inference_backend,
+        pairwise_strategy=pairwise_strategy,
+        pairwise_cutoff=pairwise_cutoff,
+        pairwise_window_size=pairwise_window_size,
+        pairwise_stride=pairwise_stride,
+        pairwise_max_comparisons=pairwise_max_comparisons,
+        pairwise_skip_margin=pairwise_skip_margin,
+        preload_models=preload_models,
+        llm_cache_path=llm_cache_path,
+        llm_cache_ttl=(
+            timedelta(hours=llm_cache_ttl_hours)
+            if llm_cache_ttl_hours is not None else None
+        ),
+        llm_cache_max_size=(
+            llm_cache_max_size_megabytes * 1_000_000
+            if llm_cache_max_size_megabytes is not None else None
+        ),
+        constrained_decoding=constrained_decoding,
+        context_token_budget=context_token_budget,
+        joint_llm_answers=joint_llm_answers,
+        local_llm_inference_backend=local_llm_inference_backend,
+        local_llm_max_batch_size=local_llm_max_batch_size,
+        llm_timeout=llm_timeout_seconds,
+        llm_max_retries=llm_max_retries,
+        hedge_llm_requests=hedge_llm_requests,
+        rate_limits_config_path=rate_limits_config_path,
+        max_planning_calls=max_planning_calls,
+        draft_language_model_name=draft_language_model_name,
+        draft_samples=draft_samples,
+        draft_confidence=draft_confidence,
+        cascade_question_types=cascade_question_types,
+        stream_ideal_answers=stream_ideal_answers,
+        ideal_answer_max_sentences=ideal_answer_max_sentences,
+        ideal_answer_max_tokens=ideal_answer_max_tokens,
+        instrument_llm=instrument_llm,
     )
 
     wrapped_answer_module = JsonAnswerModule(answer_module)
@@ -303,3 +542,10 @@ def compile(
 
     print(f"Saving LLM programm parameters to: {model_path}")
     optimized_answer_module.save(model_path)
+
+    instrumented_lm = find_language_model(dspy_settings.lm, InstrumentedLM)
+    if instrumented_lm is not None:
+        echo(f"Language model requests: {instrumented_lm.stats}")
+    cached_lm = find_language_model(dspy_settings.lm, CachedLM)
+    if cached_lm is not None:
+        echo(f"Language model cache: {cached_lm.cache.stats}")
@@ -1,7 +1,7 @@
 from pathlib import Path
-from typing import Literal
+from typing import Literal, Sequence
 
-from click import Choice, IntRange, echo, option, Path as PathType, argument, command
+from click import Choice, FloatRange, IntRange, echo, option, Path as PathType, argument, command
 
 
 @command()
@@ -83,6 +83,8 @@ from click import Choice, IntRange, echo, option, Path as PathType, argument, co
         "text-davinci-003",
         "Mixtral-8x7B-Instruct-v0.1",
         "Mistral-7B-Instruct-v0.2",
+        "local/Mixtral-8x7B-Instruct-v0.1",
+        "local/Mistral-7B-Instruct-v0.2",
     ]),
     default="gpt-3.5-turbo",
 )
@@ -110,6 +112,200 @@ from click import Choice, IntRange, echo, option, Path as PathType, argument, co
     type=str,
     envvar="ELASTICSEARCH_INDEX_PUBMED",
 )
+@option(
+    "--reranker-inference-backend", "reranker_inference_backend",
+    type=Choice([
+        "torch",
+        "torch-int8",
+    ]),
+    default="torch",
+    envvar="RERANKER_INFERENCE_BACKEND",
+)
+@option(
+    "--pairwise-strategy", "pairwise_strategy",
+    type=Choice([
+        "all-pairs",
+        "sliding-window",
+    ]),
+    default="all-pairs",
+)
+@option(
+    "--pairwise-cutoff", "pairwise_cutoff",
+    type=IntRange(min=2),
+    default=5,
+)
+@option(
+    "--pairwise-window-size", "pairwise_window_size",
+    type=IntRange(min=2),
+    default=4,
+)
+@option(
+    "--pairwise-stride", "pairwise_stride",
+    type=IntRange(min=1),
+    default=2,
+)
+@option(
+    "--pairwise-max-comparisons", "pairwise_max_comparisons",
+    type=IntRange(min=2),
+)
+@option(
+    "--pairwise-skip-margin", "pairwise_skip_margin",
+    type=FloatRange(min=0),
+)
+@option(
+    "--preload-models/--no-preload-models", "preload_models",
+    default=False,
+)
+@option(
+    "--stage-cache-path", "stage_cache_path",
+    type=PathType(
+        path_type=Path,
+        exists=False,
+        file_okay=False,
+        dir_okay=True,
+        readable=True,
+        writable=True,
+        resolve_path=True,
+        allow_dash=False
+    ),
+)
+@option(
+    "--local-llm-inference-backend", "local_llm_inference_backend",
+    type=Choice([
+        "torch",
+        "torch-int8",
+    ]),
+    default="torch",
+)
+@option(
+    "--local-llm-max-batch-size", "local_llm_max_batch_size",
+    type=IntRange(min=1),
+    default=8,
+)
+@option(
+    "--llm-timeout", "llm_timeout_seconds",
+    type=FloatRange(min=0, min_open=True),
+)
+@option(
+    "--llm-max-retries", "llm_max_retries",
+    type=IntRange(min=0),
+    default=0,
+)
+@option(
+    "--hedge-llm-requests/--no-hedge-llm-requests", "hedge_llm_requests",
+    default=False,
+)
+@option(
+    "--rate-limits-config", "rate_limits_config_path",
+    type=PathType(
+        path_type=Path,
+        exists=True,
+        file_okay=True,
+        dir_okay=False,
+        readable=True,
+        writable=False,
+        resolve_path=True,
+        allow_dash=False
+    ),
+)
+@option(
+    "--max-planning-calls", "max_planning_calls",
+    type=IntRange(min=0),
+    default=10,
+)
+@option(
+    "--draft-llm", "draft_language_model_name",
+    type=str,
+)
+@option(
+    "--draft-samples", "draft_samples",
+    type=IntRange(min=1),
+    default=3,
+)
+@option(
+    "--draft-confidence", "draft_confidence",
+    type=FloatRange(min=0, max=1),
+    default=1.0,
+)
+@option(
+    "--cascade-question-types", "cascade_question_types",
+    type=Choice(["yesno", "factoid", "list"]),
+    multiple=True,
+    default=["yesno", "factoid"],
+)
+@option(
+    "--stream-ideal-answers/--no-stream-ideal-answers", "stream_ideal_answers",
+    default=False,
+)
+@option(
+    "--ideal-answer-max-sentences", "ideal_answer_max_sentences",
+    type=IntRange(min=1),
+    default=3,
+)
+@option(
+    "--ideal-answer-max-tokens", "ideal_answer_max_tokens",
+    type=IntRange(min=1),
+)
+@option(
+    "--joint-llm-answers/--no-joint-llm-answers", "joint_llm_answers",
+    default=False,
+)
+@option(
+    "--instrument-llm/--no-instrument-llm", "instrument_llm",
+    default=False,
+)
+@option(
+    "--context-token-budget", "context_token_budget",
+    type=IntRange(min=1),
+)
+@option(
+    "--constrained-decoding/--no-constrained-decoding", "constrained_decoding",
+    default=False,
+)
+@option(
+    "--llm-cache-path", "llm_cache_path",
+    type=PathType(
+        path_type=Path,
+        exists=False,
+        file_okay=True,
+        dir_okay=False,
+        readable=True,
+        writable=True,
+        resolve_path=True,
+        allow_dash=False
+    ),
+)
+@option(
+    "--llm-cache-ttl", "llm_cache_ttl_hours",
+    type=FloatRange(min=0, min_open=True),
+)
+@option(
+    "--llm-cache-max-size", "llm_cache_max_size_megabytes",
+    type=IntRange(min=1),
+)
+@option(
+    "-c", "--concurrency", "concurrency",
+    type=IntRange(min=1),
+    default=1,
+)
+@option(
+    "-b", "--batch-size", "batch_size",
+    type=IntRange(min=1),
+    default=1,
+)
+@option(
+    "--checkpoint-path", "checkpoint_path",
+    type=PathType(
+        path_type=Path,
+        exists=False,
+        file_okay=True,
+        dir_okay=False,
+        readable=True,
+        writable=True,
+        resolve_path=True,
+        allow_dash=False
+    ),
+)
 @option(
     "-m", "--model-path", "model_path",
     type=PathType(
@@ -156,12 +352,69 @@ def run(
     elasticsearch_username: str | None,
     elasticsearch_password: str | None,
     elasticsearch_index: str | None,
+    reranker_inference_backend: Literal[
+        "torch",
+        "torch-int8",
+    ],
+    pairwise_strategy: Literal[
+        "all-pairs",
+        "sliding-window",
+    ],
+    pairwise_cutoff: int,
+    pairwise_window_size: int,
+    pairwise_stride: int,
+    pairwise_max_comparisons: int | None,
+    pairwise_skip_margin: float | None,
+    preload_models: bool,
+    stage_cache_path: Path | None,
+    local_llm_inference_backend: Literal[
+        "torch",
+        "torch-int8",
+    ],
+    local_llm_max_batch_size: int,
+    llm_timeout_seconds: float | None,
+    llm_max_retries: int,
+    hedge_llm_requests: bool,
+    rate_limits_config_path: Path | None,
+    max_planning_calls: int,
+    draft_language_model_name: str | None,
+    draft_samples: int,
+    draft_confidence: float,
+    cascade_question_types: Sequence[Literal[
+        "yesno",
+        "factoid",
+        "list",
+    ]],
+    stream_ideal_answers: bool,
+    ideal_answer_max_sentences: int,
+    ideal_answer_max_tokens: int | None,
+    joint_llm_answers: bool,
+    instrument_llm: bool,
+    context_token_budget: int | None,
+    constrained_decoding: bool,
+    llm_cache_path: Path | None,
+    llm_cache_ttl_hours: float | None,
+    llm_cache_max_size_megabytes: int | None,
+    concurrency: int,
+    batch_size: int,
+    checkpoint_path: Path | None,
     model_path: Path | None
 ) -> None:
-    from typing import Iterable
+    from contextlib import nullcontext
+    from datetime import timedelta
+    from typing import Callable, Iterator
+    from mibi.checkpoint import AnsweredQuestionsCheckpoint
     from mibi.model import AnsweredQuestion, AnsweredQuestionData, PartiallyAnsweredQuestionData, PartiallyAnsweredQuestion, Answer
-    from mibi.modules import JsonAnswerModule
+    from mibi.modules import JsonAnswerModule, iter_sub_modules
+    from mibi.modules.exact_answer.llm import LlmExactAnswerModule
+    from mibi.modules.ideal_answer.llm import LlmIdealAnswerModule
+    from mibi.modules.incremental import IncrementalAnswerModule
+    from mibi.modules.joint_answer.llm import LlmJointAnswerPredictor
     from mibi.modules.build import build_answer_module
+    from dspy import settings as dspy_settings
+    from mibi.utils.concurrency import map_batched, map_concurrently
+    from mibi.utils.language_models import CachedLM, InstrumentedLM, PooledLM, RateLimitedLM, ResilientLM, find_language_model
+    from mibi.utils.local_language_model import LocalLM
 
     with input_path.open("rb") as input_file:
         data = PartiallyAnsweredQuestionData.model_validate_json(
@@ -179,50 +432,184 @@ def run(
         elasticsearch_username=elasticsearch_username,
         elasticsearch_password=elasticsearch_password,
         elasticsearch_index=elasticsearch_index,
+        reranker_inference_backend=reranker_inference_backend,
+        pairwise_strategy=pairwise_strategy,
+        pairwise_cutoff=pairwise_cutoff,
+        pairwise_window_size=pairwise_window_size,
+        pairwise_stride=pairwise_stride,
+        pairwise_max_comparisons=pairwise_max_comparisons,
+        pairwise_skip_margin=pairwise_skip_margin,
+        preload_models=preload_models,
+        stage_cache_path=stage_cache_path,
+        llm_cache_path=llm_cache_path,
+        llm_cache_ttl=(
+            timedelta(hours=llm_cache_ttl_hours)
+            if llm_cache_ttl_hours is not None else None
+        ),
+        llm_cache_max_size=(
+            llm_cache_max_size_megabytes * 1_000_000
+            if llm_cache_max_size_megabytes is not None else None
+        ),
+        constrained_decoding=constrained_decoding,
+        context_token_budget=context_token_budget,
+        joint_llm_answers=joint_llm_answers,
+        local_llm_inference_backend=local_llm_inference_backend,
+        local_llm_max_batch_size=local_llm_max_batch_size,
+        llm_timeout=llm_timeout_seconds,
+        llm_max_retries=llm_max_retries,
+        hedge_llm_requests=hedge_llm_requests,
+        rate_limits_config_path=rate_limits_config_path,
+        max_planning_calls=max_planning_calls,
+        draft_language_model_name=draft_language_model_name,
+        draft_samples=draft_samples,
+        draft_confidence=draft_confidence,
+        cascade_question_types=cascade_question_types,
+        stream_ideal_answers=stream_ideal_answers,
+        ideal_answer_max_sentences=ideal_answer_max_sentences,
+        ideal_answer_max_tokens=ideal_answer_max_tokens,
+        instrument_llm=instrument_llm,
     )
 
     questions = data.questions
     if first_questions is not None:
         questions = questions[:first_questions]
+    question_ids = [question.id for question in questions]
 
-    question_answer_pairs: Iterable[tuple[PartiallyAnsweredQuestion, Answer]]
+    checkpoint: AnsweredQuestionsCheckpoint | None = None
+    if checkpoint_path is not None:
+        checkpoint = AnsweredQuestionsCheckpoint(checkpoint_path)
+        answered_question_ids = checkpoint.answered_question_ids
+        num_questions = len(questions)
+        questions = [
+            question for question in questions
+            if question.id not in answered_question_ids
+        ]
+        if len(questions) < num_questions:
+            echo(
+                f"Skipping {num_questions - len(questions)} questions "
+                f"already answered in checkpoint: {checkpoint_path}")
+
+    answer: Callable[[PartiallyAnsweredQuestion], Answer]
 
     if model_path is not None:
         json_answer_module = JsonAnswerModule(answer_module)
         print(f"Loading LLM programm parameters from: {model_path}")
         json_answer_module.load(model_path)
-        question_answer_pairs = (
-            (question, json_answer_module.forward(
+
+        def answer(question: PartiallyAnsweredQuestion) -> Answer:
+            return json_answer_module.forward(
                 question.model_dump(mode="json")
-            ))
-            for question in questions
-        )
+            )
     else:
-        question_answer_pairs = (
-            (question, answer_module.forward(question))
-            for question in questions
+        answer = answer_module.forward
+
+    answers: Iterator[Answer | Exception]
+    if batch_size > 1:
+        echo(
+            f"Answering questions in batches of {batch_size} "
+            f"with concurrency {concurrency}.")
+        # Loaded program parameters are shared with the wrapped answer module.
+        answers = map_batched(
+            answer_module.forward_batch,
+            questions,
+            batch_size=batch_size,
+            concurrency=concurrency,
         )
+    else:
+        if concurrency > 1:
+            echo(f"Answering questions with concurrency {concurrency}.")
+        answers = map_concurrently(
+            answer, questions, concurrency=concurrency)
 
-    answered_questions = [
-        AnsweredQuestion(
-            id=question.id,
-            type=question.type,
-            body=question.body,
-            documents=answer.documents,
-            snippets=answer.snippets,
-            ideal_answer=answer.ideal_answer,
-            exact_answer=answer.exact_answer,
+    answered_questions: list[AnsweredQuestion] = []
+    failed_questions: list[PartiallyAnsweredQuestion] = []
+    with (
+        checkpoint.open() if checkpoint is not None else nullcontext()
+    ) as checkpoint_writer:
+        for question, answer_or_exception in zip(questions, answers):
+            if isinstance(answer_or_exception, Exception):
+                echo(
+                    f"Failed to answer question '{question.id}': "
+                    f"{answer_or_exception!r}",
+                    err=True,
+                )
+                failed_questions.append(question)
+                continue
+            answered_question = AnsweredQuestion(
+                id=question.id,
+                type=question.type,
+                body=question.body,
+                documents=answer_or_exception.documents,
+                snippets=answer_or_exception.snippets,
+                ideal_answer=answer_or_exception.ideal_answer,
+                exact_answer=answer_or_exception.exact_answer,
+            )
+            if checkpoint_writer is not None:
+                checkpoint_writer.write(answered_question)
+            else:
+                answered_questions.append(answered_question)
+
+    num_answered: int
+    if checkpoint is not None:
+        num_answered = checkpoint.write_data(question_ids, output_path)
+    else:
+        answered_data = AnsweredQuestionData(
+            questions=answered_questions,
+        )
+        with output_path.open("wt") as output_file:
+            output_file.write(answered_data.model_dump_json(
+                indent=2,
+                by_alias=True,
+            ))
+        num_answered = len(answered_data.questions)
+    echo(f"Answered {num_answered} questions.")
+    if len(failed_questions) > 0:
+        echo(
+            f"Failed to answer {len(failed_questions)} questions: "
+            f"{', '.join(question.id for question in failed_questions)}",
+            err=True,
         )
-        for question, answer in question_answer_pairs
-    ]
 
-    answered_data = AnsweredQuestionData(
-        questions=answered_questions,
-    )
+    if isinstance(answer_module, IncrementalAnswerModule):
+        echo(f"Planning: {answer_module.planning_stats}")
+    for module in iter_sub_modules(answer_module):
+        if isinstance(module, LlmExactAnswerModule):
+            for question_type, stats in module.prediction_stats.items():
+                echo(f"Exact answer predictions ({question_type}): {stats}")
+            if module.cascade_stats is not None:
+                for question_type, cascade_stats in module.cascade_stats.items():
+                    echo(
+                        f"Exact answer drafts ({question_type}): "
+                        f"{cascade_stats}")
+            if module.context_stats is not None:
+                echo(f"Exact answer contexts: {module.context_stats}")
+        elif isinstance(module, LlmIdealAnswerModule):
+            if module.context_stats is not None:
+                echo(f"Ideal answer contexts: {module.context_stats}")
+        elif isinstance(module, LlmJointAnswerPredictor):
+            echo(f"Joint answer predictions: {module.stats}")
+            if module.context_stats is not None:
+                echo(f"Joint answer contexts: {module.context_stats}")
 
-    with output_path.open("wt") as output_file:
-        output_file.write(answered_data.model_dump_json(
-            indent=2,
-            by_alias=True,
-        ))
-    echo(f"Answered {len(answered_data.questions)} questions.")
+    instrumented_lm = find_language_model(dspy_settings.lm, InstrumentedLM)
+    if instrumented_lm is not None:
+        echo(f"Language model requests: {instrumented_lm.stats}")
+    local_lm = find_language_model(dspy_settings.lm, LocalLM)
+    if local_lm is not None:
+        echo(f"Local language model inference: {local_lm.engine.stats}")
+    pooled_lm = find_language_model(dspy_settings.lm, PooledLM)
+    if pooled_lm is not None:
+        for endpoint, endpoint_stats in pooled_lm.stats.items():
+            echo(f"Language model endpoint ({endpoint}): {endpoint_stats}")
+    resilient_lm = find_language_model(dspy_settings.lm, ResilientLM)
+    if resilient_lm is not None:
+        echo(
+            f"Language model latency ({resilient_lm.backend}): "
+            f"{resilient_lm.stats}")
+    rate_limited_lm = find_language_model(dspy_settings.lm, RateLimitedLM)
+    if rate_limited_lm is not None:
+        for name, rate_limit_stats in rate_limited_lm.rate_limiter.stats.items():
+            echo(f"Rate limit ({name}): {rate_limit_stats}")
+    cached_lm = find_language_model(dspy_settings.lm, CachedLM)
+    if cached_lm is not None:
+        echo(f"Language model cache: {cached_lm.cache.stats}")
@@ -3,14 +3,13 @@ from functools import cached_property
 from math import isnan, nan
 from typing import AbstractSet, Collection, Literal, Protocol
 from statistics import harmonic_mean
-from warnings import catch_warnings, simplefilter
 
 from rouge_score.rouge_scorer import RougeScorer
 from rouge_score.tokenizers import Tokenizer as RougeTokenizer
-from spacy import load as spacy_load
 from spacy.language import Language
 
 from mibi.model import NOT_AVAILABLE, Answer, Question
+from mibi.utils.spacy import spacy_language
 
 
 class Measure(Protocol):
@@ -31,9 +30,7 @@ class _LemmaTokenizer(RougeTokenizer):
 
     @cached_property
     def _language(self) -> Language:
-        with catch_warnings():
-            simplefilter(action="ignore", category=FutureWarning)
-            return spacy_load("en_core_sci_sm")
+        return spacy_language("en_core_sci_sm")
 
     def tokenize(self, text: str) -> list[str]:
         doc = self._language(text)
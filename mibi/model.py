@@ -254,7 +254,8 @@ class PartiallyAnsweredQuestion(PartialAnswer, Question):
         question: Question,
         partial_answer: PartialAnswer | None = None,
     ) -> "PartiallyAnsweredQuestion":
-        return PartiallyAnsweredQuestion(
+        # The question and partial answer are already validated, so skip re-validating them.
+        return PartiallyAnsweredQuestion.model_construct(
             id=question.id,
             type=question.type,
             body=question.body,
@@ -305,7 +306,7 @@ class PartiallyAnsweredQuestion(PartialAnswer, Question):
             raise ValueError(
                 f"Question bodys do not match: "
                 f"'{self.body}' != '{question.body}'")
-        return PartiallyAnsweredQuestion(
+        return PartiallyAnsweredQuestion.model_construct(
             id=self.id,
             type=self.type,
             body=self.body,
@@ -1,9 +1,11 @@
 from abc import ABC, ABCMeta, abstractmethod
+from typing import Iterator, Sequence
 
 from dspy import Module, ProgramMeta
 from pydantic import JsonValue
 
 from mibi.model import Question, PartialAnswer, Documents, Snippets, ExactAnswer, IdealAnswer, Answer
+from mibi.utils.concurrency import map_concurrently
 
 
 class _ABCProgramMeta(ABCMeta, ProgramMeta):
@@ -31,6 +33,22 @@ class DocumentsModule(ABCModule):
     ) -> Documents:
         return self.forward(question, partial_answer)
 
+    def forward_batch(
+        self,
+        questions: Sequence[Question],
+        partial_answers: Sequence[PartialAnswer],
+    ) -> Sequence[Documents | Exception]:
+        """
+        Batched variant of `forward`. By default, `forward` is called concurrently for each question.
+        If answering some question fails, the exception is returned in place of its result.
+        """
+        return list(map_concurrently(
+            lambda question_and_partial_answer: self.forward(
+                *question_and_partial_answer),
+            zip(questions, partial_answers),
+            concurrency=max(1, len(questions)),
+        ))
+
 
 class SnippetsModule(ABCModule):
 
@@ -49,6 +67,22 @@ class SnippetsModule(ABCModule):
     ) -> Snippets:
         return self.forward(question, partial_answer)
 
+    def forward_batch(
+        self,
+        questions: Sequence[Question],
+        partial_answers: Sequence[PartialAnswer],
+    ) -> Sequence[Snippets | Exception]:
+        """
+        Batched variant of `forward`. By default, `forward` is called concurrently for each question.
+        If answering some question fails, the exception is returned in place of its result.
+        """
+        return list(map_concurrently(
+            lambda question_and_partial_answer: self.forward(
+                *question_and_partial_answer),
+            zip(questions, partial_answers),
+            concurrency=max(1, len(questions)),
+        ))
+
 
 class ExactAnswerModule(ABCModule):
 
@@ -67,6 +101,22 @@ class ExactAnswerModule(ABCModule):
     ) -> ExactAnswer:
         return self.forward(question, partial_answer)
 
+    def forward_batch(
+        self,
+        questions: Sequence[Question],
+        partial_answers: Sequence[PartialAnswer],
+    ) -> Sequence[ExactAnswer | Exception]:
+        """
+        Batched variant of `forward`. By default, `forward` is called concurrently for each question.
+        If answering some question fails, the exception is returned in place of its result.
+        """
+        return list(map_concurrently(
+            lambda question_and_partial_answer: self.forward(
+                *question_and_partial_answer),
+            zip(questions, partial_answers),
+            concurrency=max(1, len(questions)),
+        ))
+
 
 class IdealAnswerModule(ABCModule):
 
@@ -85,6 +135,22 @@ class IdealAnswerModule(ABCModule):
     ) -> IdealAnswer:
         return self.forward(question, partial_answer)
 
+    def forward_batch(
+        self,
+        questions: Sequence[Question],
+        partial_answers: Sequence[PartialAnswer],
+    ) -> Sequence[IdealAnswer | Exception]:
+        """
+        Batched variant of `forward`. By default, `forward` is called concurrently for each question.
+        If answering some question fails, the exception is returned in place of its result.
+        """
+        return list(map_concurrently(
+            lambda question_and_partial_answer: self.forward(
+                *question_and_partial_answer),
+            zip(questions, partial_answers),
+            concurrency=max(1, len(questions)),
+        ))
+
 
 class AnswerModule(ABCModule):
 
@@ -101,6 +167,38 @@ class AnswerModule(ABCModule):
     ) -> Answer:
         return self.forward(question)
 
+    def forward_batch(
+        self,
+        questions: Sequence[Question],
+    ) -> Sequence[Answer | Exception]:
+        """
+        Batched variant of `forward`. By default, `forward` is called concurrently for each question.
+        If answering some question fails, the exception is returned in place of its answer.
+        """
+        return list(map_concurrently(
+            self.forward,
+            questions,
+            concurrency=max(1, len(questions)),
+        ))
+
+
+def iter_sub_modules(module: Module) -> Iterator[Module]:
+    """
+    Iterate over the DSPy modules nested (recursively) in the module's attributes. Modules shared by multiple modules are only yielded once.
+    """
+    visited: set[int] = {id(module)}
+    pending: list[Module] = [module]
+    while len(pending) > 0:
+        sub_modules = [
+            value
+            for value in vars(pending.pop()).values()
+            if isinstance(value, Module) and id(value) not in visited
+        ]
+        for sub_module in sub_modules:
+            visited.add(id(sub_module))
+        yield from sub_modules
+        pending.extend(reversed(sub_modules))
+
 
 class JsonAnswerModule(Module):
     answer_module: AnswerModule
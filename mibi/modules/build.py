@@ -1,15 +1,24 @@
-from typing import Literal
+from datetime import timedelta
+from pathlib import Path
+from typing import Iterable, Literal
 
 from pyterrier import started, init
 
+from mibi.model import QuestionType
 from mibi.modules import AnswerModule, DocumentsModule, ExactAnswerModule, IdealAnswerModule, SnippetsModule
+from mibi.modules.context import ContextBuilder
 from mibi.modules.exact_answer.llm import LlmExactAnswerModule
 from mibi.modules.ideal_answer.llm import LlmIdealAnswerModule
+from mibi.modules.joint_answer.llm import LlmJointAnswerPredictor, LlmJointExactAnswerModule, LlmJointIdealAnswerModule
 from mibi.modules.incremental import IncrementalAnswerModule
 from mibi.modules.independent import IndependentAnswerModule
 from mibi.modules.mock import MockDocumentsModule, MockExactAnswerModule, MockIdealAnswerModule, MockSnippetsModule
 from mibi.modules.standard import RetrieveThenGenerateAnswerModule, GenerateThenRetrieveAnswerModule, RetrieveThenGenerateThenRetrieveAnswerModule, GenerateThenRetrieveThenGenerateAnswerModule
+from mibi.stage_cache import StageCache
 from mibi.utils.language_models import init_language_model_clients
+from mibi.utils.rate_limiting import RateLimiter
+from mibi.utils.resilience import ResiliencePolicy
+from mibi.utils.registry import model_registry
 
 
 def build_answer_module(
@@ -42,11 +51,76 @@ def build_answer_module(
     elasticsearch_username: str | None,
     elasticsearch_password: str | None,
     elasticsearch_index: str | None,
+    reranker_inference_backend: Literal[
+        "torch",
+        "torch-int8",
+    ] = "torch",
+    pairwise_strategy: Literal[
+        "all-pairs",
+        "sliding-window",
+    ] = "all-pairs",
+    pairwise_cutoff: int = 5,
+    pairwise_window_size: int = 4,
+    pairwise_stride: int = 2,
+    pairwise_max_comparisons: int | None = None,
+    pairwise_skip_margin: float | None = None,
+    preload_models: bool = False,
+    stage_cache_path: Path | None = None,
+    llm_cache_path: Path | None = None,
+    llm_cache_ttl: timedelta | None = None,
+    llm_cache_max_size: int | None = None,
+    constrained_decoding: bool = False,
+    context_token_budget: int | None = None,
+    joint_llm_answers: bool = False,
+    llm_timeout: float | None = None,
+    llm_max_retries: int = 0,
+    hedge_llm_requests: bool = False,
+    local_llm_inference_backend: Literal[
+        "torch",
+        "torch-int8",
+    ] = "torch",
+    local_llm_max_batch_size: int = 8,
+    rate_limits_config_path: Path | None = None,
+    max_planning_calls: int | None = 10,
+    draft_language_model_name: str | None = None,
+    draft_samples: int = 3,
+    draft_confidence: float = 1.0,
+    cascade_question_types: Iterable[QuestionType] = ("yesno", "factoid"),
+    stream_ideal_answers: bool = False,
+    ideal_answer_max_sentences: int | None = 3,
+    ideal_answer_max_tokens: int | None = None,
+    instrument_llm: bool = False,
 ) -> AnswerModule:
     print("Build answer module.")
 
+    # Load rate limits.
+    rate_limiter: RateLimiter | None = None
+    if rate_limits_config_path is not None:
+        rate_limiter = RateLimiter.from_config(rate_limits_config_path)
+        if rate_limiter is not None:
+            print(f"Sharing rate limits at: {rate_limiter.path}")
+
+    # Configure timeouts, retries, and hedging of language model requests.
+    resilience_policy: ResiliencePolicy | None = None
+    if llm_timeout is not None or llm_max_retries > 0 or hedge_llm_requests:
+        resilience_policy = ResiliencePolicy(
+            timeout=llm_timeout,
+            max_retries=llm_max_retries,
+            hedge_quantile=0.95 if hedge_llm_requests else None,
+        )
+
     # Init language models.
-    init_language_model_clients(language_model_name)
+    init_language_model_clients(
+        language_model_name=language_model_name,
+        cache_path=llm_cache_path,
+        cache_ttl=llm_cache_ttl,
+        cache_max_size=llm_cache_max_size,
+        instrument=instrument_llm,
+        rate_limiter=rate_limiter,
+        resilience_policy=resilience_policy,
+        local_inference_backend=local_llm_inference_backend,
+        local_max_batch_size=local_llm_max_batch_size,
+    )
 
     # Create documents module.
     documents_module: DocumentsModule
@@ -64,7 +138,10 @@ def build_answer_module(
             elasticsearch_username=elasticsearch_username,
             elasticsearch_password=elasticsearch_password,
             elasticsearch_index=elasticsearch_index,
+            rate_limiter=rate_limiter,
         )
+        if preload_models:
+            pipeline.preload()
         documents_module = PyTerrierDocumentsModule(pipeline)
     else:
         raise ValueError("Unknown documents module type.")
@@ -80,22 +157,59 @@ def build_answer_module(
         from mibi.modules.snippets.pyterrier import PyTerrierSnippetsModule
         if elasticsearch_url is None or elasticsearch_index is None:
             raise ValueError("Must provide Elasticsearch URL and index.")
+        if pairwise_strategy == "sliding-window" and \
+                pairwise_stride >= pairwise_window_size:
+            raise ValueError(
+                "Pairwise stride must be smaller than the window size.")
         pipeline = SnippetsPipeline(
             elasticsearch_url=elasticsearch_url,
             elasticsearch_username=elasticsearch_username,
             elasticsearch_password=elasticsearch_password,
             elasticsearch_index=elasticsearch_index,
+            pairwise_strategy=pairwise_strategy,
+            pairwise_cutoff=pairwise_cutoff,
+            pairwise_window_size=pairwise_window_size,
+            pairwise_stride=pairwise_stride,
+            pairwise_max_comparisons=pairwise_max_comparisons,
+            pairwise_skip_margin=pairwise_skip_margin,
+            inference_backend=reranker_inference_backend,
+            rate_limiter=rate_limiter,
         )
+        if preload_models:
+            pipeline.preload()
         snippets_module = PyTerrierSnippetsModule(pipeline)
     else:
         raise ValueError("Unknown snippets module type.")
 
+    # Create context builders for the LLM modules.
+    exact_answer_context_builder: ContextBuilder | None = None
+    ideal_answer_context_builder: ContextBuilder | None = None
+    if context_token_budget is not None:
+        print(
+            f"Packing LLM contexts into {context_token_budget} tokens "
+            f"(counted for '{language_model_name}').")
+        exact_answer_context_builder = ContextBuilder(
+            language_model_name=language_model_name,
+            token_budget=context_token_budget,
+        )
+        ideal_answer_context_builder = ContextBuilder(
+            language_model_name=language_model_name,
+            token_budget=context_token_budget,
+        )
+
     # Create exact answer module.
     exact_answer_module: ExactAnswerModule
     if exact_answer_module_type == "mock":
         exact_answer_module = MockExactAnswerModule()
     elif exact_answer_module_type == "llm":
-        exact_answer_module = LlmExactAnswerModule()
+        exact_answer_module = LlmExactAnswerModule(
+            constrained_decoding=constrained_decoding,
+            context_builder=exact_answer_context_builder,
+            draft_language_model_name=draft_language_model_name,
+            cascade_question_types=cascade_question_types,
+            draft_samples=draft_samples,
+            draft_confidence=draft_confidence,
+        )
     else:
         raise ValueError("Unknown exact answer module type.")
 
@@ -104,10 +218,33 @@ def build_answer_module(
     if ideal_answer_module_type == "mock":
         ideal_answer_module = MockIdealAnswerModule()
     elif exact_answer_module_type == "llm":
-        ideal_answer_module = LlmIdealAnswerModule()
+        ideal_answer_module = LlmIdealAnswerModule(
+            context_builder=ideal_answer_context_builder,
+            streaming=stream_ideal_answers,
+            max_sentences=ideal_answer_max_sentences,
+            max_tokens=ideal_answer_max_tokens,
+        )
     else:
         raise ValueError("Unknown ideal answer module type.")
 
+    # Replace the LLM exact and ideal answer modules by a joint prediction.
+    if joint_llm_answers:
+        if exact_answer_module_type != "llm" or ideal_answer_module_type != "llm":
+            raise ValueError(
+                "Joint answers require the LLM exact and ideal answer modules.")
+        print("Predicting exact and ideal answers jointly.")
+        joint_answer_predictor = LlmJointAnswerPredictor(
+            context_builder=exact_answer_context_builder,
+        )
+        exact_answer_module = LlmJointExactAnswerModule(joint_answer_predictor)
+        ideal_answer_module = LlmJointIdealAnswerModule(joint_answer_predictor)
+
+    # Create stage cache.
+    stage_cache: StageCache | None = None
+    if stage_cache_path is not None:
+        print(f"Caching stage outputs at: {stage_cache_path}")
+        stage_cache = StageCache(stage_cache_path)
+
     # Assemble full answer module.
     answer_module: AnswerModule
     if answer_module_type in ("retrieve-then-generate", "rtg"):
@@ -116,6 +253,7 @@ def build_answer_module(
             snippets_module=snippets_module,
             exact_answer_module=exact_answer_module,
             ideal_answer_module=ideal_answer_module,
+            stage_cache=stage_cache,
         )
     elif answer_module_type in ("generate-then-retrieve", "gtr"):
         answer_module = GenerateThenRetrieveAnswerModule(
@@ -123,6 +261,7 @@ def build_answer_module(
             snippets_module=snippets_module,
             exact_answer_module=exact_answer_module,
             ideal_answer_module=ideal_answer_module,
+            stage_cache=stage_cache,
         )
     elif answer_module_type in ("retrieve-then-generate-then-retrieve", "rtgtr"):
         answer_module = RetrieveThenGenerateThenRetrieveAnswerModule(
@@ -130,6 +269,7 @@ def build_answer_module(
             snippets_module=snippets_module,
             exact_answer_module=exact_answer_module,
             ideal_answer_module=ideal_answer_module,
+            stage_cache=stage_cache,
         )
     elif answer_module_type in ("generate-retrieve-then-generate", "gtrtg"):
         answer_module = GenerateThenRetrieveThenGenerateAnswerModule(
@@ -137,6 +277,7 @@ def build_answer_module(
             snippets_module=snippets_module,
             exact_answer_module=exact_answer_module,
             ideal_answer_module=ideal_answer_module,
+            stage_cache=stage_cache,
         )
     elif answer_module_type == "incremental":
         answer_module = IncrementalAnswerModule(
@@ -144,6 +285,8 @@ def build_answer_module(
             snippets_module=snippets_module,
             exact_answer_module=exact_answer_module,
             ideal_answer_module=ideal_answer_module,
+            stage_cache=stage_cache,
+            max_planning_calls=max_planning_calls,
         )
     elif answer_module_type == "independent":
         answer_module = IndependentAnswerModule(
@@ -154,4 +297,12 @@ def build_answer_module(
         )
     else:
         raise ValueError("Unknown documents module type.")
+
+    if preload_models:
+        for key, memory in model_registry.memory_usage().items():
+            if memory is not None:
+                print(f"Loaded model '{key}' ({memory / 1024 ** 2:.1f} MiB).")
+            else:
+                print(f"Loaded model '{key}'.")
+
     return answer_module
@@ -0,0 +1,176 @@
+from dataclasses import dataclass, field
+from re import compile as re_compile
+from threading import Lock
+from typing import Any, Sequence
+
+from mibi.utils.token_counting import TokenCounter, token_counter
+
+
+_WORD_PATTERN = re_compile(r"\w+")
+
+
+def _shingles(text: str, size: int = 3) -> frozenset[tuple[str, ...]]:
+    words = _WORD_PATTERN.findall(text.lower())
+    if len(words) < size:
+        return frozenset((tuple(words),))
+    return frozenset(
+        tuple(words[index:index + size])
+        for index in range(len(words) - size + 1)
+    )
+
+
+def _similarity(
+    shingles: frozenset[tuple[str, ...]],
+    other_shingles: frozenset[tuple[str, ...]],
+) -> float:
+    union = len(shingles | other_shingles)
+    if union == 0:
+        return 1
+    return len(shingles & other_shingles) / union
+
+
+@dataclass(frozen=True)
+class PackedContext:
+    texts: Sequence[str]
+    num_tokens: int
+    num_duplicates: int
+    num_over_budget: int
+
+
+def pack_context(
+    texts: Sequence[str],
+    count_tokens: TokenCounter,
+    token_budget: int | None = None,
+    duplicate_threshold: float = 0.8,
+) -> PackedContext:
+    """
+    Pack the texts into a context in the given order, i.e., highest-ranked first.
+    Near-duplicates of already packed texts are dropped. Texts that would exceed the token budget are skipped, so that shorter, lower-ranked texts can still fill the budget.
+
+    :param texts: The texts to pack, highest-ranked first.
+    :param count_tokens: Function to count the tokens of a text.
+    :param token_budget: Maximum number of tokens of the packed texts, or `None` for no limit.
+    :param duplicate_threshold: Minimum Jaccard similarity (of word trigrams) to a packed text for a text to be dropped as a near-duplicate.
+    """
+    packed_texts: list[str] = []
+    packed_shingles: list[frozenset[tuple[str, ...]]] = []
+    num_tokens = 0
+    num_duplicates = 0
+    num_over_budget = 0
+    for text in texts:
+        shingles = _shingles(text)
+        if any(
+            _similarity(shingles, other_shingles) >= duplicate_threshold
+            for other_shingles in packed_shingles
+        ):
+            num_duplicates += 1
+            continue
+        text_tokens = count_tokens(text)
+        if token_budget is not None and num_tokens + text_tokens > token_budget:
+            num_over_budget += 1
+            continue
+        packed_texts.append(text)
+        packed_shingles.append(shingles)
+        num_tokens += text_tokens
+    return PackedContext(
+        texts=packed_texts,
+        num_tokens=num_tokens,
+        num_duplicates=num_duplicates,
+        num_over_budget=num_over_budget,
+    )
+
+
+@dataclass(frozen=True)
+class ContextStats:
+    contexts: int
+    tokens: int
+    token_budget: int | None
+    duplicates: int
+    over_budget: int
+
+    @property
+    def mean_tokens(self) -> float:
+        if self.contexts == 0:
+            return 0
+        return self.tokens / self.contexts
+
+    def __str__(self) -> str:
+        budget = (
+            f"{self.token_budget} tokens"
+            if self.token_budget is not None else "unlimited"
+        )
+        return (
+            f"{self.contexts} contexts, {self.mean_tokens:.0f} tokens "
+            f"on average (budget: {budget}), {self.duplicates} "
+            f"near-duplicates dropped, {self.over_budget} texts over budget"
+        )
+
+
+class _ContextCounter:
+    _stats: ContextStats
+    _lock: Lock
+
+    def __init__(self, token_budget: int | None) -> None:
+        self._stats = ContextStats(0, 0, token_budget, 0, 0)
+        self._lock = Lock()
+
+    def add(self, context: PackedContext) -> None:
+        with self._lock:
+            self._stats = ContextStats(
+                contexts=self._stats.contexts + 1,
+                tokens=self._stats.tokens + context.num_tokens,
+                token_budget=self._stats.token_budget,
+                duplicates=self._stats.duplicates + context.num_duplicates,
+                over_budget=self._stats.over_budget + context.num_over_budget,
+            )
+
+    @property
+    def stats(self) -> ContextStats:
+        with self._lock:
+            return self._stats
+
+    def __getstate__(self) -> dict[str, Any]:
+        # Locks cannot be pickled or copied.
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+
+@dataclass(frozen=True)
+class ContextBuilder:
+    """
+    Build LLM contexts within a token budget, counted with the language model's tokenizer, and without near-duplicate texts.
+    """
+
+    language_model_name: str
+    token_budget: int | None = None
+    duplicate_threshold: float = 0.8
+    _counter: _ContextCounter = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(
+            self, "_counter", _ContextCounter(self.token_budget))
+
+    @property
+    def stats(self) -> ContextStats:
+        """
+        Number of contexts built, tokens used, and texts dropped.
+        """
+        return self._counter.stats
+
+    def build(self, texts: Sequence[str]) -> list[str]:
+        """
+        Pack the texts, highest-ranked first, into a context.
+        """
+        context = pack_context(
+            texts=texts,
+            count_tokens=token_counter(self.language_model_name),
+            token_budget=self.token_budget,
+            duplicate_threshold=self.duplicate_threshold,
+        )
+        self._counter.add(context)
+        return list(context.texts)
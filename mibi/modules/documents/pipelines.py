@@ -1,14 +1,12 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from functools import cached_property
 from typing import Any, Hashable
-from warnings import catch_warnings, simplefilter
 from elasticsearch7_dsl.query import Query, Match, Exists, Nested, Bool, Terms
 from pandas import DataFrame, Series
 from pyterrier.transformer import Transformer
 from pyterrier.text import MaxPassage
 from pyterrier.apply import query
 from pyterrier_caching import DbmRetrieverCache
-from spacy import load as spacy_load
 from spacy.language import Language
 
 from mibi import PROJECT_DIR
@@ -16,6 +14,8 @@ from mibi.modules.documents.pubmed import Article
 from mibi.utils.elasticsearch import elasticsearch_connection
 from mibi.utils.elasticsearch_pyterrier import ElasticsearchTransformer
 from mibi.utils.pyterrier import ExportDocumentsTransformer, MaybeDePassager
+from mibi.utils.rate_limiting import RateLimiter
+from mibi.utils.spacy import spacy_language
 
 
 _DISALLOWED_PUBLICATION_TYPES = [
@@ -55,9 +55,7 @@ def build_query(row: dict[Hashable, Any]) -> Query:
     # TODO: Rank based on the query type.
     # query_type = str(row["query_type"])
 
-    with catch_warnings():
-        simplefilter(action="ignore", category=FutureWarning)
-        language: Language = spacy_load("en_core_sci_sm")
+    language: Language = spacy_language("en_core_sci_sm")
     doc = language(query)
 
     query_stop_words_removed = " ".join(
@@ -139,6 +137,8 @@ class DocumentsPipeline(Transformer):
     elasticsearch_username: str | None
     elasticsearch_password: str | None
     elasticsearch_index: str | None
+    rate_limiter: RateLimiter | None = field(
+        default=None, repr=False, compare=False)
 
     @cached_property
     def _pipeline(self) -> Transformer:
@@ -159,6 +159,7 @@ class DocumentsPipeline(Transformer):
                 elasticsearch_url=self.elasticsearch_url,
                 elasticsearch_username=self.elasticsearch_username,
                 elasticsearch_password=self.elasticsearch_password,
+                rate_limiter=self.rate_limiter,
             ),
             query_builder=build_query,
             result_builder=build_result,
@@ -181,5 +182,9 @@ class DocumentsPipeline(Transformer):
 
         return pipeline
 
+    def preload(self) -> None:
+        spacy_language("en_core_sci_sm")
+        self._pipeline  # Building the pipeline loads its models.
+
     def transform(self, topics_or_res: DataFrame) -> DataFrame:
         return self._pipeline.transform(topics_or_res)
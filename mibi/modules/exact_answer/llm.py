@@ -1,15 +1,24 @@
-from typing import Annotated, Sequence, TypeAlias, cast
+from collections import Counter
+from dataclasses import dataclass
+from threading import Lock
+from time import perf_counter
+from typing import Annotated, Any, Hashable, Iterable, Sequence, TypeAlias, cast
 from typing_extensions import TypedDict
-from warnings import catch_warnings, simplefilter, warn
+from warnings import warn
 
 from annotated_types import Len
-from dspy import Signature, Prediction, InputField, OutputField, TypedPredictor
-from pydantic import AfterValidator, Field
-from spacy import load as spacy_load
-from spacy.language import Language
-
-from mibi.model import ListExactAnswerItem, PartiallyAnsweredQuestion, Question, PartialAnswer, YesNoExactAnswer, FactoidExactAnswer, ListExactAnswer
+from dsp import LM
+from dspy import Signature, Prediction, InputField, OutputField, TypedPredictor, settings as dspy_settings
+from pydantic import AfterValidator, Field, TypeAdapter
+from requests import RequestException
+from spacy.tokenizer import Tokenizer
+
+from mibi.model import ListExactAnswerItem, PartiallyAnsweredQuestion, Question, PartialAnswer, QuestionType, YesNoExactAnswer, FactoidExactAnswer, ListExactAnswer
+from mibi.modules.context import ContextBuilder, ContextStats
 from mibi.modules.helpers import AutoExactAnswerModule
+from mibi.utils.language_models import CountingLM, init_draft_language_model, with_json_schema, with_kwargs
+from mibi.utils.registry import model_registry
+from mibi.utils.spacy import spacy_tokenizer
 
 
 Context: TypeAlias = list[str]
@@ -68,19 +77,18 @@ class FactoidInput(TypedDict):
 
 
 def _check_short_answer(value: str) -> str:
-    with catch_warnings():
-        simplefilter(action="ignore", category=FutureWarning)
-        language: Language = spacy_load("en_core_sci_sm")
-    doc = language(value)
+    # Only tokenize, as running the full pipeline is slow.
+    tokenizer: Tokenizer = spacy_tokenizer("en_core_sci_sm")
+    doc = tokenizer(value)
 
-    num_tokens = sum(1 for _ in doc)
+    num_tokens = len(doc)
     if num_tokens > 5:
         raise ValueError("Must not be longer than 5 words.")
 
     return value
 
 
-_ShortFactoidExactAnswer: TypeAlias = Annotated[
+ShortFactoidExactAnswer: TypeAlias = Annotated[
     FactoidExactAnswer,
     AfterValidator(_check_short_answer),
 ]
@@ -88,7 +96,7 @@ _ShortFactoidExactAnswer: TypeAlias = Annotated[
 
 class FactoidOutput(TypedDict):
     answer: Annotated[
-        _ShortFactoidExactAnswer,
+        ShortFactoidExactAnswer,
         Field(
             description="The factoid answer to the given question. The answer should contain just the name of the entity, number, or other similar short expression sought by the question, not a complete sentence.",
         ),
@@ -123,20 +131,20 @@ class ListInput(TypedDict):
     ]
 
 
-_ShortListExactAnswerItem: TypeAlias = Annotated[
+ShortListExactAnswerItem: TypeAlias = Annotated[
     ListExactAnswerItem,
     AfterValidator(_check_short_answer),
 ]
 
-_ShortListExactAnswer: TypeAlias = Annotated[
-    Sequence[_ShortListExactAnswerItem],
+ShortListExactAnswer: TypeAlias = Annotated[
+    Sequence[ShortListExactAnswerItem],
     Len(min_length=2),
 ]
 
 
 class ListOutput(TypedDict):
     answer: Annotated[
-        _ShortListExactAnswer,
+        ShortListExactAnswer,
         Field(
             description="The list answer to the given question. The answer should contain up to 5 short names of the entities sought by the question.",
         ),
@@ -156,12 +164,246 @@ class ListPredict(Signature):
     ]
 
 
+@dataclass(frozen=True)
+class PredictionStats:
+    predictions: int
+    attempts: int
+    failures: int
+
+    @property
+    def retries(self) -> int:
+        return self.attempts - self.predictions
+
+    def __str__(self) -> str:
+        return (
+            f"{self.predictions} predictions, {self.retries} retries, "
+            f"{self.failures} failures"
+        )
+
+
+class _PredictionCounter:
+    _stats: dict[QuestionType, PredictionStats]
+    _lock: Lock
+
+    def __init__(self) -> None:
+        self._stats = {}
+        self._lock = Lock()
+
+    def add(self, question_type: QuestionType, attempts: int, failed: bool) -> None:
+        with self._lock:
+            stats = self._stats.get(
+                question_type, PredictionStats(0, 0, 0))
+            self._stats[question_type] = PredictionStats(
+                predictions=stats.predictions + 1,
+                attempts=stats.attempts + attempts,
+                failures=stats.failures + (1 if failed else 0),
+            )
+
+    @property
+    def stats(self) -> dict[QuestionType, PredictionStats]:
+        with self._lock:
+            return dict(self._stats)
+
+    def __getstate__(self) -> dict[str, Any]:
+        # Locks cannot be pickled or copied.
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+
+@dataclass(frozen=True)
+class CascadeStats:
+    drafts: int
+    escalations: int
+    draft_seconds: float
+    verify_seconds: float
+    draft_tokens: int
+    verify_tokens: int
+
+    @property
+    def accepted(self) -> int:
+        """
+        Number of drafted answers accepted without the large language model.
+        """
+        return self.drafts - self.escalations
+
+    @property
+    def escalation_rate(self) -> float:
+        if self.drafts == 0:
+            return 0
+        return self.escalations / self.drafts
+
+    @property
+    def mean_verify_seconds(self) -> float:
+        if self.escalations == 0:
+            return 0
+        return self.verify_seconds / self.escalations
+
+    @property
+    def saved_seconds(self) -> float:
+        """
+        Estimated latency saved, i.e., the large language model's mean latency for each accepted draft, minus the time spent drafting.
+        """
+        return self.accepted * self.mean_verify_seconds - self.draft_seconds
+
+    @property
+    def mean_verify_tokens(self) -> float:
+        if self.escalations == 0:
+            return 0
+        return self.verify_tokens / self.escalations
+
+    @property
+    def saved_tokens(self) -> float:
+        """
+        Estimated large language model tokens saved compared to always using the large language model, i.e., its mean token usage for each accepted draft. Tokens are only known if reported by the backend.
+        """
+        return self.accepted * self.mean_verify_tokens
+
+    def __str__(self) -> str:
+        return (
+            f"{self.drafts} drafts, {self.escalations} escalated "
+            f"({self.escalation_rate:.0%} escalation rate), "
+            f"{self.accepted} large model predictions saved, "
+            f"{self.saved_seconds:.1f} s saved "
+            f"({self.draft_seconds:.1f} s drafting), "
+            f"{self.saved_tokens:.0f} large model tokens saved "
+            f"({self.draft_tokens} draft tokens)"
+        )
+
+
+class _CascadeCounter:
+    _stats: dict[QuestionType, CascadeStats]
+    _lock: Lock
+
+    def __init__(self) -> None:
+        self._stats = {}
+        self._lock = Lock()
+
+    def add(
+        self,
+        question_type: QuestionType,
+        draft_seconds: float,
+        draft_tokens: int,
+        verify_seconds: float | None,
+        verify_tokens: int = 0,
+    ) -> None:
+        """
+        :param verify_seconds: Time spent by the large language model, or `None` if the draft was accepted.
+        :param verify_tokens: Tokens used by the large language model.
+        """
+        with self._lock:
+            stats = self._stats.get(
+                question_type, CascadeStats(0, 0, 0, 0, 0, 0))
+            self._stats[question_type] = CascadeStats(
+                drafts=stats.drafts + 1,
+                escalations=stats.escalations +
+                (1 if verify_seconds is not None else 0),
+                draft_seconds=stats.draft_seconds + draft_seconds,
+                verify_seconds=stats.verify_seconds +
+                (verify_seconds if verify_seconds is not None else 0),
+                draft_tokens=stats.draft_tokens + draft_tokens,
+                verify_tokens=stats.verify_tokens + verify_tokens,
+            )
+
+    @property
+    def stats(self) -> dict[QuestionType, CascadeStats]:
+        with self._lock:
+            return dict(self._stats)
+
+    def __getstate__(self) -> dict[str, Any]:
+        # Locks cannot be pickled or copied.
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+
+def _answer_key(answer: str | Sequence[str]) -> Hashable:
+    # Compare answers regardless of case, whitespace, and list order.
+    if isinstance(answer, str):
+        return " ".join(answer.casefold().split())
+    return tuple(sorted({
+        cast(str, _answer_key(item))
+        for item in answer
+    }))
+
+
+def majority_answer(
+    answers: Iterable[str | Sequence[str] | None],
+    num_samples: int,
+) -> tuple[int | None, float]:
+    """
+    Find the most frequent of the sampled answers (self-consistency).
+    Return the index of a sample with that answer (or `None` if no sample has an answer) and the confidence, i.e., the share of all samples that agree on that answer.
+
+    :param answers: The sampled answers, or `None` for samples that failed.
+    :param num_samples: Number of samples, including failed samples.
+    """
+    indices: dict[Hashable, int] = {}
+    votes: Counter[Hashable] = Counter()
+    for index, answer in enumerate(answers):
+        if answer is None:
+            continue
+        key = _answer_key(answer)
+        indices.setdefault(key, index)
+        votes[key] += 1
+    if len(votes) == 0 or num_samples == 0:
+        return None, 0
+    key, count = votes.most_common(1)[0]
+    return indices[key], count / num_samples
+
+
 class LlmExactAnswerModule(AutoExactAnswerModule):
+    """
+    Find exact answers with typed LLM predictions. Predictions that do not validate are retried (with the validation error as feedback).
+
+    With constrained decoding, the LLM's output is constrained to the output type's JSON schema (for OpenAI chat models and Ollama), so that most outputs are valid on the first attempt. Constraints not expressible as a JSON schema (e.g., the answer length in words) are still only validated.
+
+    With a draft language model, answers to the cascaded question types are first drafted by sampling several answers from the small (local) language model in one request. If enough samples agree on the answer, that answer is used. Otherwise, or if the draft language model fails, the question is escalated to the (large) default language model.
+    """
+
     _yes_no_predict: TypedPredictor
     _factoid_predict: TypedPredictor
     _list_predict: TypedPredictor
-
-    def __init__(self):
+    _constrained_decoding: bool
+    _context_builder: ContextBuilder | None
+    _draft_language_model_name: str | None
+    _cascade_question_types: tuple[QuestionType, ...]
+    _draft_samples: int
+    _draft_confidence: float
+    _counter: _PredictionCounter
+    _cascade_counter: _CascadeCounter
+
+    def __init__(
+        self,
+        constrained_decoding: bool = False,
+        context_builder: ContextBuilder | None = None,
+        draft_language_model_name: str | None = None,
+        cascade_question_types: Iterable[QuestionType] = ("yesno", "factoid"),
+        draft_samples: int = 3,
+        draft_confidence: float = 1.0,
+    ):
+        """
+        :param draft_language_model_name: Name of the small language model to draft answers with (served by Ollama if `OLLAMA_API_BASE` is set, or run with Hugging Face otherwise), or `None` to not draft answers.
+        :param cascade_question_types: Question types whose answers are drafted.
+        :param draft_samples: Number of drafted answers to sample per question.
+        :param draft_confidence: Minimum share of the samples that must agree on the answer for the draft to be accepted.
+        """
+        self._constrained_decoding = constrained_decoding
+        self._context_builder = context_builder
+        self._draft_language_model_name = draft_language_model_name
+        self._cascade_question_types = tuple(sorted(set(cascade_question_types)))
+        self._draft_samples = draft_samples
+        self._draft_confidence = draft_confidence
+        self._counter = _PredictionCounter()
+        self._cascade_counter = _CascadeCounter()
         self._yes_no_predict = TypedPredictor(
             signature=YesNoPredict,
             max_retries=3,
@@ -175,6 +417,144 @@ class LlmExactAnswerModule(AutoExactAnswerModule):
             max_retries=10,
         )
 
+    @property
+    def prediction_stats(self) -> dict[QuestionType, PredictionStats]:
+        """
+        Number of predictions, LLM attempts (including retries), and failures per question type.
+        """
+        return self._counter.stats
+
+    @property
+    def cascade_stats(self) -> dict[QuestionType, CascadeStats] | None:
+        """
+        Number of drafted and escalated answers, and time and tokens spent and saved per question type, if answers are drafted.
+        """
+        if self._draft_language_model_name is None:
+            return None
+        return self._cascade_counter.stats
+
+    def _constrain(self, lm: LM, output_type: type) -> LM:
+        if self._constrained_decoding:
+            lm = with_json_schema(
+                lm=lm,
+                name=output_type.__name__,
+                json_schema=TypeAdapter(output_type).json_schema(),
+            )
+        return lm
+
+    def _predict(
+            self,
+            question_type: QuestionType,
+            predict: TypedPredictor,
+            output_type: type,
+            input: Any,
+    ) -> Prediction:
+        if (
+            self._draft_language_model_name is None or
+            question_type not in self._cascade_question_types
+        ):
+            return self._verify(question_type, predict, output_type, input)
+
+        start = perf_counter()
+        draft_lm = CountingLM(self._draft_lm(output_type))
+        draft = self._draft(predict, input, draft_lm)
+        draft_seconds = perf_counter() - start
+        if draft is not None:
+            self._cascade_counter.add(
+                question_type,
+                draft_seconds,
+                draft_lm.num_tokens,
+                verify_seconds=None,
+            )
+            return draft
+
+        start = perf_counter()
+        counting_lm = CountingLM(
+            self._constrain(dspy_settings.lm, output_type))
+        try:
+            return self._verify(
+                question_type, predict, output_type, input, counting_lm)
+        finally:
+            self._cascade_counter.add(
+                question_type,
+                draft_seconds,
+                draft_lm.num_tokens,
+                perf_counter() - start,
+                counting_lm.num_tokens,
+            )
+
+    def _draft_lm(self, output_type: type) -> LM:
+        draft_language_model_name = self._draft_language_model_name
+        assert draft_language_model_name is not None
+        draft_lm: LM = model_registry.get(
+            f"draft-lm:{draft_language_model_name}",
+            # Wrap the draft language model like the default language model (e.g., with the same rate limiter).
+            lambda: init_draft_language_model(
+                draft_language_model_name, dspy_settings.lm),
+        )
+        draft_lm = self._constrain(draft_lm, output_type)
+        # Sample all answers in one request, which is cached as a whole.
+        return with_kwargs(
+            draft_lm, n=self._draft_samples, temperature=0.7)
+
+    def _draft(
+            self,
+            predict: TypedPredictor,
+            input: Any,
+            draft_lm: LM,
+    ) -> Prediction | None:
+        """
+        Sample answers from the draft language model and return the majority prediction if it is confident enough, or `None` otherwise (i.e., if the samples disagree, are invalid, or the draft language model fails).
+        """
+        try:
+            with dspy_settings.context(lm=draft_lm):
+                prediction: Prediction = predict.forward(input=input)
+        except ValueError:
+            return None
+        except (RequestException, TimeoutError) as e:
+            warn(RuntimeWarning(
+                "Could not draft answer, escalating to the default language model.", e))
+            return None
+        outputs = prediction.completions["output"]
+        majority_index, confidence = majority_answer(
+            answers=(output["answer"] for output in outputs),
+            num_samples=self._draft_samples,
+        )
+        if majority_index is None or confidence < self._draft_confidence:
+            return None
+        return Prediction(output=outputs[majority_index])
+
+    def _verify(
+            self,
+            question_type: QuestionType,
+            predict: TypedPredictor,
+            output_type: type,
+            input: Any,
+            counting_lm: CountingLM | None = None,
+    ) -> Prediction:
+        if counting_lm is None:
+            counting_lm = CountingLM(
+                self._constrain(dspy_settings.lm, output_type))
+        try:
+            with dspy_settings.context(lm=counting_lm):
+                prediction = predict.forward(input=input)
+        except ValueError:
+            self._counter.add(
+                question_type, counting_lm.num_requests, failed=True)
+            raise
+        self._counter.add(
+            question_type, counting_lm.num_requests, failed=False)
+        return prediction
+
+    @property
+    def context_stats(self) -> ContextStats | None:
+        """
+        Statistics of the contexts built, if a context builder is used.
+        """
+        if self._context_builder is None:
+            return None
+        return self._context_builder.stats
+
     def _context(
             self,
             question: Question,
@@ -195,6 +575,8 @@ class LlmExactAnswerModule(AutoExactAnswerModule):
                 for snippet in partially_answered_question.snippets
             ]
         # TODO: Extract context from document.
+        if self._context_builder is not None:
+            context = self._context_builder.build(context)
         return context
 
     def forward_yes_no(
@@ -207,7 +589,12 @@ class LlmExactAnswerModule(AutoExactAnswerModule):
             context=self._context(question, partial_answer)
         )
         try:
-            prediction: Prediction = self._yes_no_predict.forward(input=input)
+            prediction: Prediction = self._predict(
+                question_type="yesno",
+                predict=self._yes_no_predict,
+                output_type=YesNoOutput,
+                input=input,
+            )
         except ValueError as e:
             warn(RuntimeWarning(
                 f"Could not find yes-no answer to question: {question.body}", e))
@@ -226,7 +613,12 @@ class LlmExactAnswerModule(AutoExactAnswerModule):
             context=self._context(question, partial_answer)
         )
         try:
-            prediction: Prediction = self._factoid_predict.forward(input=input)
+            prediction: Prediction = self._predict(
+                question_type="factoid",
+                predict=self._factoid_predict,
+                output_type=FactoidOutput,
+                input=input,
+            )
         except ValueError as e:
             warn(RuntimeWarning(
                 f"Could not find factoid answer to question: {question.body}", e))
@@ -246,7 +638,12 @@ class LlmExactAnswerModule(AutoExactAnswerModule):
             context=self._context(question, partial_answer)
         )
         try:
-            prediction: Prediction = self._list_predict.forward(input=input)
+            prediction: Prediction = self._predict(
+                question_type="list",
+                predict=self._list_predict,
+                output_type=ListOutput,
+                input=input,
+            )
         except ValueError as e:
             warn(RuntimeWarning(
                 f"Could not find list answer to question: {question.body}", e))
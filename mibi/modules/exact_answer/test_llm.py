@@ -0,0 +1,96 @@
+from json import dumps
+from typing import Any
+
+from dsp import LM
+from pydantic import TypeAdapter, ValidationError
+from pytest import raises, warns
+from requests import ConnectionError as RequestsConnectionError
+
+from mibi.modules.exact_answer.llm import CascadeStats, FactoidOutput, ListOutput, LlmExactAnswerModule, YesNoInput, majority_answer
+
+
+def test_factoid_output_short_answer() -> None:
+    adapter = TypeAdapter(FactoidOutput)
+    assert adapter.validate_python({"answer": "bladder cancer"}) == {
+        "answer": "bladder cancer",
+    }
+    with raises(ValidationError):
+        adapter.validate_python({
+            "answer": "The BCG vaccine is used for bladder cancer.",
+        })
+
+
+def test_list_output_short_answer() -> None:
+    adapter = TypeAdapter(ListOutput)
+    output = adapter.validate_python({
+        "answer": ["bladder cancer", "melanoma"],
+    })
+    assert list(output["answer"]) == ["bladder cancer", "melanoma"]
+    with raises(ValidationError):
+        adapter.validate_python({
+            "answer": ["bladder cancer", "a very long list item with many words"],
+        })
+
+
+def test_majority_answer() -> None:
+    assert majority_answer(["yes", "Yes ", "no"], num_samples=3) == (0, 2 / 3)
+    assert majority_answer(
+        [["B", "a"], None, ["a", "b"]],
+        num_samples=3,
+    ) == (0, 2 / 3)
+    assert majority_answer([None, None], num_samples=2) == (None, 0)
+
+
+def test_cascade_stats_saved_tokens() -> None:
+    stats = CascadeStats(
+        drafts=4,
+        escalations=1,
+        draft_seconds=1,
+        verify_seconds=2,
+        draft_tokens=100,
+        verify_tokens=500,
+    )
+    assert stats.accepted == 3
+    assert stats.saved_tokens == 1500
+    assert "1500 large model tokens saved" in str(stats)
+
+
+class _DraftLM(LM):
+    def __init__(self, answers: list[str], healthy: bool = True) -> None:
+        super().__init__(model="test")
+        self.answers = answers
+        self.healthy = healthy
+
+    def basic_request(self, prompt: str, **kwargs) -> Any:
+        raise NotImplementedError()
+
+    def __call__(self, prompt: str, only_completed: bool = True, return_sorted: bool = False, **kwargs) -> list[Any]:
+        if not self.healthy:
+            raise RequestsConnectionError("Connection refused.")
+        return [dumps({"answer": answer}) for answer in self.answers]
+
+
+def test_draft_majority_answer() -> None:
+    module = LlmExactAnswerModule(
+        draft_language_model_name="test",
+        draft_samples=3,
+        draft_confidence=0.6,
+    )
+    input = YesNoInput(question="Is BCG used for bladder cancer?", context=[])
+    draft = module._draft(
+        module._yes_no_predict, input, _DraftLM(["yes", "no", "yes"]))
+    assert draft is not None
+    assert draft.output["answer"] == "yes"
+    draft = module._draft(
+        module._yes_no_predict, input, _DraftLM(["yes", "no", "no"]))
+    assert draft is not None
+    assert draft.output["answer"] == "no"
+
+
+def test_draft_escalates_on_backend_error() -> None:
+    module = LlmExactAnswerModule(draft_language_model_name="test")
+    input = YesNoInput(question="Is BCG used for bladder cancer?", context=[])
+    with warns(RuntimeWarning):
+        draft = module._draft(
+            module._yes_no_predict, input, _DraftLM([], healthy=False))
+    assert draft is None
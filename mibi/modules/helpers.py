@@ -1,6 +1,8 @@
 from abc import abstractmethod
+from typing import Sequence
 from mibi.model import Question, PartialAnswer, ExactAnswer, YesNoExactAnswer, FactoidExactAnswer, ListExactAnswer, SummaryExactAnswer, NOT_AVAILABLE
 from mibi.modules import ABCModule, ExactAnswerModule
+from mibi.utils.concurrency import map_concurrently
 
 
 class AutoExactAnswerModule(ExactAnswerModule, ABCModule):
@@ -20,6 +22,35 @@ class AutoExactAnswerModule(ExactAnswerModule, ABCModule):
         else:
             raise ValueError(f"Unknown question type: {question.type}")
 
+    def forward_batch(
+        self,
+        questions: Sequence[Question],
+        partial_answers: Sequence[PartialAnswer],
+    ) -> Sequence[ExactAnswer | Exception]:
+        # Group the questions by type, so that requests with the same prompt (prefix) are sent together.
+        indices_by_type: dict[str, list[int]] = {}
+        for index, question in enumerate(questions):
+            indices_by_type.setdefault(question.type, []).append(index)
+        groups = list(indices_by_type.values())
+        forward_batch = super().forward_batch
+        answers: list[ExactAnswer | Exception] = [
+            RuntimeError("Question not answered.")
+        ] * len(questions)
+        # Answer the groups concurrently.
+        for indices, type_answers in zip(groups, map_concurrently(
+            lambda indices: forward_batch(
+                [questions[index] for index in indices],
+                [partial_answers[index] for index in indices],
+            ),
+            groups,
+            concurrency=max(1, len(groups)),
+        )):
+            if isinstance(type_answers, Exception):
+                type_answers = [type_answers] * len(indices)
+            for index, answer in zip(indices, type_answers):
+                answers[index] = answer
+        return answers
+
     @abstractmethod
     def forward_yes_no(
         self,
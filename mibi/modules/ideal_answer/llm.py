@@ -1,11 +1,13 @@
 from typing import Annotated, TypeAlias, cast
 from typing_extensions import TypedDict
 from warnings import warn
-from dspy import Signature, Prediction, InputField, OutputField, TypedPredictor
+from dspy import Signature, Prediction, InputField, OutputField, TypedPredictor, settings as dspy_settings
 from pydantic import Field
 
 from mibi.model import PartiallyAnsweredQuestion, Question, PartialAnswer, IdealAnswer
 from mibi.modules import IdealAnswerModule
+from mibi.modules.context import ContextBuilder, ContextStats
+from mibi.utils.language_models import with_streaming
 
 
 Context: TypeAlias = list[str]
@@ -42,14 +44,49 @@ class IdealPredict(Signature):
 
 
 class LlmIdealAnswerModule(IdealAnswerModule):
+    """
+    Find ideal answers with typed LLM predictions.
+
+    With streaming, the LLM's output is parsed while it is generated, and the generation is stopped as soon as the answer is complete or exceeds the maximum number of sentences (for OpenAI chat models and Ollama).
+    """
+
     _ideal_predict: TypedPredictor
+    _context_builder: ContextBuilder | None
+    _streaming: bool
+    _max_sentences: int | None
+    _max_tokens: int | None
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        context_builder: ContextBuilder | None = None,
+        streaming: bool = False,
+        max_sentences: int | None = 3,
+        max_tokens: int | None = None,
+    ) -> None:
+        """
+        :param context_builder: Builder to pack the context into a token budget.
+        :param streaming: Whether to stream the LLM's output and stop the generation early.
+        :param max_sentences: Maximum number of sentences of streamed answers.
+        :param max_tokens: Maximum number of tokens to generate for streamed answers.
+        """
+        self._context_builder = context_builder
+        self._streaming = streaming
+        self._max_sentences = max_sentences
+        self._max_tokens = max_tokens
         self._ideal_predict = TypedPredictor(
             signature=IdealPredict,
             max_retries=3,
         )
 
+    @property
+    def context_stats(self) -> ContextStats | None:
+        """
+        Statistics of the contexts built, if a context builder is used.
+        """
+        if self._context_builder is None:
+            return None
+        return self._context_builder.stats
+
     def _context(
         self,
         question: Question,
@@ -70,8 +107,22 @@ class LlmIdealAnswerModule(IdealAnswerModule):
                 for snippet in partially_answered_question.snippets
             ]
         # TODO: Extract context from document.
+        if self._context_builder is not None:
+            context = self._context_builder.build(context)
         return context
 
+    def _predict(self, input: IdealInput) -> Prediction:
+        if not self._streaming:
+            return self._ideal_predict.forward(input=input)
+        lm = with_streaming(
+            lm=dspy_settings.lm,
+            field="answer",
+            max_sentences=self._max_sentences,
+            max_tokens=self._max_tokens,
+        )
+        with dspy_settings.context(lm=lm):
+            return self._ideal_predict.forward(input=input)
+
     def forward(
         self,
         question: Question,
@@ -82,7 +133,7 @@ class LlmIdealAnswerModule(IdealAnswerModule):
             context=self._context(question, partial_answer)
         )
         try:
-            prediction: Prediction = self._ideal_predict.forward(input=input)
+            prediction: Prediction = self._predict(input)
         except ValueError as e:
             warn(RuntimeWarning(
                 f"Could not find ideal answer to question: {question.body}", e))
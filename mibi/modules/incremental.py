@@ -1,15 +1,15 @@
+from dataclasses import dataclass
 from random import choice
-from typing import Annotated, Literal, Sequence, TypeAlias, cast
+from threading import Lock
+from typing import Annotated, Any, Literal, Sequence, TypeAlias, cast
 from typing_extensions import TypedDict
 from warnings import warn
 from dspy import Signature, Prediction, InputField, OutputField, TypedPredictor
 from pydantic import Field
-from pyrate_limiter.limiter import Limiter
-from pyrate_limiter import Rate, Duration
 from mibi.builder import AnswerBuilder
 from mibi.model import Question, Answer, QuestionType
 from mibi.modules import AnswerModule, DocumentsModule, SnippetsModule, ExactAnswerModule, IdealAnswerModule
-from mibi.utils.rate_limiting import rate_limit
+from mibi.stage_cache import StageCache
 
 
 Task: TypeAlias = Literal[
@@ -90,18 +90,131 @@ class NextTaskPredict(Signature):
     output: NextTaskOutput = OutputField()
 
 
+PlanningSource: TypeAlias = Literal[
+    "forced",
+    "cached",
+    "llm",
+    "capped",
+]
+
+
+_TASK_ORDER: Sequence[Task] = (
+    'retrieve documents',
+    'retrieve snippets',
+    'generate exact answer',
+    'generate summary answer',
+    'none',
+)
+
+
+_PlanningState: TypeAlias = tuple[
+    QuestionType,
+    bool,
+    tuple[tuple[Task, bool], ...],
+]
+
+
+@dataclass(frozen=True)
+class PlanningStats:
+    forced: int
+    cached: int
+    llm: int
+    capped: int
+
+    @property
+    def steps(self) -> int:
+        return self.forced + self.cached + self.llm + self.capped
+
+    def __str__(self) -> str:
+        return (
+            f"{self.steps} planning steps, {self.llm} LLM calls, "
+            f"{self.forced} forced, {self.cached} cached, "
+            f"{self.capped} over the call limit"
+        )
+
+
+class _PlanningCounter:
+    _stats: PlanningStats
+    _lock: Lock
+
+    def __init__(self) -> None:
+        self._stats = PlanningStats(0, 0, 0, 0)
+        self._lock = Lock()
+
+    def add(self, source: PlanningSource) -> None:
+        with self._lock:
+            self._stats = PlanningStats(
+                forced=self._stats.forced + (1 if source == "forced" else 0),
+                cached=self._stats.cached + (1 if source == "cached" else 0),
+                llm=self._stats.llm + (1 if source == "llm" else 0),
+                capped=self._stats.capped + (1 if source == "capped" else 0),
+            )
+
+    @property
+    def stats(self) -> PlanningStats:
+        with self._lock:
+            return self._stats
+
+    def __getstate__(self) -> dict[str, Any]:
+        # Locks cannot be pickled or copied.
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+
+class _PlanningDecisions:
+    """
+    The LLM's planning decisions by question type and history (and whether the answer is ready).
+    """
+
+    _decisions: dict[_PlanningState, Task]
+    _lock: Lock
+
+    def __init__(self) -> None:
+        self._decisions = {}
+        self._lock = Lock()
+
+    def get(self, state: _PlanningState) -> Task | None:
+        with self._lock:
+            return self._decisions.get(state)
+
+    def put(self, state: _PlanningState, task: Task) -> None:
+        with self._lock:
+            self._decisions[state] = task
+
+    def __getstate__(self) -> dict[str, Any]:
+        # Locks cannot be pickled or copied.
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+
 class IncrementalAnswerModule(AnswerModule):
     """
     Incrementally build the full answer by asking the LLM which
     part of the answer (i.e., documents, snippets, exact answer,
     or ideal answer) to make next.
+
+    The LLM is only asked if the next task is not forced, i.e., if more than one task is allowed and the answer is not complete yet. The LLM's decisions are reused for questions of the same type with the same history. After the maximum number of LLM calls per question, the remaining tasks are run in the default order.
     """
 
     _documents_module: DocumentsModule
     _snippets_module: SnippetsModule
     _exact_answer_module: ExactAnswerModule
     _ideal_answer_module: IdealAnswerModule
+    _stage_cache: StageCache | None
+    _max_planning_calls: int | None
     _next_task_predict: TypedPredictor
+    _decisions: _PlanningDecisions
+    _counter: _PlanningCounter
 
     def __init__(
         self,
@@ -109,11 +222,20 @@ class IncrementalAnswerModule(AnswerModule):
         snippets_module: SnippetsModule,
         exact_answer_module: ExactAnswerModule,
         ideal_answer_module: IdealAnswerModule,
+        stage_cache: StageCache | None = None,
+        max_planning_calls: int | None = 10,
     ) -> None:
+        """
+        :param max_planning_calls: Maximum number of LLM calls to plan the tasks of a question, or `None` for no limit.
+        """
         self._documents_module = documents_module
         self._snippets_module = snippets_module
         self._exact_answer_module = exact_answer_module
         self._ideal_answer_module = ideal_answer_module
+        self._stage_cache = stage_cache
+        self._max_planning_calls = max_planning_calls
+        self._decisions = _PlanningDecisions()
+        self._counter = _PlanningCounter()
         self._next_task_predict = TypedPredictor(
             signature=NextTaskPredict,
             max_retries=3,
@@ -152,16 +274,71 @@ class IncrementalAnswerModule(AnswerModule):
         ]
         return tasks
 
-    @rate_limit(Limiter([
-        Rate(limit=1, interval=Duration.SECOND),
-        Rate(limit=500, interval=Duration.HOUR),
-    ], raise_when_fail=False))
+    @property
+    def planning_stats(self) -> PlanningStats:
+        """
+        Number of planning steps by how the next task was chosen.
+        """
+        return self._counter.stats
+
+    def _forced_task(
+        self,
+        builder: AnswerBuilder,
+        history: Sequence[HistoryItem],
+    ) -> Task | None:
+        allowed_tasks = self._allowed_tasks(builder, history)
+        if len(allowed_tasks) == 1:
+            return allowed_tasks[0]
+        if builder.is_ready and "none" in allowed_tasks:
+            # All parts of the answer are made, so the answer can be returned.
+            return "none"
+        return None
+
+    def _default_task(
+        self,
+        builder: AnswerBuilder,
+        history: Sequence[HistoryItem],
+    ) -> Task:
+        allowed_tasks = self._allowed_tasks(builder, history)
+        undone_tasks = self._undone_tasks(builder, history)
+        for task in _TASK_ORDER:
+            if task in undone_tasks:
+                return task
+        for task in _TASK_ORDER:
+            if task in allowed_tasks:
+                return task
+        raise RuntimeError("No task is allowed.")
+
+    def _predict_next_task(self, input: NextTaskInput, **kwargs) -> Task:
+        prediction: Prediction = self._next_task_predict.forward(
+            input=input, **kwargs)
+        output = cast(NextTaskOutput, prediction.output)
+        return output["task"]
+
     def _next_task(
         self,
         builder: AnswerBuilder,
         history: Sequence[HistoryItem],
+        num_planning_calls: int,
         **kwargs,
-    ) -> Task:
+    ) -> tuple[Task, PlanningSource]:
+        forced_task = self._forced_task(builder, history)
+        if forced_task is not None:
+            return forced_task, "forced"
+
+        state: _PlanningState = (
+            builder.question.type,
+            builder.is_ready,
+            tuple((item["task"], item["successful"]) for item in history),
+        )
+        cached_task = self._decisions.get(state)
+        if cached_task is not None:
+            return cached_task, "cached"
+
+        if self._max_planning_calls is not None and \
+                num_planning_calls >= self._max_planning_calls:
+            return self._default_task(builder, history), "capped"
+
         input = NextTaskInput(
             question=builder.question.body,
             question_type=builder.question.type,
@@ -169,21 +346,30 @@ class IncrementalAnswerModule(AnswerModule):
             allowed_tasks=self._allowed_tasks(builder, history),
             undone_tasks=self._undone_tasks(builder, history),
         )
-        prediction: Prediction = self._next_task_predict.forward(
-            input=input, **kwargs)
-        output = cast(NextTaskOutput, prediction.output)
-        return output["task"]
+        task = self._predict_next_task(input, **kwargs)
+        self._decisions.put(state, task)
+        return task, "llm"
 
     def _run_next_task(
         self,
         builder: AnswerBuilder,
         history: Sequence[HistoryItem],
-    ) -> HistoryItem | None:
-        task = self._next_task(
+        num_planning_calls: int,
+    ) -> tuple[HistoryItem | None, PlanningSource]:
+        task, source = self._next_task(
             builder=builder,
             history=history,
+            num_planning_calls=num_planning_calls,
         )
+        self._counter.add(source)
+        return self._run_task(builder, history, task), source
 
+    def _run_task(
+        self,
+        builder: AnswerBuilder,
+        history: Sequence[HistoryItem],
+        task: Task,
+    ) -> HistoryItem | None:
         if len(history) > 5 and \
                 all(not item["successful"] for item in history[-5:]):
             warn("Selecting a new task failed 5 times in a row.")
@@ -228,15 +414,20 @@ class IncrementalAnswerModule(AnswerModule):
             snippets_module=self._snippets_module,
             exact_answer_module=self._exact_answer_module,
             ideal_answer_module=self._ideal_answer_module,
+            stage_cache=self._stage_cache,
         )
         history: list[HistoryItem] = []
+        num_planning_calls = 0
         while not (builder.is_ready and
                    len(history) > 0 and
                    history[-1]["task"] == "none"):
-            history_item = self._run_next_task(
+            history_item, source = self._run_next_task(
                 builder=builder,
                 history=history,
+                num_planning_calls=num_planning_calls,
             )
+            if source == "llm":
+                num_planning_calls += 1
             if history_item is None:
                 break
             history.append(history_item)
@@ -1,29 +1,59 @@
-from dataclasses import dataclass
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field
 
 from mibi.model import PartialAnswer, Question, Answer
 from mibi.modules import AnswerModule, DocumentsModule, SnippetsModule, ExactAnswerModule, IdealAnswerModule
+from mibi.utils.concurrency import with_dspy_settings
 
 
 @dataclass(frozen=True)
 class IndependentAnswerModule(AnswerModule):
     """
-    Build the full answer by independently retrieving documents, snippets, finding the exact answer, and the ideal answer. The result of neither task depends on one another.
+    Build the full answer by independently retrieving documents, snippets, finding the exact answer, and the ideal answer. The result of neither task depends on one another, so all four tasks are run concurrently.
+
+    The tasks are submitted to the given executor, or to a new thread pool per question if no executor is given. Do not pass the executor that runs the questions themselves (e.g., from `mibi run --concurrency`): a question would then block a worker while waiting for its tasks, which can deadlock once all workers wait.
     """
 
     documents_module: DocumentsModule
     snippets_module: SnippetsModule
     exact_answer_module: ExactAnswerModule
     ideal_answer_module: IdealAnswerModule
+    executor: Executor | None = field(default=None, repr=False)
 
     def forward(self, question: Question) -> Answer:
         empty_answer = PartialAnswer()
-        documents = self.documents_module.forward(question, empty_answer)
-        snippets = self.snippets_module.forward(question, empty_answer)
-        exact_answer = self.exact_answer_module.forward(question, empty_answer)
-        ideal_answer = self.ideal_answer_module.forward(question, empty_answer)
-        return Answer(
-            documents=documents,
-            snippets=snippets,
-            exact_answer=exact_answer,
-            ideal_answer=ideal_answer,
-        )
+        with (
+            nullcontext(self.executor)
+            if self.executor is not None
+            else ThreadPoolExecutor(
+                max_workers=4,
+                thread_name_prefix="mibi-independent",
+            )
+        ) as executor:
+            documents = executor.submit(
+                with_dspy_settings(self.documents_module.forward),
+                question,
+                empty_answer,
+            )
+            snippets = executor.submit(
+                with_dspy_settings(self.snippets_module.forward),
+                question,
+                empty_answer,
+            )
+            exact_answer = executor.submit(
+                with_dspy_settings(self.exact_answer_module.forward),
+                question,
+                empty_answer,
+            )
+            ideal_answer = executor.submit(
+                with_dspy_settings(self.ideal_answer_module.forward),
+                question,
+                empty_answer,
+            )
+            return Answer(
+                documents=documents.result(),
+                snippets=snippets.result(),
+                exact_answer=exact_answer.result(),
+                ideal_answer=ideal_answer.result(),
+            )
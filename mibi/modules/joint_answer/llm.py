@@ -0,0 +1,372 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from threading import Lock
+from typing import Annotated, Any, Hashable, TypeAlias, cast
+from typing_extensions import TypedDict
+from warnings import warn
+
+from dspy import Module, Signature, Prediction, InputField, OutputField, TypedPredictor
+from pydantic import Field
+
+from mibi.model import NOT_AVAILABLE, ExactAnswer, IdealAnswer, PartiallyAnsweredQuestion, Question, PartialAnswer, QuestionType, YesNoExactAnswer
+from mibi.modules import ExactAnswerModule, IdealAnswerModule
+from mibi.modules.context import ContextBuilder, ContextStats
+from mibi.modules.exact_answer.llm import ShortFactoidExactAnswer, ShortListExactAnswer
+
+
+Context: TypeAlias = list[str]
+
+
+class JointInput(TypedDict):
+    question: Annotated[
+        str,
+        Field(
+            description="The question that should be answered.",
+        ),
+    ]
+    context: Annotated[
+        Context,
+        Field(
+            description="Context that should be used to answer the question.",
+        ),
+    ]
+
+
+_IDEAL_ANSWER_DESCRIPTION = "The long-form answer to the question consisting of 1 to 3 sentence that also contains a short explanation. The answer should be grammatically correct, concise, and precise."
+
+
+class YesNoJointOutput(TypedDict):
+    exact_answer: Annotated[
+        YesNoExactAnswer,
+        Field(
+            description="The yes-no answer to the given question.",
+        ),
+    ]
+    ideal_answer: Annotated[
+        str,
+        Field(
+            description=_IDEAL_ANSWER_DESCRIPTION,
+        ),
+    ]
+
+
+class FactoidJointOutput(TypedDict):
+    exact_answer: Annotated[
+        ShortFactoidExactAnswer,
+        Field(
+            description="The factoid answer to the given question. The answer should contain just the name of the entity, number, or other similar short expression sought by the question, not a complete sentence.",
+        ),
+    ]
+    ideal_answer: Annotated[
+        str,
+        Field(
+            description=_IDEAL_ANSWER_DESCRIPTION,
+        ),
+    ]
+
+
+class ListJointOutput(TypedDict):
+    exact_answer: Annotated[
+        ShortListExactAnswer,
+        Field(
+            description="The list answer to the given question. The answer should contain up to 5 short names of the entities sought by the question.",
+        ),
+    ]
+    ideal_answer: Annotated[
+        str,
+        Field(
+            description=_IDEAL_ANSWER_DESCRIPTION,
+        ),
+    ]
+
+
+class SummaryJointOutput(TypedDict):
+    ideal_answer: Annotated[
+        str,
+        Field(
+            description=_IDEAL_ANSWER_DESCRIPTION,
+        ),
+    ]
+
+
+class YesNoJointPredict(Signature):
+    """Answer the medical yes-no question based on the given context (from a relevant medical abstract), basic medical knowledge, and current standard practices from medical guidelines, both with a yes-no answer and with a long-form answer. The answers should be based mostly on the given context if it is factually correct."""
+
+    input: Annotated[
+        JointInput,
+        InputField(),
+    ]
+    output: Annotated[
+        YesNoJointOutput,
+        OutputField(),
+    ]
+
+
+class FactoidJointPredict(Signature):
+    """Answer the medical factoid question based on the given context (from a relevant medical abstract), basic medical knowledge, and current standard practices from medical guidelines, both with a short factoid answer and with a long-form answer. The answers should be based mostly on the given context if it is factually correct."""
+
+    input: Annotated[
+        JointInput,
+        InputField(),
+    ]
+    output: Annotated[
+        FactoidJointOutput,
+        OutputField(),
+    ]
+
+
+class ListJointPredict(Signature):
+    """Answer the medical list question based on the given context (from a relevant medical abstract), basic medical knowledge, and current standard practices from medical guidelines, both with a list of short answers and with a long-form answer. The answers should be based mostly on the given context if it is factually correct."""
+
+    input: Annotated[
+        JointInput,
+        InputField(),
+    ]
+    output: Annotated[
+        ListJointOutput,
+        OutputField(),
+    ]
+
+
+class SummaryJointPredict(Signature):
+    """Answer the medical question based on the given context (from a relevant medical abstract), basic medical knowledge, and current standard practices from medical guidelines. The answer should be based mostly on the given context if it is factually correct."""
+
+    input: Annotated[
+        JointInput,
+        InputField(),
+    ]
+    output: Annotated[
+        SummaryJointOutput,
+        OutputField(),
+    ]
+
+
+@dataclass(frozen=True)
+class JointAnswer:
+    exact_answer: ExactAnswer
+    ideal_answer: IdealAnswer
+
+
+@dataclass(frozen=True)
+class JointAnswerStats:
+    predictions: int
+    shared: int
+
+    def __str__(self) -> str:
+        return f"{self.predictions} predictions, {self.shared} shared"
+
+
+class LlmJointAnswerPredictor(Module):
+    """
+    Predict the exact and the ideal answer to a question in a single LLM call with a combined structured output.
+    Requests for the same question and context (e.g., from the exact and ideal answer modules running concurrently) share one prediction, so the shared context is only sent once.
+    """
+
+    _yes_no_predict: TypedPredictor
+    _factoid_predict: TypedPredictor
+    _list_predict: TypedPredictor
+    _summary_predict: TypedPredictor
+    _context_builder: ContextBuilder | None
+    _max_shared: int
+    _lock: Lock
+    _predictions: OrderedDict[Hashable, Future[JointAnswer]]
+    _num_predictions: int
+    _num_shared: int
+
+    def __init__(
+        self,
+        context_builder: ContextBuilder | None = None,
+        max_shared: int = 1024,
+    ) -> None:
+        """
+        :param context_builder: Builder to pack the context into a token budget.
+        :param max_shared: Maximum number of recent predictions kept for sharing.
+        """
+        self._context_builder = context_builder
+        self._max_shared = max_shared
+        self._lock = Lock()
+        self._predictions = OrderedDict()
+        self._num_predictions = 0
+        self._num_shared = 0
+        self._yes_no_predict = TypedPredictor(
+            signature=YesNoJointPredict,
+            max_retries=3,
+        )
+        self._factoid_predict = TypedPredictor(
+            signature=FactoidJointPredict,
+            max_retries=5,
+        )
+        self._list_predict = TypedPredictor(
+            signature=ListJointPredict,
+            max_retries=10,
+        )
+        self._summary_predict = TypedPredictor(
+            signature=SummaryJointPredict,
+            max_retries=3,
+        )
+
+    @property
+    def stats(self) -> JointAnswerStats:
+        """
+        Number of LLM predictions and of requests that shared an earlier prediction.
+        """
+        with self._lock:
+            return JointAnswerStats(
+                predictions=self._num_predictions,
+                shared=self._num_shared,
+            )
+
+    @property
+    def context_stats(self) -> ContextStats | None:
+        """
+        Statistics of the contexts built, if a context builder is used.
+        """
+        if self._context_builder is None:
+            return None
+        return self._context_builder.stats
+
+    def __getstate__(self) -> dict[str, Any]:
+        # Locks and pending predictions cannot be pickled or copied.
+        state = self.__dict__.copy()
+        del state["_lock"]
+        del state["_predictions"]
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = Lock()
+        self._predictions = OrderedDict()
+
+    def _context(
+        self,
+        question: Question,
+        partial_answer: PartialAnswer,
+    ) -> Context:
+        partially_answered_question = PartiallyAnsweredQuestion.from_question(
+            question, partial_answer)
+
+        context = []
+
+        if partially_answered_question.exact_answer_text is not None:
+            context += [partially_answered_question.exact_answer_text]
+        if partially_answered_question.ideal_answer is not None:
+            context += [partially_answered_question.ideal_answer]
+        if partially_answered_question.snippets is not None:
+            context += [
+                snippet.text
+                for snippet in partially_answered_question.snippets
+            ]
+        if self._context_builder is not None:
+            context = self._context_builder.build(context)
+        return context
+
+    def _predictor(self, question_type: QuestionType) -> TypedPredictor:
+        if question_type == "yesno":
+            return self._yes_no_predict
+        elif question_type == "factoid":
+            return self._factoid_predict
+        elif question_type == "list":
+            return self._list_predict
+        elif question_type == "summary":
+            return self._summary_predict
+        else:
+            raise ValueError(f"Unknown question type: {question_type}")
+
+    def _fallback(self, question_type: QuestionType) -> JointAnswer:
+        exact_answer: ExactAnswer
+        if question_type == "yesno":
+            exact_answer = "no"
+        elif question_type == "factoid":
+            exact_answer = ""
+        elif question_type == "list":
+            exact_answer = []
+        else:
+            exact_answer = NOT_AVAILABLE
+        return JointAnswer(exact_answer=exact_answer, ideal_answer="")
+
+    def _predict(self, question: Question, context: Context) -> JointAnswer:
+        input = JointInput(
+            question=question.body,
+            context=context,
+        )
+        try:
+            prediction: Prediction = self._predictor(
+                question.type).forward(input=input)
+        except ValueError as e:
+            warn(RuntimeWarning(
+                f"Could not find answers to question: {question.body}", e))
+            warn("Falling back to empty answers.")
+            return self._fallback(question.type)
+        output = cast(dict[str, Any], prediction.output)
+        return JointAnswer(
+            exact_answer=output.get("exact_answer", NOT_AVAILABLE),
+            ideal_answer=output["ideal_answer"],
+        )
+
+    def predict(
+        self,
+        question: Question,
+        partial_answer: PartialAnswer,
+    ) -> JointAnswer:
+        context = self._context(question, partial_answer)
+        key = (question.id, question.type, question.body, tuple(context))
+        with self._lock:
+            future = self._predictions.get(key)
+            is_owner = future is None
+            if future is None:
+                future = Future()
+                self._predictions[key] = future
+                self._num_predictions += 1
+                while len(self._predictions) > self._max_shared:
+                    self._predictions.popitem(last=False)
+            else:
+                self._predictions.move_to_end(key)
+                self._num_shared += 1
+        if is_owner:
+            try:
+                future.set_result(self._predict(question, context))
+            except BaseException as e:
+                # Do not share failed predictions.
+                with self._lock:
+                    if self._predictions.get(key) is future:
+                        del self._predictions[key]
+                future.set_exception(e)
+                raise
+        return future.result()
+
+
+class LlmJointExactAnswerModule(ExactAnswerModule):
+    """
+    Find the exact answer with a joint LLM prediction of the exact and ideal answer.
+    """
+
+    _predictor: LlmJointAnswerPredictor
+
+    def __init__(self, predictor: LlmJointAnswerPredictor) -> None:
+        self._predictor = predictor
+
+    def forward(
+        self,
+        question: Question,
+        partial_answer: PartialAnswer,
+    ) -> ExactAnswer:
+        return self._predictor.predict(question, partial_answer).exact_answer
+
+
+class LlmJointIdealAnswerModule(IdealAnswerModule):
+    """
+    Find the ideal answer with a joint LLM prediction of the exact and ideal answer.
+    """
+
+    _predictor: LlmJointAnswerPredictor
+
+    def __init__(self, predictor: LlmJointAnswerPredictor) -> None:
+        self._predictor = predictor
+
+    def forward(
+        self,
+        question: Question,
+        partial_answer: PartialAnswer,
+    ) -> IdealAnswer:
+        return self._predictor.predict(question, partial_answer).ideal_answer
@@ -0,0 +1,51 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from mibi.model import PartialAnswer, Question
+from mibi.modules.joint_answer.llm import Context, JointAnswer, LlmJointAnswerPredictor, LlmJointExactAnswerModule, LlmJointIdealAnswerModule
+
+
+_QUESTION = Question(
+    id="6415c252690f196b51000012",
+    type="yesno",
+    body="Is the BCG vaccine used for bladder cancer?",
+)
+
+
+class _FixedJointAnswerPredictor(LlmJointAnswerPredictor):
+    calls: int
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.calls = 0
+
+    def _predict(self, question: Question, context: Context) -> JointAnswer:
+        self.calls += 1
+        return JointAnswer(
+            exact_answer="yes",
+            ideal_answer="Yes, the BCG vaccine is used for bladder cancer.",
+        )
+
+
+def test_joint_answer_shared() -> None:
+    predictor = _FixedJointAnswerPredictor()
+    exact_answer_module = LlmJointExactAnswerModule(predictor)
+    ideal_answer_module = LlmJointIdealAnswerModule(predictor)
+    partial_answer = PartialAnswer()
+    with ThreadPoolExecutor(2) as executor:
+        exact_answer = executor.submit(
+            exact_answer_module.forward, _QUESTION, partial_answer)
+        ideal_answer = executor.submit(
+            ideal_answer_module.forward, _QUESTION, partial_answer)
+        assert exact_answer.result() == "yes"
+        assert ideal_answer.result().startswith("Yes")
+    assert predictor.calls == 1
+    assert predictor.stats.predictions == 1
+    assert predictor.stats.shared == 1
+
+
+def test_joint_answer_different_context() -> None:
+    predictor = _FixedJointAnswerPredictor()
+    LlmJointExactAnswerModule(predictor).forward(_QUESTION, PartialAnswer())
+    LlmJointIdealAnswerModule(predictor).forward(
+        _QUESTION, PartialAnswer(ideal_answer="Yes."))
+    assert predictor.calls == 2
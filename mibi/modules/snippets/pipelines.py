@@ -1,5 +1,6 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from functools import cached_property
+from typing import Literal
 from warnings import catch_warnings, filterwarnings
 from pandas import DataFrame
 from pyterrier.batchretrieve import TextScorer
@@ -14,7 +15,66 @@ from mibi.modules.documents.pubmed import Article
 from mibi.modules.snippets.pyterrier import FixOffsetDtype, PubMedSentencePassager
 from mibi.utils.elasticsearch import elasticsearch_connection
 from mibi.utils.elasticsearch_pyterrier import ElasticsearchGet, ElasticsearchRerank
-from mibi.utils.pyterrier import CachableTransformer, CutoffRerank, ExportSnippetsTransformer, MaybePassager, WithDocumentIds
+from mibi.utils.pyterrier import CachableTransformer, Cascade, CascadeStage, ExportSnippetsTransformer, MaybePassager, SlidingWindowPairwiseRerank, WithDocumentIds
+from mibi.utils.quantization import InferenceBackend, with_inference_backend
+from mibi.utils.rate_limiting import RateLimiter
+from mibi.utils.registry import model_registry
+from mibi.utils.spacy import spacy_language
+
+
+def build_pointwise_reranker(
+    model_name: str,
+    inference_backend: InferenceBackend = "torch",
+) -> Transformer | None:
+    pointwise_reranker: Transformer | None
+    if "monot5" in model_name:
+        pointwise_reranker = MonoT5ReRanker(
+            model=model_name, verbose=True)
+    elif ("tas-b" in model_name or
+          "tas_b" in model_name):
+        with catch_warnings():
+            filterwarnings(
+                action="ignore", message="TypedStorage is deprecated", category=UserWarning)
+            pointwise_reranker = TasB(
+                model_name=model_name, verbose=True)
+    elif ("tct-colbert" in model_name or
+          "tct_colbert" in model_name):
+        pointwise_reranker = TctColBert(
+            model_name=model_name, verbose=True)
+    elif "ance" in model_name:
+        pointwise_reranker = Ance(
+            model_name=model_name, verbose=True)
+    else:
+        pointwise_reranker = None
+    if pointwise_reranker is not None:
+        pointwise_reranker = with_inference_backend(
+            reranker=pointwise_reranker,
+            model_name=model_name,
+            inference_backend=inference_backend,
+        )
+    return pointwise_reranker
+
+
+def build_pairwise_reranker(
+    model_name: str,
+    inference_backend: InferenceBackend = "torch",
+) -> Transformer | None:
+    pairwise_reranker: Transformer | None
+    if "duot5" in model_name:
+        with catch_warnings():
+            filterwarnings(
+                action="ignore", message="TypedStorage is deprecated", category=UserWarning)
+            pairwise_reranker = DuoT5ReRanker(
+                model=model_name, verbose=True)
+    else:
+        pairwise_reranker = None
+    if pairwise_reranker is not None:
+        pairwise_reranker = with_inference_backend(
+            reranker=pairwise_reranker,
+            model_name=model_name,
+            inference_backend=inference_backend,
+        )
+    return pairwise_reranker
 
 
 @dataclass(frozen=True)
@@ -37,6 +97,16 @@ class SnippetsPipeline(Transformer):
     pairwise_model: str = "castorini/duot5-base-msmarco"  # duoT5
     # pairwise_model: str = "castorini/duot5-3b-msmarco"  # duoT5
     # pairwise_model: str = "castorini/duot5-3b-med-msmarco"  # duoT5
+    pointwise_cutoff: int = 100
+    pairwise_strategy: Literal["all-pairs", "sliding-window"] = "all-pairs"
+    pairwise_cutoff: int = 5
+    pairwise_window_size: int = 4
+    pairwise_stride: int = 2
+    pairwise_max_comparisons: int | None = None
+    pairwise_skip_margin: float | None = None
+    inference_backend: InferenceBackend = "torch"
+    rate_limiter: RateLimiter | None = field(
+        default=None, repr=False, compare=False)
 
     @cached_property
     def _pipeline(self) -> Transformer:
@@ -53,6 +123,7 @@ class SnippetsPipeline(Transformer):
                 elasticsearch_url=self.elasticsearch_url,
                 elasticsearch_username=self.elasticsearch_username,
                 elasticsearch_password=self.elasticsearch_password,
+                rate_limiter=self.rate_limiter,
             ),
             result_builder=build_result,
             index=self.elasticsearch_index,
@@ -72,6 +143,7 @@ class SnippetsPipeline(Transformer):
                 elasticsearch_url=self.elasticsearch_url,
                 elasticsearch_username=self.elasticsearch_username,
                 elasticsearch_password=self.elasticsearch_password,
+                rate_limiter=self.rate_limiter,
             ),
             query_builder=build_query,
             index=self.elasticsearch_index,
@@ -92,49 +164,53 @@ class SnippetsPipeline(Transformer):
         # pipeline = pipeline >> bm25_scorer
 
         # Re-rank the top-100 snippets pointwise.
-        pointwise_reranker: Transformer | None
-        if "monot5" in self.pointwise_model:
-            pointwise_reranker = MonoT5ReRanker(
-                model=self.pointwise_model, verbose=True)
-        elif ("tas-b" in self.pointwise_model or
-              "tas_b" in self.pointwise_model):
-            with catch_warnings():
-                filterwarnings(
-                    action="ignore", message="TypedStorage is deprecated", category=UserWarning)
-                pointwise_reranker = TasB(
-                    model_name=self.pointwise_model, verbose=True)
-        elif ("tct-colbert" in self.pointwise_model or
-              "tct_colbert" in self.pointwise_model):
-            pointwise_reranker = TctColBert(
-                model_name=self.pointwise_model, verbose=True)
-        elif "ance" in self.pointwise_model:
-            pointwise_reranker = Ance(
-                model_name=self.pointwise_model, verbose=True)
-        else:
-            pointwise_reranker = None
+        stages: list[CascadeStage] = []
+        pointwise_reranker = model_registry.get(
+            f"pointwise:{self.pointwise_model}:{self.inference_backend}",
+            lambda: build_pointwise_reranker(
+                model_name=self.pointwise_model,
+                inference_backend=self.inference_backend,
+            ),
+        )
         if pointwise_reranker is not None:
-            pipeline = CutoffRerank(
-                candidates=pipeline,
+            stages.append(CascadeStage(
+                name="pointwise",
                 reranker=pointwise_reranker,
-                cutoff=100,
-            )
+                cutoff=self.pointwise_cutoff,
+            ))
 
-        # Re-re-rank top-5 snippets pairwise.
+        # Re-re-rank top-5 (or top-k) snippets pairwise, unless the pointwise scores are clearly separated.
         # TODO: Choose pointwise re-ranker.
-        pairwise_reranker: Transformer | None
-        if "duot5" in self.pairwise_model:
-            with catch_warnings():
-                filterwarnings(
-                    action="ignore", message="TypedStorage is deprecated", category=UserWarning)
-                pairwise_reranker = DuoT5ReRanker(
-                    model=self.pairwise_model, verbose=True)
-        else:
-            pairwise_reranker = None
+        pairwise_reranker = model_registry.get(
+            f"pairwise:{self.pairwise_model}:{self.inference_backend}",
+            lambda: build_pairwise_reranker(
+                model_name=self.pairwise_model,
+                inference_backend=self.inference_backend,
+            ),
+        )
         if pairwise_reranker is not None:
-            pipeline = CutoffRerank(
-                candidates=pipeline,
+            if self.pairwise_strategy == "sliding-window":
+                pairwise_reranker = SlidingWindowPairwiseRerank(
+                    reranker=pairwise_reranker,
+                    window_size=self.pairwise_window_size,
+                    stride=self.pairwise_stride,
+                    max_comparisons=self.pairwise_max_comparisons,
+                )
+            elif self.pairwise_strategy != "all-pairs":
+                raise ValueError(
+                    f"Unknown pairwise strategy: {self.pairwise_strategy}")
+            stages.append(CascadeStage(
+                name="pairwise",
                 reranker=pairwise_reranker,
-                cutoff=5,
+                cutoff=self.pairwise_cutoff,
+                skip_margin=self.pairwise_skip_margin,
+            ))
+
+        if len(stages) > 0:
+            pipeline = Cascade(
+                candidates=pipeline,
+                stages=tuple(stages),
+                verbose=True,
             )
 
         # TODO: Axiomatically re-rank snippets.
@@ -144,5 +220,9 @@ class SnippetsPipeline(Transformer):
 
         return pipeline
 
+    def preload(self) -> None:
+        spacy_language("en_core_sci_sm")
+        self._pipeline  # Building the pipeline loads its models.
+
     def transform(self, topics_or_res: DataFrame) -> DataFrame:
         return self._pipeline.transform(topics_or_res)
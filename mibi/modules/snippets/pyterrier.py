@@ -12,7 +12,7 @@ from pyterrier.transformer import Transformer
 
 from mibi.model import Snippet, Snippets
 from mibi.modules import SnippetsModule
-from mibi.utils.pyterrier import PyTerrierModule
+from mibi.utils.pyterrier import PyTerrierModule, passage_docno, pmids
 
 
 class PyTerrierSnippetsModule(PyTerrierModule[Snippets], SnippetsModule):
@@ -39,7 +39,7 @@ class PyTerrierSnippetsModule(PyTerrierModule[Snippets], SnippetsModule):
                     # document=Url(
                     #     f"https://pubmed.ncbi.nlm.nih.gov/{row['docno'].split('%p', maxsplit=1)[0]}"),
                     document=Url(
-                        f"http://www.ncbi.nlm.nih.gov/pubmed/{row['docno'].split('%p', maxsplit=1)[0]}"),
+                        f"http://www.ncbi.nlm.nih.gov/pubmed/{document_id}"),
                     text=row["text"],
                     begin_section=row["snippet_begin_section"],
                     offset_in_begin_section=int(
@@ -48,7 +48,7 @@ class PyTerrierSnippetsModule(PyTerrierModule[Snippets], SnippetsModule):
                     offset_in_end_section=int(
                         f"{row['snippet_offset_in_end_section']:d}"),
                 )
-                for _, row in res.iterrows()
+                for document_id, (_, row) in zip(pmids(res), res.iterrows())
             ]
         elif "url" in res.columns:
             if any(res["url"].isna()):
@@ -157,8 +157,9 @@ class PubMedSentencePassager(Transformer):
     def transform(self, topics_or_res: DataFrame) -> DataFrame:
         topics_or_res = DataFrame([
             {
-                "docno": f"{row['docno']}%p({snippet.begin_section},{snippet.offset_in_begin_section:d},{snippet.end_section},{snippet.offset_in_end_section:d})",
+                "docno": passage_docno(row["docno"], snippet),
                 **row[list(set(row.index) - {"docno", "text", "title", "abstract"})],
+                "pmid": row["docno"],
                 "text": snippet.text,
                 "snippet_begin_section": snippet.begin_section,
                 "snippet_offset_in_begin_section": snippet.offset_in_begin_section,
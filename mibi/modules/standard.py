@@ -1,16 +1,52 @@
-from dataclasses import dataclass
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from typing import Any, Callable, ClassVar, Collection, Mapping, NamedTuple, Sequence
 
 from mibi.builder import AnswerBuilder
-from mibi.model import Question, Answer
+from mibi.model import PartialAnswer, Question, Answer
 from mibi.modules import AnswerModule, DocumentsModule, SnippetsModule, ExactAnswerModule, IdealAnswerModule
+from mibi.stage_cache import StageCache, StageType
+from mibi.utils.scheduling import run_dag, topological_order
+
+
+class Stage(NamedTuple):
+    name: str
+    type: StageType
+    dependencies: tuple[str, ...] = ()
+
+
+def _snapshot(
+    partial_answer: PartialAnswer,
+    stages: Sequence[Stage],
+    names: Collection[str],
+    outputs: Mapping[str, Any],
+) -> PartialAnswer:
+    # Later stages (in topological order) override earlier stages of the same type.
+    return partial_answer.model_copy(update={
+        stage.type: outputs[stage.name]
+        for stage in stages
+        if stage.name in names
+    })
 
 
 @dataclass(frozen=True)
 class _AnswerBuilderModule(AnswerModule):
+    """
+    Build the full answer by running the strategy's stages as soon as the stages they depend on are done. Independent stages run concurrently.
+    Each stage is made from a snapshot of the partial answer that only contains the outputs of the stages it (transitively) depends on, so its input, and thus its stage cache key, does not depend on the timing of concurrent stages.
+
+    The stages are submitted to the given executor, or to a new thread pool per question if no executor is given. Do not pass the executor that runs the questions themselves (e.g., from `mibi run --concurrency`), as this can deadlock.
+    If a stage cache is given, stages are only run if no output is cached for the same inputs.
+    """
+
+    stages: ClassVar[Sequence[Stage]]
+
     documents_module: DocumentsModule
     snippets_module: SnippetsModule
     exact_answer_module: ExactAnswerModule
     ideal_answer_module: IdealAnswerModule
+    executor: Executor | None = field(default=None, repr=False)
+    stage_cache: StageCache | None = field(default=None, repr=False)
 
     def builder(self, question: Question) -> AnswerBuilder:
         return AnswerBuilder(
@@ -19,7 +55,100 @@ class _AnswerBuilderModule(AnswerModule):
             snippets_module=self.snippets_module,
             exact_answer_module=self.exact_answer_module,
             ideal_answer_module=self.ideal_answer_module,
+            stage_cache=self.stage_cache,
+        )
+
+    def _ordered_stages(self) -> Sequence[Stage]:
+        stages = {stage.name: stage for stage in self.stages}
+        return [
+            stages[name]
+            for name in topological_order(
+                tasks=stages.keys(),
+                dependencies={
+                    stage.name: stage.dependencies
+                    for stage in self.stages
+                },
+            )
+        ]
+
+    def _ancestors(self) -> Mapping[str, frozenset[str]]:
+        ancestors: dict[str, frozenset[str]] = {}
+        for stage in self._ordered_stages():
+            ancestors[stage.name] = frozenset(stage.dependencies).union(
+                *(ancestors[dependency] for dependency in stage.dependencies))
+        return ancestors
+
+    def forward(self, question: Question) -> Answer:
+        builder = self.builder(question)
+        partial_answer = builder.partial_answer
+        stages = self._ordered_stages()
+        ancestors = self._ancestors()
+        outputs: dict[str, Any] = {}
+
+        def make(stage: Stage) -> Callable[[], None]:
+            def make_stage() -> None:
+                outputs[stage.name] = builder.make(
+                    stage.type,
+                    _snapshot(
+                        partial_answer, stages, ancestors[stage.name], outputs),
+                )
+            return make_stage
+
+        run_dag(
+            tasks={
+                stage.name: make(stage)
+                for stage in self.stages
+            },
+            dependencies={
+                stage.name: stage.dependencies
+                for stage in self.stages
+            },
+            executor=self.executor,
         )
+        return builder.answer
+
+    def forward_batch(
+        self,
+        questions: Sequence[Question],
+    ) -> Sequence[Answer | Exception]:
+        """
+        Answer a batch of questions stage by stage, i.e., each stage is made for all questions at once before the next stage, using the stage modules' batched prediction.
+        If some stage fails for a question, the remaining stages are skipped for that question and the exception is returned in place of its answer.
+        """
+        builders = [self.builder(question) for question in questions]
+        partial_answers = [builder.partial_answer for builder in builders]
+        stages = self._ordered_stages()
+        ancestors = self._ancestors()
+        outputs: list[dict[str, Any]] = [{} for _ in questions]
+        errors: list[Exception | None] = [None] * len(questions)
+        for stage in stages:
+            indices = [
+                index
+                for index, error in enumerate(errors)
+                if error is None
+            ]
+            results = AnswerBuilder.make_batch(
+                builders=[builders[index] for index in indices],
+                stage=stage.type,
+                partial_answers=[
+                    _snapshot(
+                        partial_answers[index],
+                        stages,
+                        ancestors[stage.name],
+                        outputs[index],
+                    )
+                    for index in indices
+                ],
+            )
+            for index, result in zip(indices, results):
+                if isinstance(result, Exception):
+                    errors[index] = result
+                else:
+                    outputs[index][stage.name] = result
+        return [
+            builder.answer if error is None else error
+            for builder, error in zip(builders, errors)
+        ]
 
 
 class RetrieveThenGenerateAnswerModule(_AnswerBuilderModule):
@@ -27,13 +156,12 @@ class RetrieveThenGenerateAnswerModule(_AnswerBuilderModule):
     Build the full answer by first retrieving documents, then snippets, then finding the exact answer, and finally the ideal answer.
     """
 
-    def forward(self, question: Question) -> Answer:
-        builder = self.builder(question)
-        builder.make_documents()
-        builder.make_snippets()
-        builder.make_exact_answer()
-        builder.make_ideal_answer()
-        return builder.answer
+    stages = (
+        Stage("documents", "documents"),
+        Stage("snippets", "snippets", ("documents",)),
+        Stage("exact_answer", "exact_answer", ("snippets",)),
+        Stage("ideal_answer", "ideal_answer", ("exact_answer",)),
+    )
 
 
 class GenerateThenRetrieveAnswerModule(_AnswerBuilderModule):
@@ -41,13 +169,12 @@ class GenerateThenRetrieveAnswerModule(_AnswerBuilderModule):
     Build the full answer by first guessing the exact answer, then the ideal answer, then retrieving documents, and finally snippets.
     """
 
-    def forward(self, question: Question) -> Answer:
-        builder = self.builder(question)
-        builder.make_exact_answer()
-        builder.make_ideal_answer()
-        builder.make_documents()
-        builder.make_snippets()
-        return builder.answer
+    stages = (
+        Stage("exact_answer", "exact_answer"),
+        Stage("ideal_answer", "ideal_answer", ("exact_answer",)),
+        Stage("documents", "documents", ("ideal_answer",)),
+        Stage("snippets", "snippets", ("documents",)),
+    )
 
 
 class RetrieveThenGenerateThenRetrieveAnswerModule(_AnswerBuilderModule):
@@ -55,15 +182,14 @@ class RetrieveThenGenerateThenRetrieveAnswerModule(_AnswerBuilderModule):
     Build the full answer by first retrieving documents, then snippets, then finding the exact answer, and finally the ideal answer. The answers are used to again retrieve documents and snippets.
     """
 
-    def forward(self, question: Question) -> Answer:
-        builder = self.builder(question)
-        builder.make_documents()
-        builder.make_snippets()
-        builder.make_exact_answer()
-        builder.make_ideal_answer()
-        builder.make_documents()
-        builder.make_snippets()
-        return builder.answer
+    stages = (
+        Stage("documents", "documents"),
+        Stage("snippets", "snippets", ("documents",)),
+        Stage("exact_answer", "exact_answer", ("snippets",)),
+        Stage("ideal_answer", "ideal_answer", ("exact_answer",)),
+        Stage("documents_2", "documents", ("ideal_answer",)),
+        Stage("snippets_2", "snippets", ("documents_2",)),
+    )
 
 
 class GenerateThenRetrieveThenGenerateAnswerModule(_AnswerBuilderModule):
@@ -71,12 +197,11 @@ class GenerateThenRetrieveThenGenerateAnswerModule(_AnswerBuilderModule):
     Build the full answer by first guessing the exact answer, then the ideal answer, then retrieving documents, and finally snippets. The documents and snippets are used to refine the answers.
     """
 
-    def forward(self, question: Question) -> Answer:
-        builder = self.builder(question)
-        builder.make_exact_answer()
-        builder.make_ideal_answer()
-        builder.make_documents()
-        builder.make_snippets()
-        builder.make_exact_answer()
-        builder.make_ideal_answer()
-        return builder.answer
+    stages = (
+        Stage("exact_answer", "exact_answer"),
+        Stage("ideal_answer", "ideal_answer", ("exact_answer",)),
+        Stage("documents", "documents", ("ideal_answer",)),
+        Stage("snippets", "snippets", ("documents",)),
+        Stage("exact_answer_2", "exact_answer", ("snippets",)),
+        Stage("ideal_answer_2", "ideal_answer", ("exact_answer_2",)),
+    )
@@ -0,0 +1,49 @@
+from mibi.modules.context import pack_context
+
+
+def _count_words(text: str) -> int:
+    return len(text.split())
+
+
+def test_pack_context_budget() -> None:
+    context = pack_context(
+        texts=[
+            "BCG is used for bladder cancer.",
+            "The BCG vaccine was first used against tuberculosis in 1921.",
+            "BCG also treats melanoma.",
+        ],
+        count_tokens=_count_words,
+        token_budget=10,
+    )
+    # The second text does not fit, but the shorter third one does.
+    assert context.texts == [
+        "BCG is used for bladder cancer.",
+        "BCG also treats melanoma.",
+    ]
+    assert context.num_tokens == 10
+    assert context.num_over_budget == 1
+    assert context.num_duplicates == 0
+
+
+def test_pack_context_duplicates() -> None:
+    context = pack_context(
+        texts=[
+            "The BCG vaccine is used to treat bladder cancer.",
+            "The BCG vaccine is used to treat bladder cancer!",
+            "BCG also treats melanoma.",
+        ],
+        count_tokens=_count_words,
+    )
+    assert context.texts == [
+        "The BCG vaccine is used to treat bladder cancer.",
+        "BCG also treats melanoma.",
+    ]
+    assert context.num_duplicates == 1
+    assert context.num_over_budget == 0
+
+
+def test_pack_context_unlimited() -> None:
+    texts = ["foo bar", "baz qux quux"]
+    context = pack_context(texts=texts, count_tokens=_count_words)
+    assert context.texts == texts
+    assert context.num_tokens == 5
@@ -0,0 +1,54 @@
+from threading import Barrier
+
+from mibi.model import FactoidExactAnswer, ListExactAnswer, PartialAnswer, Question, YesNoExactAnswer
+from mibi.modules.helpers import AutoExactAnswerModule
+
+
+class _BarrierExactAnswerModule(AutoExactAnswerModule):
+    _barrier: Barrier
+
+    def __init__(self, barrier: Barrier) -> None:
+        self._barrier = barrier
+
+    def forward_yes_no(
+        self,
+        question: Question,
+        partial_answer: PartialAnswer,
+    ) -> YesNoExactAnswer:
+        self._barrier.wait()
+        return "yes"
+
+    def forward_factoid(
+        self,
+        question: Question,
+        partial_answer: PartialAnswer,
+    ) -> FactoidExactAnswer:
+        self._barrier.wait()
+        return "foo"
+
+    def forward_list(
+        self,
+        question: Question,
+        partial_answer: PartialAnswer,
+    ) -> ListExactAnswer:
+        raise NotImplementedError()
+
+
+def test_auto_exact_answer_module_batch_groups_concurrently() -> None:
+    questions = [
+        Question(
+            id="6415c252690f196b51000011",
+            type="factoid",
+            body="Which cancer is the BCG vaccine used for?",
+        ),
+        Question(
+            id="6415c252690f196b51000012",
+            type="yesno",
+            body="Is the BCG vaccine used for bladder cancer?",
+        ),
+    ]
+    # Both question types must be answered at the same time to pass the barrier.
+    module = _BarrierExactAnswerModule(Barrier(2, timeout=5))
+    answers = module.forward_batch(
+        questions, [PartialAnswer(), PartialAnswer()])
+    assert answers == ["foo", "yes"]
@@ -0,0 +1,30 @@
+from mibi.model import Question
+from mibi.modules.incremental import IncrementalAnswerModule, PlanningStats
+from mibi.modules.mock import MockDocumentsModule, MockSnippetsModule, MockExactAnswerModule, MockIdealAnswerModule
+
+
+_QUESTION = Question(
+    id="6415c252690f196b51000011",
+    type="factoid",
+    body="Which cancer is the BCG vaccine used for?",
+)
+
+
+def test_incremental_answer_module_without_planning_calls() -> None:
+    answer_module = IncrementalAnswerModule(
+        documents_module=MockDocumentsModule(),
+        snippets_module=MockSnippetsModule(),
+        exact_answer_module=MockExactAnswerModule(),
+        ideal_answer_module=MockIdealAnswerModule(),
+        max_planning_calls=0,
+    )
+    answer = answer_module.forward(_QUESTION)
+    assert len(answer.documents) > 0
+    assert len(answer.snippets) > 0
+    # Only returning the answer is forced.
+    assert answer_module.planning_stats == PlanningStats(
+        forced=1,
+        cached=0,
+        llm=0,
+        capped=4,
+    )
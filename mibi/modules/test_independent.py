@@ -0,0 +1,37 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from mibi.model import Question
+from mibi.modules.independent import IndependentAnswerModule
+from mibi.modules.mock import MockDocumentsModule, MockSnippetsModule, MockExactAnswerModule, MockIdealAnswerModule
+
+
+_QUESTION = Question(
+    id="6415c252690f196b51000011",
+    type="factoid",
+    body="Which cancer is the BCG vaccine used for?",
+)
+
+
+def _answer_module(
+    executor: ThreadPoolExecutor | None = None,
+) -> IndependentAnswerModule:
+    return IndependentAnswerModule(
+        documents_module=MockDocumentsModule(),
+        snippets_module=MockSnippetsModule(),
+        exact_answer_module=MockExactAnswerModule(),
+        ideal_answer_module=MockIdealAnswerModule(),
+        executor=executor,
+    )
+
+
+def test_independent_answer_module() -> None:
+    answer = _answer_module().forward(_QUESTION)
+    assert len(answer.documents) > 0
+    assert len(answer.snippets) > 0
+
+
+def test_independent_answer_module_executor() -> None:
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        answer = _answer_module(executor).forward(_QUESTION)
+    assert len(answer.documents) > 0
+    assert len(answer.snippets) > 0
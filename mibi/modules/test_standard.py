@@ -0,0 +1,117 @@
+from pytest import mark
+
+from mibi.model import IdealAnswer, PartialAnswer, Question
+from mibi.modules.mock import MockDocumentsModule, MockSnippetsModule, MockExactAnswerModule, MockIdealAnswerModule
+from mibi.modules.standard import GenerateThenRetrieveAnswerModule, GenerateThenRetrieveThenGenerateAnswerModule, RetrieveThenGenerateAnswerModule, RetrieveThenGenerateThenRetrieveAnswerModule, _AnswerBuilderModule
+
+
+_QUESTION = Question(
+    id="6415c252690f196b51000011",
+    type="factoid",
+    body="Which cancer is the BCG vaccine used for?",
+)
+
+_ANSWER_MODULE_TYPES = [
+    RetrieveThenGenerateAnswerModule,
+    GenerateThenRetrieveAnswerModule,
+    RetrieveThenGenerateThenRetrieveAnswerModule,
+    GenerateThenRetrieveThenGenerateAnswerModule,
+]
+
+
+def _answer_module(
+    answer_module_type: type[_AnswerBuilderModule],
+) -> _AnswerBuilderModule:
+    return answer_module_type(
+        documents_module=MockDocumentsModule(),
+        snippets_module=MockSnippetsModule(),
+        exact_answer_module=MockExactAnswerModule(),
+        ideal_answer_module=MockIdealAnswerModule(),
+    )
+
+
+@mark.parametrize("answer_module_type", _ANSWER_MODULE_TYPES)
+def test_answer_builder_module(
+    answer_module_type: type[_AnswerBuilderModule],
+) -> None:
+    answer = _answer_module(answer_module_type).forward(_QUESTION)
+    assert len(answer.documents) > 0
+    assert len(answer.snippets) > 0
+
+
+@mark.parametrize("answer_module_type", _ANSWER_MODULE_TYPES)
+def test_answer_builder_module_batch(
+    answer_module_type: type[_AnswerBuilderModule],
+) -> None:
+    questions = [
+        _QUESTION,
+        Question(
+            id="6415c252690f196b51000012",
+            type="yesno",
+            body="Is the BCG vaccine used for bladder cancer?",
+        ),
+    ]
+    answers = _answer_module(answer_module_type).forward_batch(questions)
+    assert len(answers) == len(questions)
+    for answer in answers:
+        assert not isinstance(answer, Exception)
+        assert len(answer.documents) > 0
+        assert len(answer.snippets) > 0
+    # Answers are in the order of the questions (which have different types).
+    factoid_answer, yes_no_answer = answers
+    assert not isinstance(factoid_answer, Exception)
+    assert factoid_answer.exact_answer in ("foo", "bar")
+    assert not isinstance(yes_no_answer, Exception)
+    assert yes_no_answer.exact_answer in ("yes", "no")
+
+
+class _RecordingIdealAnswerModule(MockIdealAnswerModule):
+    partial_answers: list[PartialAnswer]
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.partial_answers = []
+
+    def forward(
+        self,
+        question: Question,
+        partial_answer: PartialAnswer,
+    ) -> IdealAnswer:
+        self.partial_answers.append(partial_answer)
+        return super().forward(question, partial_answer)
+
+
+@mark.parametrize("answer_module_type", _ANSWER_MODULE_TYPES)
+def test_answer_builder_module_ideal_answer_sees_exact_answer(
+    answer_module_type: type[_AnswerBuilderModule],
+) -> None:
+    ideal_answer_module = _RecordingIdealAnswerModule()
+    answer_module_type(
+        documents_module=MockDocumentsModule(),
+        snippets_module=MockSnippetsModule(),
+        exact_answer_module=MockExactAnswerModule(),
+        ideal_answer_module=ideal_answer_module,
+    ).forward(_QUESTION)
+    assert len(ideal_answer_module.partial_answers) > 0
+    for partial_answer in ideal_answer_module.partial_answers:
+        # The ideal answer is made after the exact answer, as if made sequentially.
+        assert partial_answer.exact_answer is not None
+
+
+def test_answer_builder_module_stage_input_snapshot() -> None:
+    ideal_answer_module = _RecordingIdealAnswerModule()
+    GenerateThenRetrieveThenGenerateAnswerModule(
+        documents_module=MockDocumentsModule(),
+        snippets_module=MockSnippetsModule(),
+        exact_answer_module=MockExactAnswerModule(),
+        ideal_answer_module=ideal_answer_module,
+    ).forward(_QUESTION)
+    first, second = ideal_answer_module.partial_answers
+    # The first ideal answer only depends on the first exact answer.
+    assert first.documents is None
+    assert first.snippets is None
+    assert first.ideal_answer is None
+    # The second ideal answer depends on all earlier stages.
+    assert second.documents is not None
+    assert second.snippets is not None
+    assert second.ideal_answer is not None
@@ -0,0 +1,125 @@
+from dataclasses import is_dataclass
+from json import dumps
+from pathlib import Path
+from typing import Any, Literal, Sequence, TypeAlias
+
+from dspy import Module, settings as dspy_settings
+from pydantic import BaseModel, JsonValue, TypeAdapter
+
+from mibi.model import Documents, ExactAnswer, IdealAnswer, PartialAnswer, Question, Snippets
+from mibi.utils.content_store import ContentStore
+
+
+StageType: TypeAlias = Literal[
+    "documents",
+    "snippets",
+    "exact_answer",
+    "ideal_answer",
+]
+
+STAGE_ADAPTERS: dict[StageType, TypeAdapter] = {
+    "documents": TypeAdapter(Documents),
+    "snippets": TypeAdapter(Snippets),
+    "exact_answer": TypeAdapter(ExactAnswer),
+    "ideal_answer": TypeAdapter(IdealAnswer),
+}
+
+
+def _to_json(value: Any) -> JsonValue:
+    # Serialize manually, as the model's serializers are lossy (e.g., only the top-10 documents are serialized).
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    elif isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    elif isinstance(value, Sequence):
+        return [_to_json(item) for item in value]
+    else:
+        return str(value)
+
+
+def _module_identity(module: Module) -> JsonValue:
+    module_type = type(module)
+    identity: dict[str, JsonValue] = {
+        "type": f"{module_type.__module__}.{module_type.__qualname__}",
+    }
+    if is_dataclass(module):
+        identity["config"] = repr(module)
+    else:
+        identity["config"] = {
+            name: repr(value)
+            for name, value in sorted(vars(module).items())
+            if is_dataclass(value) or
+            isinstance(value, (str, bool, int, float, tuple))
+        }
+    if len(module.predictors()) > 0:
+        lm = dspy_settings.lm
+        identity["language_model"] = lm.kwargs.get("model") \
+            if lm is not None else None
+        # Demonstrations and instructions of compiled programs.
+        identity["state"] = dumps(
+            module.dump_state(),
+            sort_keys=True,
+            default=str,
+        )
+    return identity
+
+
+class StageCache:
+    """
+    Persistent cache of answer stage outputs, keyed by the stage, the module's identity (type, configuration, language model, and program state), the question, and the partial answer the stage was run on.
+    Stages with the same inputs are thus only run once, even across answer strategies and runs.
+    """
+
+    _store: ContentStore
+
+    def __init__(self, path: Path) -> None:
+        self._store = ContentStore(path)
+
+    @staticmethod
+    def _key(
+        stage: StageType,
+        module: Module,
+        question: Question,
+        partial_answer: PartialAnswer,
+    ) -> JsonValue:
+        return {
+            "stage": stage,
+            "module": _module_identity(module),
+            "question": {
+                "id": question.id,
+                "type": question.type,
+                "body": question.body,
+            },
+            "partial_answer": {
+                "documents": _to_json(partial_answer.documents),
+                "snippets": _to_json(partial_answer.snippets),
+                "exact_answer": _to_json(partial_answer.exact_answer),
+                "ideal_answer": _to_json(partial_answer.ideal_answer),
+            },
+        }
+
+    def get(
+        self,
+        stage: StageType,
+        module: Module,
+        question: Question,
+        partial_answer: PartialAnswer,
+    ) -> Any | None:
+        value = self._store.get(
+            self._key(stage, module, question, partial_answer))
+        if value is None:
+            return None
+        return STAGE_ADAPTERS[stage].validate_python(value)
+
+    def put(
+        self,
+        stage: StageType,
+        module: Module,
+        question: Question,
+        partial_answer: PartialAnswer,
+        value: Any,
+    ) -> None:
+        self._store.put(
+            self._key(stage, module, question, partial_answer),
+            _to_json(value),
+        )
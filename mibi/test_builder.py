@@ -1,6 +1,9 @@
 
+from pydantic import ValidationError
+from pytest import raises
+
 from mibi.builder import AnswerBuilder
-from mibi.model import Question
+from mibi.model import PartialAnswer, PartiallyAnsweredQuestion, Question
 from mibi.modules.mock import MockDocumentsModule, MockSnippetsModule, MockExactAnswerModule, MockIdealAnswerModule
 
 
@@ -70,3 +73,45 @@ def test_answer_builder() -> None:
     assert builder.partial_answer.exact_answer is not None
     assert builder.partial_answer.ideal_answer is not None
     assert builder.is_ready
+
+
+def test_answer_builder_validates_updates() -> None:
+    question = Question(
+        id="6415c252690f196b51000011",
+        type="factoid",
+        body="Which cancer is the BCG vaccine used for?",
+    )
+    builder = AnswerBuilder(
+        question=question,
+        documents_module=MockDocumentsModule(),
+        snippets_module=MockSnippetsModule(),
+        exact_answer_module=MockExactAnswerModule(),
+        ideal_answer_module=MockIdealAnswerModule(),
+    )
+    builder.make_documents()
+    documents = builder.partial_answer.documents
+    with raises(ValidationError):
+        builder._update_partial_answer(
+            "snippets", [{"document": "https://example.com"}])
+    assert builder.partial_answer.documents == documents
+    assert builder.partial_answer.snippets is None
+    builder.make_snippets()
+    assert builder.partial_answer.documents == documents
+    assert builder.partial_answer.snippets is not None
+
+
+def test_partially_answered_question_from_question() -> None:
+    question = Question(
+        id="6415c252690f196b51000011",
+        type="factoid",
+        body="Which cancer is the BCG vaccine used for?",
+    )
+    partial_answer = PartialAnswer(
+        exact_answer="bladder cancer",
+    )
+    partially_answered_question = PartiallyAnsweredQuestion.from_question(
+        question, partial_answer)
+    assert partially_answered_question.id == question.id
+    assert partially_answered_question.exact_answer == "bladder cancer"
+    assert partially_answered_question.exact_answer_text == "bladder cancer"
+    assert partially_answered_question.documents is None
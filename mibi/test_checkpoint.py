@@ -0,0 +1,78 @@
+from pathlib import Path
+
+from pydantic import TypeAdapter
+
+from mibi.checkpoint import AnsweredQuestionsCheckpoint
+from mibi.model import AnsweredQuestion, AnsweredQuestionData, Document
+
+
+def _answered_question(question_id: str) -> AnsweredQuestion:
+    return AnsweredQuestion(
+        id=question_id,
+        type="factoid",
+        body="Which cancer is the BCG vaccine used for?",
+        documents=[
+            TypeAdapter(Document).validate_python(
+                "http://www.ncbi.nlm.nih.gov/pubmed/12345678"),
+        ],
+        snippets=[],
+        ideal_answer="The BCG vaccine is used for bladder cancer.",
+        exact_answer="bladder cancer",
+    )
+
+
+def test_checkpoint_resume(tmp_path: Path) -> None:
+    checkpoint_path = tmp_path / "checkpoint.jsonl"
+    first = _answered_question("6415c252690f196b51000011")
+    second = _answered_question("6415c252690f196b51000012")
+
+    checkpoint = AnsweredQuestionsCheckpoint(checkpoint_path)
+    assert checkpoint.answered_question_ids == set()
+    with checkpoint.open() as writer:
+        writer.write(first)
+    # Simulate a crash while writing the second question.
+    with checkpoint_path.open("ab") as file:
+        file.write(second.model_dump_json(by_alias=True).encode()[:20])
+
+    checkpoint = AnsweredQuestionsCheckpoint(checkpoint_path)
+    assert checkpoint.answered_question_ids == {first.id}
+    with checkpoint.open() as writer:
+        writer.write(second)
+
+    checkpoint = AnsweredQuestionsCheckpoint(checkpoint_path)
+    assert checkpoint.answered_question_ids == {first.id, second.id}
+
+
+def test_checkpoint_write_data(tmp_path: Path) -> None:
+    checkpoint_path = tmp_path / "checkpoint.jsonl"
+    output_path = tmp_path / "output.json"
+    first = _answered_question("6415c252690f196b51000011")
+    second = _answered_question("6415c252690f196b51000012")
+
+    checkpoint = AnsweredQuestionsCheckpoint(checkpoint_path)
+    with checkpoint.open() as writer:
+        writer.write(second)
+        writer.write(first)
+
+    count = checkpoint.write_data(
+        [first.id, "6415c252690f196b51000013", second.id],
+        output_path,
+    )
+    assert count == 2
+    expected = AnsweredQuestionData(
+        questions=[first, second],
+    ).model_dump_json(indent=2, by_alias=True)
+    assert output_path.read_text() == expected
+
+
+def test_checkpoint_write_empty_data(tmp_path: Path) -> None:
+    checkpoint_path = tmp_path / "checkpoint.jsonl"
+    output_path = tmp_path / "output.json"
+    checkpoint = AnsweredQuestionsCheckpoint(checkpoint_path)
+    with checkpoint.open():
+        pass
+    assert checkpoint.write_data([], output_path) == 0
+    expected = AnsweredQuestionData(
+        questions=[],
+    ).model_dump_json(indent=2, by_alias=True)
+    assert output_path.read_text() == expected
@@ -0,0 +1,55 @@
+from pathlib import Path
+
+from mibi.builder import AnswerBuilder
+from mibi.model import Documents, PartialAnswer, Question
+from mibi.modules.mock import MockDocumentsModule, MockSnippetsModule, MockExactAnswerModule, MockIdealAnswerModule
+from mibi.stage_cache import StageCache
+
+
+class _CountingDocumentsModule(MockDocumentsModule):
+    calls: int = 0
+
+    def forward(
+        self,
+        question: Question,
+        partial_answer: PartialAnswer,
+    ) -> Documents:
+        _CountingDocumentsModule.calls += 1
+        return super().forward(question, partial_answer)
+
+
+def _builder(question: Question, stage_cache: StageCache) -> AnswerBuilder:
+    return AnswerBuilder(
+        question=question,
+        documents_module=_CountingDocumentsModule(),
+        snippets_module=MockSnippetsModule(),
+        exact_answer_module=MockExactAnswerModule(),
+        ideal_answer_module=MockIdealAnswerModule(),
+        stage_cache=stage_cache,
+    )
+
+
+def test_stage_cache(tmp_path: Path) -> None:
+    question = Question(
+        id="6415c252690f196b51000011",
+        type="factoid",
+        body="Which cancer is the BCG vaccine used for?",
+    )
+    stage_cache = StageCache(tmp_path)
+    _CountingDocumentsModule.calls = 0
+
+    builder = _builder(question, stage_cache)
+    builder.make_documents()
+    assert _CountingDocumentsModule.calls == 1
+    documents = builder.partial_answer.documents
+
+    # Same stage inputs: re-use the cached documents.
+    builder = _builder(question, StageCache(tmp_path))
+    builder.make_documents()
+    assert _CountingDocumentsModule.calls == 1
+    assert builder.partial_answer.documents == documents
+
+    # Different stage inputs: make new documents.
+    builder.make_exact_answer()
+    builder.make_documents()
+    assert _CountingDocumentsModule.calls == 2
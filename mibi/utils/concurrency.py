@@ -0,0 +1,125 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import wraps
+from itertools import islice
+from typing import Callable, Deque, Iterable, Iterator, ParamSpec, Sequence, TypeVar
+from warnings import warn
+
+from dspy import settings as dspy_settings
+
+
+_T = TypeVar("_T")
+_R = TypeVar("_R")
+_P = ParamSpec("_P")
+
+
+def with_dspy_settings(function: Callable[_P, _R]) -> Callable[_P, _R]:
+    """
+    Wrap the function such that it runs with the calling thread's DSPy settings (e.g., the language model and trace), also when called from another thread.
+    DSPy keeps the settings per thread identifier and never removes them, so a new worker thread would otherwise see the settings of an earlier thread with the same identifier, and not the caller's `dspy.settings.context(...)`.
+    """
+    config = dict(dspy_settings.config)
+
+    @wraps(function)
+    def wrapped(*args: _P.args, **kwargs: _P.kwargs) -> _R:
+        with dspy_settings.context(inherit_config=False, **config):
+            return function(*args, **kwargs)
+
+    return wrapped
+
+
+def _call_safely(function: Callable[[_T], _R], item: _T) -> _R | Exception:
+    try:
+        return function(item)
+    except Exception as exception:
+        return exception
+
+
+def map_concurrently(
+    function: Callable[[_T], _R],
+    items: Iterable[_T],
+    concurrency: int = 1,
+) -> Iterator[_R | Exception]:
+    """
+    Apply the function to each item in a bounded pool of worker threads and yield the results in the order of the items.
+    If the function raises an exception for some item, the exception is yielded in place of the result, so that one failing item does not abort the remaining items.
+
+    :param function: The function to apply to each item.
+    :param items: The items to apply the function to. Items are consumed lazily.
+    :param concurrency: Maximum number of items processed at the same time. With a concurrency of 1, the items are processed sequentially in the calling thread.
+    """
+    if concurrency < 1:
+        raise ValueError(f"Concurrency must be positive: {concurrency}")
+    if concurrency == 1:
+        for item in items:
+            yield _call_safely(function, item)
+        return
+
+    function = with_dspy_settings(function)
+    with ThreadPoolExecutor(
+        max_workers=concurrency,
+        thread_name_prefix="mibi-worker",
+    ) as executor:
+        # Only keep a bounded number of pending items to limit memory usage.
+        pending: Deque[Future[_R | Exception]] = deque()
+        for item in items:
+            pending.append(executor.submit(_call_safely, function, item))
+            if len(pending) >= 2 * concurrency:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+
+def _chunked(items: Iterable[_T], size: int) -> Iterator[list[_T]]:
+    iterator = iter(items)
+    while len(chunk := list(islice(iterator, size))) > 0:
+        yield chunk
+
+
+def map_batched(
+    function: Callable[[Sequence[_T]], Sequence[_R | Exception]],
+    items: Iterable[_T],
+    batch_size: int,
+    concurrency: int = 1,
+) -> Iterator[_R | Exception]:
+    """
+    Apply the batched function to batches of items and yield the results per item in the order of the items.
+    If the function raises an exception for a whole batch, the exception is yielded in place of each result of the batch. If it returns the wrong number of results for a batch, the function is applied to each item of that batch separately instead.
+
+    :param function: The function to apply to each batch. It must return one result (or exception) per item of the batch.
+    :param items: The items to apply the function to. Items are consumed lazily.
+    :param batch_size: Maximum number of items per batch.
+    :param concurrency: Maximum number of batches processed at the same time.
+    """
+    if batch_size < 1:
+        raise ValueError(f"Batch size must be positive: {batch_size}")
+
+    def apply_single(item: _T) -> _R | Exception:
+        try:
+            results = function([item])
+        except Exception as exception:
+            return exception
+        if len(results) != 1:
+            return RuntimeError(f"Expected 1 result but got {len(results)}.")
+        return results[0]
+
+    def apply(batch: list[_T]) -> Sequence[_R | Exception]:
+        try:
+            results = function(batch)
+        except Exception as exception:
+            return [exception] * len(batch)
+        if len(results) != len(batch):
+            warn(RuntimeWarning(
+                f"Expected {len(batch)} results but got {len(results)}. "
+                "Applying the function to each item of the batch instead."))
+            return [apply_single(item) for item in batch]
+        return results
+
+    for results in map_concurrently(
+        apply,
+        _chunked(items, batch_size),
+        concurrency=concurrency,
+    ):
+        if isinstance(results, Exception):
+            raise results
+        yield from results
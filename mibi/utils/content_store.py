@@ -0,0 +1,69 @@
+from hashlib import sha256
+from json import dumps, loads
+from os import replace
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+from pydantic import JsonValue
+
+
+class ContentStore:
+    """
+    Persistent key-value store on disk where each value is addressed by the hash of its (JSON) key.
+    Values are written atomically, so that multiple processes can share the same store.
+    Keys are only hashed and never written to disk.
+    """
+
+    _path: Path
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @staticmethod
+    def address(key: JsonValue) -> str:
+        """
+        Hash the canonical JSON representation of the key.
+        """
+        key_json = dumps(
+            key,
+            sort_keys=True,
+            separators=(",", ":"),
+            ensure_ascii=False,
+        )
+        return sha256(key_json.encode("utf-8")).hexdigest()
+
+    def _value_path(self, address: str) -> Path:
+        return self._path / address[:2] / f"{address}.json"
+
+    def __contains__(self, key: JsonValue) -> bool:
+        """
+        Check if a value is stored for the (JSON) key.
+        """
+        return self._value_path(self.address(key)).exists()
+
+    def get(self, key: JsonValue) -> JsonValue | None:
+        """
+        Get the value stored for the key, or `None` if no value is stored.
+        """
+        value_path = self._value_path(self.address(key))
+        if not value_path.exists():
+            return None
+        return loads(value_path.read_text(encoding="utf-8"))
+
+    def put(self, key: JsonValue, value: JsonValue) -> None:
+        value_path = self._value_path(self.address(key))
+        value_path.parent.mkdir(parents=True, exist_ok=True)
+        with NamedTemporaryFile(
+            mode="wt",
+            encoding="utf-8",
+            dir=value_path.parent,
+            suffix=".tmp",
+            delete=False,
+        ) as file:
+            file.write(dumps(value, ensure_ascii=False))
+        replace(file.name, value_path)
+
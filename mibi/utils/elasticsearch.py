@@ -1,11 +1,13 @@
 from dataclasses import dataclass
 from typing import Any, Generic, Iterable, Sized, Type, TypeVar, Iterator
 
-from elasticsearch7 import Elasticsearch
+from elasticsearch7 import Elasticsearch, Urllib3HttpConnection
 from elasticsearch7.helpers import streaming_bulk
 from elasticsearch7_dsl import Document
 from tqdm.auto import tqdm
 
+from mibi.utils.rate_limiting import RateLimiter
+
 
 T = TypeVar("T", bound=Document)
 
@@ -58,10 +60,45 @@ class ElasticsearchIndexer(Generic[T]):
             pass
 
 
+class RateLimitedConnection(Urllib3HttpConnection):
+    """
+    Connection that waits for the `elasticsearch` rate limit before each request.
+    The transport retries failed requests on its connections, so retries wait for the rate limit, too.
+    """
+
+    _rate_limiter: RateLimiter
+
+    def __init__(self, rate_limiter: RateLimiter, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self._rate_limiter = rate_limiter
+
+    def perform_request(
+        self,
+        method,
+        url,
+        params=None,
+        body=None,
+        timeout=None,
+        ignore=(),
+        headers=None,
+    ):
+        self._rate_limiter.acquire("elasticsearch")
+        return super().perform_request(
+            method,
+            url,
+            params=params,
+            body=body,
+            timeout=timeout,
+            ignore=ignore,
+            headers=headers,
+        )
+
+
 def elasticsearch_connection(
     elasticsearch_url: str,
     elasticsearch_username: str | None,
     elasticsearch_password: str | None,
+    rate_limiter: RateLimiter | None = None,
 ) -> Elasticsearch:
     elasticsearch_auth: tuple[str, str] | None
     if elasticsearch_username is not None and elasticsearch_password is None:
@@ -73,10 +110,19 @@ def elasticsearch_connection(
     else:
         elasticsearch_auth = None
 
+    connection_kwargs: dict[str, Any] = {}
+    if rate_limiter is not None:
+        # The transport passes extra arguments on to the connections.
+        connection_kwargs = dict(
+            connection_class=RateLimitedConnection,
+            rate_limiter=rate_limiter,
+        )
+
     return Elasticsearch(
         hosts=elasticsearch_url,
         http_auth=elasticsearch_auth,
         request_timeout=60,
         read_timeout=60,
         max_retries=10,
+        **connection_kwargs,
     )
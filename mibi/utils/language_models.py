@@ -1,6 +1,27 @@
+from copy import copy
+from dataclasses import dataclass
+from datetime import timedelta
+from json import loads
 from os import environ
+from pathlib import Path
+from threading import Lock
+from time import perf_counter
+from typing import Any, Callable, Literal, Sequence, TypeVar, cast
+from warnings import warn
+
+import openai
+from openai import Stream
+from openai.types.chat import ChatCompletionChunk
 from dspy import OpenAI as DSPyOpenAI, HFModel, settings as dspy_settings, OllamaLocal
 from dsp import LM
+from requests import ConnectionError as RequestsConnectionError, HTTPError, Timeout, post
+from pydantic import JsonValue
+
+from mibi.utils.rate_limiting import RateLimiter
+from mibi.utils.resilience import ResiliencePolicy, ResilienceStats, ResilientCaller
+from mibi.utils.response_cache import ResponseCache
+from mibi.utils.streaming import JsonStringFieldTerminator, StreamTerminator
+from mibi.utils.token_counting import token_counter
 
 
 _BLABLADOR_MODEL_NAMES = {
@@ -11,31 +32,1229 @@ _BLABLADOR_MODEL_NAMES = {
 }
 
 
-def init_language_model_clients(language_model_name: str) -> LM:
+class WrappedLM(LM):
+    """
+    Language model that forwards all requests to the wrapped language model.
+    Subclasses override `__call__` to add behavior around the requests.
+    The wrapper shares the wrapped language model's arguments and history, so that inspecting the history works as usual.
+    """
+
     lm: LM
+
+    def __init__(self, lm: LM) -> None:
+        # Some language models (e.g., Ollama) do not keep the model name in their arguments.
+        super().__init__(model=lm.kwargs.get("model"))
+        self.lm = lm
+        self.kwargs = lm.kwargs
+        self.provider = lm.provider
+        self.history = lm.history
+
+    def basic_request(self, prompt: str, **kwargs) -> Any:
+        return self.lm.basic_request(prompt, **kwargs)
+
+    def __call__(
+        self,
+        prompt: str,
+        only_completed: bool = True,
+        return_sorted: bool = False,
+        **kwargs,
+    ) -> list[Any]:
+        return self.lm(
+            prompt,
+            only_completed=only_completed,
+            return_sorted=return_sorted,
+            **kwargs,
+        )
+
+    def completion_identity(self) -> str | None:
+        """
+        Identity of the wrapper's settings that affect the completions, or `None` if the completions are not affected.
+        """
+        return None
+
+    def copy(self, **kwargs) -> "WrappedLM":
+        wrapped_lm = copy(self)
+        wrapped_lm.lm = self.lm.copy(**kwargs)
+        wrapped_lm.kwargs = wrapped_lm.lm.kwargs
+        wrapped_lm.history = wrapped_lm.lm.history
+        return wrapped_lm
+
+
+_LM = TypeVar("_LM", bound=LM)
+_T = TypeVar("_T")
+
+
+def find_language_model(lm: LM, lm_type: type[_LM]) -> _LM | None:
+    """
+    Find the first language model of the given type in a chain of wrapped language models.
+    """
+    while True:
+        if isinstance(lm, lm_type):
+            return lm
+        elif isinstance(lm, WrappedLM):
+            lm = lm.lm
+        else:
+            return None
+
+
+class CountingLM(WrappedLM):
+    """
+    Language model that counts the requests to the wrapped language model, and the tokens used as reported by the backend (not counting cached responses).
+    """
+
+    num_requests: int
+    num_tokens: int
+    _lock: Lock
+
+    def __init__(self, lm: LM) -> None:
+        super().__init__(lm)
+        self.num_requests = 0
+        self.num_tokens = 0
+        self._lock = Lock()
+
+    def __call__(
+        self,
+        prompt: str,
+        only_completed: bool = True,
+        return_sorted: bool = False,
+        **kwargs,
+    ) -> list[Any]:
+        with self._lock:
+            self.num_requests += 1
+        history_start = len(self.history)
+        completions = super().__call__(
+            prompt,
+            only_completed=only_completed,
+            return_sorted=return_sorted,
+            **kwargs,
+        )
+        tokens = _response_total_tokens(
+            _history_response(self.history, history_start, prompt))
+        if tokens is not None:
+            with self._lock:
+                self.num_tokens += tokens
+        return completions
+
+
+@dataclass(frozen=True)
+class LanguageModelStats:
+    requests: int
+    seconds: float
+    prompt_tokens: int
+    cached_prompt_tokens: int
+    prompt_eval_seconds: float
+    streamed_requests: int
+    first_token_seconds: float
+
+    @property
+    def mean_seconds(self) -> float:
+        if self.requests == 0:
+            return 0
+        return self.seconds / self.requests
+
+    @property
+    def mean_first_token_seconds(self) -> float:
+        """
+        Mean time to the first token of the streamed requests.
+        """
+        if self.streamed_requests == 0:
+            return 0
+        return self.first_token_seconds / self.streamed_requests
+
+    @property
+    def cached_prompt_tokens_ratio(self) -> float:
+        if self.prompt_tokens == 0:
+            return 0
+        return self.cached_prompt_tokens / self.prompt_tokens
+
+    def __str__(self) -> str:
+        return (
+            f"{self.requests} requests, {self.mean_seconds:.2f} s "
+            f"per request, {self.prompt_tokens} prompt tokens "
+            f"({self.cached_prompt_tokens_ratio:.0%} cached), "
+            f"{self.prompt_eval_seconds:.1f} s prompt evaluation, "
+            f"{self.mean_first_token_seconds:.2f} s to first token "
+            f"({self.streamed_requests} streamed requests)"
+        )
+
+
+def _int(value: Any) -> int:
+    return value if isinstance(value, int) else 0
+
+
+def _response_usage(response: Any) -> tuple[int, int, float]:
+    # Usage as reported by the backend: prompt tokens, cached prompt tokens (OpenAI prompt caching), and prompt evaluation time (Ollama).
+    if not isinstance(response, dict):
+        return 0, 0, 0
+    usage = response.get("usage")
+    if not isinstance(usage, dict):
+        usage = {}
+    prompt_tokens = _int(usage.get("prompt_tokens"))
+    prompt_tokens_details = usage.get("prompt_tokens_details")
+    cached_prompt_tokens = _int(
+        prompt_tokens_details.get("cached_tokens")
+        if isinstance(prompt_tokens_details, dict) else None
+    )
+    additional_kwargs = response.get("additional_kwargs")
+    if not isinstance(additional_kwargs, dict):
+        additional_kwargs = {}
+    prompt_eval_nanoseconds = _int(response.get(
+        "prompt_eval_duration",
+        additional_kwargs.get("prompt_eval_duration"),
+    ))
+    return prompt_tokens, cached_prompt_tokens, prompt_eval_nanoseconds / 1e9
+
+
+def _response_first_token_seconds(response: Any) -> float | None:
+    # Time to the first token, as measured by the `StreamingLM`.
+    if not isinstance(response, dict):
+        return None
+    first_token_seconds = response.get("first_token_seconds")
+    if not isinstance(first_token_seconds, (int, float)):
+        return None
+    return first_token_seconds
+
+
+def _history_response(
+    history: Sequence[Any],
+    start: int,
+    prompt: str,
+) -> Any:
+    # Find the response of the request among the entries added to the (shared) history during the request, which can include entries of concurrent requests.
+    entries = [
+        entry
+        for entry in history[start:]
+        if isinstance(entry, dict)
+    ]
+    for entry in reversed(entries):
+        if entry.get("prompt") == prompt:
+            return entry.get("response")
+    if len(entries) == 1:
+        # Some wrappers modify the prompt (e.g., to add a JSON schema).
+        return entries[0].get("response")
+    return None
+
+
+class _LanguageModelStatsCounter:
+    _stats: LanguageModelStats
+    _lock: Lock
+
+    def __init__(self) -> None:
+        self._stats = LanguageModelStats(0, 0, 0, 0, 0, 0, 0)
+        self._lock = Lock()
+
+    def add(
+        self,
+        seconds: float,
+        prompt_tokens: int,
+        cached_prompt_tokens: int,
+        prompt_eval_seconds: float,
+        first_token_seconds: float | None,
+    ) -> None:
+        with self._lock:
+            self._stats = LanguageModelStats(
+                requests=self._stats.requests + 1,
+                seconds=self._stats.seconds + seconds,
+                prompt_tokens=self._stats.prompt_tokens + prompt_tokens,
+                cached_prompt_tokens=self._stats.cached_prompt_tokens +
+                cached_prompt_tokens,
+                prompt_eval_seconds=self._stats.prompt_eval_seconds +
+                prompt_eval_seconds,
+                streamed_requests=self._stats.streamed_requests +
+                (first_token_seconds is not None),
+                first_token_seconds=self._stats.first_token_seconds +
+                (first_token_seconds or 0),
+            )
+
+    @property
+    def stats(self) -> LanguageModelStats:
+        with self._lock:
+            return self._stats
+
+
+class InstrumentedLM(WrappedLM):
+    """
+    Language model that measures the latency of the requests and collects the prompt usage reported by the backend, i.e., cached prompt tokens (OpenAI prompt caching) and prompt evaluation time (Ollama).
+    Both indicate how much of the prompts' prefixes the backend could reuse. The time to the first token is only known for requests streamed by a wrapped `StreamingLM`. Copies share the statistics.
+    """
+
+    _counter: _LanguageModelStatsCounter
+
+    def __init__(self, lm: LM) -> None:
+        super().__init__(lm)
+        self._counter = _LanguageModelStatsCounter()
+
+    @property
+    def stats(self) -> LanguageModelStats:
+        return self._counter.stats
+
+    def __call__(
+        self,
+        prompt: str,
+        only_completed: bool = True,
+        return_sorted: bool = False,
+        **kwargs,
+    ) -> list[Any]:
+        history_start = len(self.history)
+        start = perf_counter()
+        completions = super().__call__(
+            prompt,
+            only_completed=only_completed,
+            return_sorted=return_sorted,
+            **kwargs,
+        )
+        seconds = perf_counter() - start
+        response = _history_response(self.history, history_start, prompt)
+        self._counter.add(
+            seconds,
+            *_response_usage(response),
+            _response_first_token_seconds(response),
+        )
+        return completions
+
+
+def _response_total_tokens(response: Any) -> int | None:
+    # Total tokens as reported by the backend (OpenAI and Ollama).
+    if not isinstance(response, dict):
+        return None
+    usage = response.get("usage")
+    if isinstance(usage, dict) and isinstance(usage.get("total_tokens"), int):
+        return usage["total_tokens"]
+    if isinstance(response.get("prompt_eval_count"), int) and \
+            isinstance(response.get("eval_count"), int):
+        return response["prompt_eval_count"] + response["eval_count"]
+    return None
+
+
+class RateLimitedLM(WrappedLM):
+    """
+    Language model that waits for the named rate limit before each request.
+    The tokens of a request are estimated from the prompt and the maximum completion length, and corrected with the usage reported by the backend afterwards.
+    If the wrapped language model is a `ResilientLM`, each of its attempts (including retries and hedged requests) waits for the rate limit.
+    """
+
+    language_model_name: str
+    rate_limiter: RateLimiter
+    rate_limit_name: str
+
+    def __init__(
+        self,
+        lm: LM,
+        language_model_name: str,
+        rate_limiter: RateLimiter,
+        rate_limit_name: str,
+    ) -> None:
+        super().__init__(lm)
+        self.language_model_name = language_model_name
+        self.rate_limiter = rate_limiter
+        self.rate_limit_name = rate_limit_name
+
+    def __call__(
+        self,
+        prompt: str,
+        only_completed: bool = True,
+        return_sorted: bool = False,
+        **kwargs,
+    ) -> list[Any]:
+        max_tokens = kwargs.get("max_tokens", self.kwargs.get("max_tokens"))
+        estimated_tokens = token_counter(self.language_model_name)(prompt) + (
+            max_tokens if isinstance(max_tokens, int) else 0)
+
+        def acquire() -> None:
+            self.rate_limiter.acquire(self.rate_limit_name, estimated_tokens)
+
+        history_start = len(self.history)
+        if isinstance(self.lm, ResilientLM):
+            completions = self.lm.call(
+                prompt,
+                only_completed=only_completed,
+                return_sorted=return_sorted,
+                acquire=acquire,
+                **kwargs,
+            )
+        else:
+            acquire()
+            completions = super().__call__(
+                prompt,
+                only_completed=only_completed,
+                return_sorted=return_sorted,
+                **kwargs,
+            )
+        response = _history_response(self.history, history_start, prompt)
+        tokens = _response_total_tokens(response)
+        if tokens is not None:
+            self.rate_limiter.adjust(
+                self.rate_limit_name, tokens - estimated_tokens)
+        return completions
+
+
+def _retry_after_header(headers: Any) -> float:
+    if headers is None:
+        return 0
+    try:
+        return float(headers.get("retry-after", 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _retry_after(error: Exception) -> float | None:
+    # Retry rate limit (429) and server errors (5xx), as well as connection errors and timeouts.
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code == 429 or error.status_code >= 500:
+            return _retry_after_header(error.response.headers)
+        return None
+    elif isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return 0
+    elif isinstance(error, HTTPError):
+        if error.response is None:
+            return 0
+        status_code = error.response.status_code
+        if status_code == 429 or status_code >= 500:
+            return _retry_after_header(error.response.headers)
+        return None
+    elif isinstance(error, (RequestsConnectionError, Timeout)):
+        return 0
+    return None
+
+
+class ResilientLM(WrappedLM):
+    """
+    Language model that times out slow requests, retries rate-limited (429) and failed (5xx) requests with exponential backoff and jitter, and optionally hedges requests slower than usual with a duplicate request.
+    Latencies are recorded per backend. Copies share the statistics.
+    """
+
+    backend: str
+    policy: ResiliencePolicy
+    caller: ResilientCaller[list[Any]]
+
+    def __init__(
+        self,
+        lm: LM,
+        backend: str,
+        policy: ResiliencePolicy,
+    ) -> None:
+        super().__init__(lm)
+        self.backend = backend
+        self.policy = policy
+        self.caller = ResilientCaller(policy)
+
+    @property
+    def stats(self) -> ResilienceStats:
+        return self.caller.stats
+
+    def call(
+        self,
+        prompt: str,
+        only_completed: bool = True,
+        return_sorted: bool = False,
+        acquire: Callable[[], None] | None = None,
+        **kwargs,
+    ) -> list[Any]:
+        """
+        Request completions like `__call__`, but call `acquire` before each attempt (e.g., to wait for a rate limit).
+        """
+        return self.caller.call(
+            lambda: super(ResilientLM, self).__call__(
+                prompt,
+                only_completed=only_completed,
+                return_sorted=return_sorted,
+                **kwargs,
+            ),
+            _retry_after,
+            acquire,
+        )
+
+    def __call__(
+        self,
+        prompt: str,
+        only_completed: bool = True,
+        return_sorted: bool = False,
+        **kwargs,
+    ) -> list[Any]:
+        return self.call(
+            prompt,
+            only_completed=only_completed,
+            return_sorted=return_sorted,
+            **kwargs,
+        )
+
+
+class OpenAIEndpointLM(DSPyOpenAI):
+    """
+    OpenAI(-compatible) language model with its own client, e.g., for one of several vLLM replicas. DSPy's OpenAI language model uses the global OpenAI client, i.e., only one endpoint.
+    """
+
+    api_key: str | None
+    api_base: str | None
+    client: openai.OpenAI
+
+    def __init__(
+        self,
+        model: str,
+        api_key: str | None = None,
+        api_base: str | None = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(
+            model=model,
+            api_key=api_key,
+            api_base=api_base,
+            **kwargs,
+        )
+        self.api_key = api_key
+        self.api_base = api_base
+        self.client = openai.OpenAI(api_key=api_key, base_url=api_base)
+
+    def basic_request(self, prompt: str, **kwargs) -> Any:
+        raw_kwargs = kwargs
+        kwargs = {**self.kwargs, **kwargs}
+        if self.model_type == "chat":
+            messages = [{"role": "user", "content": prompt}]
+            system_prompt = getattr(self, "system_prompt", None)
+            if system_prompt:
+                messages.insert(
+                    0, {"role": "system", "content": system_prompt})
+            response = self.client.chat.completions.create(
+                messages=messages,  # type: ignore
+                **kwargs,
+            ).model_dump()
+        else:
+            response = self.client.completions.create(
+                prompt=prompt,
+                **kwargs,
+            ).model_dump()
+        self.history.append({
+            "prompt": prompt,
+            "response": response,
+            "kwargs": kwargs,
+            "raw_kwargs": raw_kwargs,
+        })
+        return response
+
+    def copy(self, **kwargs) -> "OpenAIEndpointLM":
+        copied_lm = copy(self)
+        copied_lm.kwargs = {**self.kwargs, **kwargs}
+        return copied_lm
+
+
+@dataclass(frozen=True)
+class EndpointStats:
+    requests: int
+    failures: int
+    ejections: int
+
+    def __str__(self) -> str:
+        return (
+            f"{self.requests} requests, {self.failures} failures, "
+            f"{self.ejections} ejections"
+        )
+
+
+class _EndpointPool:
+    """
+    Outstanding requests and health of the endpoints, shared by all copies of a pooled language model.
+    """
+
+    _endpoints: Sequence[str]
+    _eject_after: int
+    _eject_seconds: float
+    _lock: Lock
+    _outstanding: list[int]
+    _consecutive_failures: list[int]
+    _ejected_until: list[float]
+    _stats: list[EndpointStats]
+    _next: int
+
+    def __init__(
+        self,
+        endpoints: Sequence[str],
+        eject_after: int,
+        eject_seconds: float,
+    ) -> None:
+        self._endpoints = endpoints
+        self._eject_after = eject_after
+        self._eject_seconds = eject_seconds
+        self._lock = Lock()
+        self._outstanding = [0] * len(endpoints)
+        self._consecutive_failures = [0] * len(endpoints)
+        self._ejected_until = [0] * len(endpoints)
+        self._stats = [EndpointStats(0, 0, 0)] * len(endpoints)
+        self._next = 0
+
+    @property
+    def stats(self) -> dict[str, EndpointStats]:
+        with self._lock:
+            return dict(zip(self._endpoints, self._stats))
+
+    def acquire(self, excluded: set[int]) -> int | None:
+        """
+        Choose the healthy endpoint with the fewest outstanding requests (round-robin among ties), or the endpoint whose ejection ends first if all are ejected.
+        """
+        with self._lock:
+            now = perf_counter()
+            candidates = [
+                index
+                for index in range(len(self._endpoints))
+                if index not in excluded
+            ]
+            if len(candidates) == 0:
+                return None
+            healthy = [
+                index
+                for index in candidates
+                if self._ejected_until[index] <= now
+            ]
+            if len(healthy) > 0:
+                # Rotate the candidates, so that ties are broken round-robin.
+                rotation = self._next % len(self._endpoints)
+                self._next += 1
+                index = min(
+                    healthy,
+                    key=lambda index: (
+                        self._outstanding[index],
+                        (index - rotation) % len(self._endpoints),
+                    ),
+                )
+            else:
+                index = min(
+                    candidates,
+                    key=lambda index: self._ejected_until[index],
+                )
+            self._outstanding[index] += 1
+            return index
+
+    def release(self, index: int, failed: bool) -> None:
+        with self._lock:
+            self._outstanding[index] -= 1
+            stats = self._stats[index]
+            ejected = False
+            if failed:
+                self._consecutive_failures[index] += 1
+                if self._consecutive_failures[index] >= self._eject_after:
+                    self._consecutive_failures[index] = 0
+                    self._ejected_until[index] = \
+                        perf_counter() + self._eject_seconds
+                    ejected = True
+            else:
+                self._consecutive_failures[index] = 0
+            self._stats[index] = EndpointStats(
+                requests=stats.requests + 1,
+                failures=stats.failures + (1 if failed else 0),
+                ejections=stats.ejections + (1 if ejected else 0),
+            )
+        if ejected:
+            warn(RuntimeWarning(
+                f"Ejecting unhealthy endpoint {self._endpoints[index]} "
+                f"for {self._eject_seconds:g} s."))
+
+    def __getstate__(self) -> dict[str, Any]:
+        # Locks cannot be pickled or copied.
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+
+class PooledLM(LM):
+    """
+    Language model that spreads the requests across several endpoints serving the same model (e.g., Ollama or vLLM replicas).
+    Each request is routed to the endpoint with the fewest outstanding requests. Requests that fail with a retryable error (e.g., connection errors or 5xx) are retried on another endpoint, and endpoints that fail repeatedly are ejected for a while.
+    The endpoints' language models share their history. Copies share the endpoints' state.
+    """
+
+    lms: Sequence[LM]
+    _pool: _EndpointPool
+
+    def __init__(
+        self,
+        lms: Sequence[LM],
+        endpoints: Sequence[str],
+        eject_after: int = 3,
+        eject_seconds: float = 30,
+    ) -> None:
+        """
+        :param lms: The language models, one per endpoint.
+        :param endpoints: Names of the endpoints, e.g., their base URLs.
+        :param eject_after: Number of consecutive failures after which an endpoint is ejected.
+        :param eject_seconds: Time (in seconds) an ejected endpoint is not routed to.
+        """
+        if len(lms) == 0 or len(lms) != len(endpoints):
+            raise ValueError("Must provide one language model per endpoint.")
+        super().__init__(model=lms[0].kwargs.get("model"))
+        self._pool = _EndpointPool(endpoints, eject_after, eject_seconds)
+        self._set_lms(lms)
+        self.history: list[dict[str, Any]] = []
+        for lm in lms:
+            lm.history = self.history
+        self.provider = lms[0].provider
+
+    def _set_lms(self, lms: Sequence[LM]) -> None:
+        self.lms = lms
+        self.kwargs = lms[0].kwargs
+
+    @property
+    def stats(self) -> dict[str, EndpointStats]:
+        return self._pool.stats
+
+    def with_lms(self, lms: Sequence[LM]) -> "PooledLM":
+        """
+        Copy the pooled language model with other language models for the same endpoints (e.g., with other settings).
+        """
+        pooled_lm = copy(self)
+        pooled_lm._set_lms(lms)
+        return pooled_lm
+
+    def copy(self, **kwargs) -> LM:
+        # Re-initializing the endpoints' language models would lose their settings (e.g., Ollama's base URL).
+        return with_kwargs(self, **kwargs)
+
+    def _route(self, request: Callable[[LM], _T]) -> _T:
+        excluded: set[int] = set()
+        while True:
+            index = self._pool.acquire(excluded)
+            if index is None:
+                raise RuntimeError("No endpoint is available.")
+            try:
+                result = request(self.lms[index])
+            except Exception as error:
+                self._pool.release(index, failed=True)
+                excluded.add(index)
+                if _retry_after(error) is None or \
+                        len(excluded) == len(self.lms):
+                    raise
+                continue
+            self._pool.release(index, failed=False)
+            return result
+
+    def basic_request(self, prompt: str, **kwargs) -> Any:
+        return self._route(lambda lm: lm.basic_request(prompt, **kwargs))
+
+    def __call__(
+        self,
+        prompt: str,
+        only_completed: bool = True,
+        return_sorted: bool = False,
+        **kwargs,
+    ) -> list[Any]:
+        return self._route(lambda lm: lm(
+            prompt,
+            only_completed=only_completed,
+            return_sorted=return_sorted,
+            **kwargs,
+        ))
+
+
+def _strict_json_schema(json_schema: Any) -> Any:
+    # Strict structured outputs require closed objects.
+    if isinstance(json_schema, dict):
+        strict_json_schema = {
+            name: _strict_json_schema(value)
+            for name, value in json_schema.items()
+        }
+        if strict_json_schema.get("type") == "object":
+            strict_json_schema["additionalProperties"] = False
+        return strict_json_schema
+    elif isinstance(json_schema, list):
+        return [_strict_json_schema(value) for value in json_schema]
+    else:
+        return json_schema
+
+
+def _with_base_language_model(lm: LM, replace: Callable[[LM], LM]) -> LM:
+    # Copy the chain of wrapped language models, replacing the innermost language model (of each endpoint).
+    if isinstance(lm, PooledLM):
+        return lm.with_lms([
+            _with_base_language_model(endpoint_lm, replace)
+            for endpoint_lm in lm.lms
+        ])
+    if isinstance(lm, WrappedLM):
+        wrapped_lm = copy(lm)
+        wrapped_lm.lm = _with_base_language_model(lm.lm, replace)
+        wrapped_lm.kwargs = wrapped_lm.lm.kwargs
+        return wrapped_lm
+    return replace(lm)
+
+
+def with_json_schema(
+    lm: LM,
+    name: str,
+    json_schema: dict[str, Any],
+) -> LM:
+    """
+    Copy the language model such that its completions are constrained to the JSON schema, if the backend supports constrained decoding (OpenAI chat models and Ollama).
+    Otherwise, the language model is returned as is and completions are unconstrained.
+
+    :param lm: The language model to constrain (may be wrapped).
+    :param name: Name of the schema, e.g., the output type's name.
+    :param json_schema: The JSON schema that completions must conform to.
+    """
+    return _with_base_language_model(
+        lm, lambda base_lm: _with_json_schema(base_lm, name, json_schema))
+
+
+def _with_json_schema(
+    lm: LM,
+    name: str,
+    json_schema: dict[str, Any],
+) -> LM:
+    if isinstance(lm, DSPyOpenAI) and lm.model_type == "chat":
+        constrained_lm = copy(lm)
+        constrained_lm.kwargs = {
+            **lm.kwargs,
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": name,
+                    "schema": _strict_json_schema(json_schema),
+                    "strict": True,
+                },
+            },
+        }
+        return constrained_lm
+    elif isinstance(lm, OllamaLocal):
+        constrained_lm = copy(lm)
+        constrained_lm.format = json_schema
+        return constrained_lm
+    else:
+        warn(RuntimeWarning(
+            f"Constrained decoding is not supported for "
+            f"{type(lm).__name__}. Falling back to unconstrained decoding."))
+        return lm
+
+
+_OPENAI_STREAMING_PARAMETERS = {
+    "model",
+    "temperature",
+    "max_tokens",
+    "top_p",
+    "frequency_penalty",
+    "presence_penalty",
+    "response_format",
+    "stop",
+    "seed",
+}
+
+
+class StreamingLM(WrappedLM):
+    """
+    Language model that streams the completion of a JSON object and stops the generation as soon as a string field is complete or exceeds a number of sentences.
+    The completion is then a JSON object with just that field. Streaming is supported for OpenAI chat models and Ollama. Other language models, and requests for multiple completions, are not streamed.
+    """
+
+    field: str
+    max_sentences: int | None
+    max_tokens: int | None
+
+    def __init__(
+        self,
+        lm: LM,
+        field: str,
+        max_sentences: int | None = None,
+        max_tokens: int | None = None,
+    ) -> None:
+        """
+        :param lm: The language model to stream completions from.
+        :param field: Name of the JSON string field to stop after.
+        :param max_sentences: Maximum number of sentences of the field's value.
+        :param max_tokens: Maximum number of tokens to generate.
+        """
+        super().__init__(lm)
+        self.field = field
+        self.max_sentences = max_sentences
+        self.max_tokens = max_tokens
+
+    def completion_identity(self) -> str | None:
+        return (
+            f"StreamingLM(field={self.field!r}, "
+            f"max_sentences={self.max_sentences!r}, "
+            f"max_tokens={self.max_tokens!r})"
+        )
+
+    @staticmethod
+    def _stream_openai(
+        lm: DSPyOpenAI,
+        prompt: str,
+        kwargs: dict[str, Any],
+        terminator: StreamTerminator,
+    ) -> float | None:
+        messages = [{"role": "user", "content": prompt}]
+        system_prompt = getattr(lm, "system_prompt", None)
+        if system_prompt:
+            messages.insert(0, {"role": "system", "content": system_prompt})
+        client = lm.client if isinstance(lm, OpenAIEndpointLM) else openai
+        stream = cast(Stream[ChatCompletionChunk], client.chat.completions.create(
+            messages=messages,  # type: ignore
+            stream=True,
+            **{
+                name: value
+                for name, value in kwargs.items()
+                if name in _OPENAI_STREAMING_PARAMETERS
+            },
+        ))
+        first_token: float | None = None
+        try:
+            for chunk in stream:
+                if len(chunk.choices) == 0:
+                    continue
+                content = chunk.choices[0].delta.content
+                if content and first_token is None:
+                    first_token = perf_counter()
+                if content is not None and terminator.feed(content):
+                    break
+        finally:
+            # Closing the stream stops the generation.
+            stream.close()
+        return first_token
+
+    @staticmethod
+    def _stream_ollama(
+        lm: OllamaLocal,
+        prompt: str,
+        kwargs: dict[str, Any],
+        terminator: StreamTerminator,
+    ) -> float | None:
+        is_chat = lm.model_type == "chat"
+        options = {
+            name: value
+            for name, value in kwargs.items()
+            if name not in ("n", "max_tokens", "model")
+        }
+        options["num_predict"] = kwargs["max_tokens"]
+        request: dict[str, Any] = {
+            "model": getattr(lm, "model_name", kwargs.get("model")),
+            "options": options,
+            "stream": True,
+        }
+        if is_chat:
+            request["messages"] = [{"role": "user", "content": prompt}]
+        else:
+            request["prompt"] = prompt
+        if lm.format:
+            request["format"] = lm.format
+        if getattr(lm, "system", None):
+            request["system"] = lm.system
+        url = f"{lm.base_url}/api/{'chat' if is_chat else 'generate'}"
+        first_token: float | None = None
+        # Closing the connection stops the generation.
+        with post(url, json=request, stream=True, timeout=lm.timeout_s) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                data = loads(line)
+                content = (
+                    data.get("message", {}).get("content", "")
+                    if is_chat else data.get("response", "")
+                )
+                if content and first_token is None:
+                    first_token = perf_counter()
+                if terminator.feed(content) or data.get("done", False):
+                    break
+        return first_token
+
+    def __call__(
+        self,
+        prompt: str,
+        only_completed: bool = True,
+        return_sorted: bool = False,
+        **kwargs,
+    ) -> list[Any]:
+        request_kwargs = {**self.lm.kwargs, **kwargs}
+        if self.max_tokens is not None:
+            request_kwargs["max_tokens"] = self.max_tokens
+        terminator = JsonStringFieldTerminator(
+            field=self.field,
+            max_sentences=self.max_sentences,
+        )
+        if request_kwargs.get("n", 1) != 1:
+            return super().__call__(
+                prompt,
+                only_completed=only_completed,
+                return_sorted=return_sorted,
+                **kwargs,
+            )
+        start = perf_counter()
+        if isinstance(self.lm, DSPyOpenAI) and self.lm.model_type == "chat":
+            first_token = self._stream_openai(
+                self.lm, prompt, request_kwargs, terminator)
+        elif isinstance(self.lm, OllamaLocal):
+            first_token = self._stream_ollama(
+                self.lm, prompt, request_kwargs, terminator)
+        else:
+            warn(RuntimeWarning(
+                f"Streaming is not supported for {type(self.lm).__name__}. "
+                f"Falling back to full completions."))
+            return super().__call__(
+                prompt,
+                only_completed=only_completed,
+                return_sorted=return_sorted,
+                **kwargs,
+            )
+        completion = terminator.completion()
+        self.history.append({
+            "prompt": prompt,
+            "response": {
+                "choices": [{
+                    "text": completion,
+                    "message": {"content": completion},
+                }],
+                "first_token_seconds": (
+                    first_token - start if first_token is not None else None
+                ),
+            },
+            "kwargs": request_kwargs,
+            "raw_kwargs": kwargs,
+        })
+        return [completion]
+
+
+def with_streaming(
+    lm: LM,
+    field: str,
+    max_sentences: int | None = None,
+    max_tokens: int | None = None,
+) -> LM:
+    """
+    Copy the language model such that the completion of a JSON object is streamed and stopped early, see `StreamingLM`.
+
+    :param lm: The language model to stream completions from (may be wrapped).
+    :param field: Name of the JSON string field to stop after.
+    :param max_sentences: Maximum number of sentences of the field's value.
+    :param max_tokens: Maximum number of tokens to generate.
+    """
+    return _with_base_language_model(
+        lm,
+        lambda base_lm: StreamingLM(
+            lm=base_lm,
+            field=field,
+            max_sentences=max_sentences,
+            max_tokens=max_tokens,
+        ),
+    )
+
+
+def with_kwargs(lm: LM, **kwargs) -> LM:
+    """
+    Copy the language model with updated arguments (e.g., sampling parameters).
+    Unlike `LM.copy`, the language model is not re-initialized, so that settings outside the arguments (e.g., Ollama's base URL) are kept.
+
+    :param lm: The language model to copy (may be wrapped).
+    """
+    def _with_kwargs(base_lm: LM) -> LM:
+        copied_lm = copy(base_lm)
+        copied_lm.kwargs = {**base_lm.kwargs, **kwargs}
+        return copied_lm
+
+    return _with_base_language_model(lm, _with_kwargs)
+
+
+def _completion_identity(lm: LM) -> list[JsonValue]:
+    identity: list[JsonValue] = []
+    while isinstance(lm, (WrappedLM, PooledLM)):
+        if isinstance(lm, PooledLM):
+            # All endpoints serve the same model.
+            lm = lm.lms[0]
+            continue
+        wrapper_identity = lm.completion_identity()
+        if wrapper_identity is not None:
+            identity.append(wrapper_identity)
+        lm = lm.lm
+    lm_type = type(lm)
+    identity.append(f"{lm_type.__module__}.{lm_type.__qualname__}")
+    if isinstance(lm, OllamaLocal):
+        # Ollama sets the output format outside the arguments.
+        identity.append(repr(lm.format))
+    return identity
+
+
+class CachedLM(WrappedLM):
+    """
+    Language model that caches the completions in a persistent response cache.
+    Completions are keyed by the language model's type, settings, and arguments (e.g., model name and sampling parameters), the request arguments, and the prompt.
+    Note that with a non-zero temperature, reruns thus return the same sampled completions.
+    """
+
+    cache: ResponseCache
+
+    def __init__(self, lm: LM, cache: ResponseCache) -> None:
+        super().__init__(lm)
+        self.cache = cache
+
+    def __call__(
+        self,
+        prompt: str,
+        only_completed: bool = True,
+        return_sorted: bool = False,
+        **kwargs,
+    ) -> list[Any]:
+        key: dict[str, JsonValue] = {
+            "lm": _completion_identity(self.lm),
+            "kwargs": {
+                name: repr(value)
+                for name, value in {**self.lm.kwargs, **kwargs}.items()
+            },
+            "only_completed": only_completed,
+            "return_sorted": return_sorted,
+            "prompt": prompt,
+        }
+        completions = self.cache.get(key)
+        if isinstance(completions, list):
+            return completions
+        completions = super().__call__(
+            prompt,
+            only_completed=only_completed,
+            return_sorted=return_sorted,
+            **kwargs,
+        )
+        self.cache.put(key, completions)
+        return completions
+
+
+def init_draft_language_model(
+    language_model_name: str,
+    lm: LM | None = None,
+) -> LM:
+    """
+    Initialize a small, local language model, e.g., for drafting answers.
+    The model is served by Ollama if `OLLAMA_API_BASE` is set, and run with Hugging Face otherwise. The model is not configured as DSPy's default language model.
+
+    :param lm: The main language model. If given, the draft language model is wrapped like it, i.e., with the same response cache, rate limiter, and resilience policy, and instrumented if the main language model is.
+    """
+    draft_lm: LM
+    backend: str
     if "OLLAMA_API_BASE" in environ.keys():
+        endpoints = _endpoints(environ["OLLAMA_API_BASE"]) or \
+            [environ["OLLAMA_API_BASE"]]
         print(
-            f"Using Ollama language model '{language_model_name}' "
-            f"from {environ['OPENAI_API_BASE']}."
+            f"Using Ollama draft language model '{language_model_name}' "
+            f"from {', '.join(endpoints)}."
+        )
+        draft_lm = _pooled([
+            OllamaLocal(
+                model=language_model_name,
+                base_url=endpoint,
+            )
+            for endpoint in endpoints
+        ], endpoints)
+        backend = "ollama"
+    else:
+        print(
+            f"Using Hugging Face draft language model '{language_model_name}'."
         )
-        lm = OllamaLocal(
+        draft_lm = HFModel(
             model=language_model_name,
-            base_url=environ["OLLAMA_API_BASE"],
         )
+        backend = "huggingface"
+    if lm is None:
+        return draft_lm
+    cached_lm = find_language_model(lm, CachedLM)
+    rate_limited_lm = find_language_model(lm, RateLimitedLM)
+    resilient_lm = find_language_model(lm, ResilientLM)
+    return _wrap_language_model(
+        lm=draft_lm,
+        backend=backend,
+        tokenizer_name=language_model_name,
+        cache=cached_lm.cache if cached_lm is not None else None,
+        instrument=find_language_model(lm, InstrumentedLM) is not None,
+        rate_limiter=rate_limited_lm.rate_limiter
+        if rate_limited_lm is not None else None,
+        resilience_policy=resilient_lm.policy
+        if resilient_lm is not None else None,
+    )
+
+
+def _endpoints(value: str) -> list[str]:
+    # Endpoints are given as a comma-separated list, e.g., of replicas.
+    return [
+        endpoint.strip()
+        for endpoint in value.split(",")
+        if endpoint.strip() != ""
+    ]
+
+
+def _pooled(lms: Sequence[LM], endpoints: Sequence[str]) -> LM:
+    if len(lms) == 1:
+        return lms[0]
+    print(f"Routing language model requests across {len(lms)} endpoints.")
+    return PooledLM(lms=lms, endpoints=endpoints)
+
+
+def init_language_model_clients(
+    language_model_name: str,
+    cache_path: Path | None = None,
+    cache_ttl: timedelta | None = None,
+    cache_max_size: int | None = None,
+    instrument: bool = False,
+    rate_limiter: RateLimiter | None = None,
+    resilience_policy: ResiliencePolicy | None = None,
+    local_inference_backend: Literal[
+        "torch",
+        "torch-int8",
+    ] = "torch",
+    local_max_batch_size: int = 8,
+) -> LM:
+    lm: LM
+    backend: str
+    # Count tokens for the original model name (e.g., before mapping Blablador's model names).
+    tokenizer_name = language_model_name
+    if language_model_name.startswith("local/"):
+        print(
+            f"Using local language model '{language_model_name}' "
+            f"({local_inference_backend}, batches of up to "
+            f"{local_max_batch_size})."
+        )
+        # Import lazily, as the local backend requires PyTorch.
+        from mibi.utils.local_language_model import LocalLM
+        lm = LocalLM(
+            model=language_model_name,
+            inference_backend=local_inference_backend,
+            max_batch_size=local_max_batch_size,
+        )
+        backend = "local"
+    elif "OLLAMA_API_BASE" in environ.keys():
+        endpoints = _endpoints(environ["OLLAMA_API_BASE"]) or \
+            [environ["OLLAMA_API_BASE"]]
+        print(
+            f"Using Ollama language model '{language_model_name}' "
+            f"from {', '.join(endpoints)}."
+        )
+        lm = _pooled([
+            OllamaLocal(
+                model=language_model_name,
+                base_url=endpoint,
+            )
+            for endpoint in endpoints
+        ], endpoints)
+        backend = "ollama"
     elif "OPENAI_API_KEY" in environ.keys():
+        endpoints = _endpoints(environ.get("OPENAI_API_BASE", ""))
         print(
             f"Using OpenAI language model '{language_model_name}' "
-            f"from {environ.get('OPENAI_API_BASE', 'default enpoint')}."
+            f"from {', '.join(endpoints) or 'default enpoint'}."
         )
         if (
             "helmholtz-blablador.fz-juelich.de" in environ.get("OPENAI_API_BASE", "") and
                 language_model_name in _BLABLADOR_MODEL_NAMES.keys()):
             language_model_name = _BLABLADOR_MODEL_NAMES[language_model_name]
-        lm = DSPyOpenAI(
-            model=language_model_name,
-            api_key=environ["OPENAI_API_KEY"],
-            api_base=environ.get("OPENAI_API_BASE")
-        )
+        if len(endpoints) > 1:
+            lm = _pooled([
+                OpenAIEndpointLM(
+                    model=language_model_name,
+                    api_key=environ["OPENAI_API_KEY"],
+                    api_base=endpoint,
+                )
+                for endpoint in endpoints
+            ], endpoints)
+        else:
+            lm = DSPyOpenAI(
+                model=language_model_name,
+                api_key=environ["OPENAI_API_KEY"],
+                api_base=environ.get("OPENAI_API_BASE")
+            )
+        backend = "openai"
     else:
         print(
             f"Using Hugging Face language model '{language_model_name}'."
@@ -43,7 +1262,61 @@ def init_language_model_clients(language_model_name: str) -> LM:
         lm = HFModel(
             model=language_model_name,
         )
+        backend = "huggingface"
+    lm = _wrap_language_model(
+        lm=lm,
+        backend=backend,
+        tokenizer_name=tokenizer_name,
+        cache=ResponseCache(
+            path=cache_path,
+            ttl=cache_ttl,
+            max_size=cache_max_size,
+        ) if cache_path is not None else None,
+        instrument=instrument,
+        rate_limiter=rate_limiter,
+        resilience_policy=resilience_policy,
+    )
     dspy_settings.configure(
         lm=lm,
     )
     return lm
+
+
+def _wrap_language_model(
+    lm: LM,
+    backend: str,
+    tokenizer_name: str,
+    cache: ResponseCache | None,
+    instrument: bool,
+    rate_limiter: RateLimiter | None,
+    resilience_policy: ResiliencePolicy | None,
+) -> LM:
+    if instrument:
+        # Wrap before caching, so that only actual requests are measured.
+        lm = InstrumentedLM(lm)
+    if resilience_policy is not None:
+        # Wrap before rate limiting, so that each attempt waits for the rate limit, but the latency does not include waiting.
+        print(
+            f"Retrying and hedging language model requests as "
+            f"'{backend}'.")
+        lm = ResilientLM(
+            lm=lm,
+            backend=backend,
+            policy=resilience_policy,
+        )
+    if rate_limiter is not None and backend in rate_limiter.limits:
+        # Wrap before caching, so that cached responses are not limited.
+        print(f"Rate limiting language model requests as '{backend}'.")
+        lm = RateLimitedLM(
+            lm=lm,
+            language_model_name=tokenizer_name,
+            rate_limiter=rate_limiter,
+            rate_limit_name=backend,
+        )
+    if cache is not None:
+        print(f"Caching language model responses at: {cache.path}")
+        lm = CachedLM(
+            lm=lm,
+            cache=cache,
+        )
+    return lm
@@ -0,0 +1,434 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from queue import Empty, Queue
+from threading import Lock, Thread
+from time import perf_counter
+from typing import Any, Sequence, TypeAlias, cast
+
+from dsp import LM
+from torch import Tensor, bfloat16, cumsum, device as torch_device, float32, inference_mode, multinomial, softmax, sort, tensor
+from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer, DynamicCache, GenerationMixin, PreTrainedModel, PreTrainedTokenizerBase
+
+from mibi.utils.quantization import InferenceBackend, quantize_int8
+from mibi.utils.registry import model_registry
+from mibi.utils.token_counting import HUGGING_FACE_MODEL_NAMES
+
+
+# Keys and values of each layer, in the legacy format. Unlike cache objects, the legacy format is not updated in-place by the model, so it can be kept and truncated.
+_PastKeyValues: TypeAlias = tuple[tuple[Tensor, Tensor], ...]
+
+
+@dataclass(frozen=True)
+class LocalInferenceStats:
+    requests: int
+    batches: int
+    prompt_tokens: int
+    reused_prompt_tokens: int
+
+    @property
+    def mean_batch_size(self) -> float:
+        if self.batches == 0:
+            return 0
+        return self.requests / self.batches
+
+    @property
+    def reused_prompt_tokens_ratio(self) -> float:
+        if self.prompt_tokens == 0:
+            return 0
+        return self.reused_prompt_tokens / self.prompt_tokens
+
+    def __str__(self) -> str:
+        return (
+            f"{self.requests} requests in {self.batches} batches "
+            f"({self.mean_batch_size:.1f} per batch), "
+            f"{self.prompt_tokens} prompt tokens "
+            f"({self.reused_prompt_tokens_ratio:.0%} reused from cache)"
+        )
+
+
+@dataclass(frozen=True)
+class _GenerationRequest:
+    prompt: str
+    max_new_tokens: int
+    temperature: float
+    top_p: float
+    future: "Future[str]"
+
+
+def _truncate(past_key_values: _PastKeyValues, length: int) -> _PastKeyValues:
+    return tuple(
+        (keys[:, :, :length, :], values[:, :, :length, :])
+        for keys, values in past_key_values
+    )
+
+
+def _legacy_cache(past_key_values: Any) -> _PastKeyValues:
+    # Newer Transformers versions return cache objects.
+    to_legacy_cache = getattr(past_key_values, "to_legacy_cache", None)
+    if callable(to_legacy_cache):
+        return to_legacy_cache()
+    return past_key_values
+
+
+def _model_cache(past_key_values: _PastKeyValues | None) -> DynamicCache | None:
+    # Newer Transformers versions only accept cache objects. The cache object is updated by the model, but not the legacy keys and values it is created from.
+    if past_key_values is None:
+        return None
+    return DynamicCache.from_legacy_cache(past_key_values)  # type: ignore
+
+
+def _empty_model(model_name: str) -> PreTrainedModel:
+    # Build the model's modules on the meta device, without loading the weights.
+    config = AutoConfig.from_pretrained(model_name)
+    with torch_device("meta"):
+        return AutoModelForCausalLM.from_config(config, torch_dtype=float32)
+
+
+def _common_prefix_length(tokens: Sequence[int], other_tokens: Sequence[int]) -> int:
+    length = 0
+    for token, other_token in zip(tokens, other_tokens):
+        if token != other_token:
+            break
+        length += 1
+    return length
+
+
+class _PrefixCache:
+    """
+    Least recently used cache of the keys and values computed for prompts, to be reused for later prompts with the same prefix.
+    """
+
+    _max_size: int
+    _entries: OrderedDict[tuple[int, ...], _PastKeyValues]
+
+    def __init__(self, max_size: int) -> None:
+        self._max_size = max_size
+        self._entries = OrderedDict()
+
+    def get(
+        self,
+        input_ids: Sequence[int],
+    ) -> tuple[int, _PastKeyValues | None]:
+        """
+        Find the cached keys and values for the longest prefix of the input (except the last token, which must be computed to predict the next token).
+        """
+        best_length = 0
+        best_key: tuple[int, ...] | None = None
+        for key in self._entries.keys():
+            length = min(
+                _common_prefix_length(key, input_ids),
+                len(input_ids) - 1,
+            )
+            if length > best_length:
+                best_length = length
+                best_key = key
+        if best_key is None:
+            return 0, None
+        self._entries.move_to_end(best_key)
+        return best_length, _truncate(self._entries[best_key], best_length)
+
+    def put(self, input_ids: Sequence[int], past_key_values: _PastKeyValues) -> None:
+        if self._max_size == 0:
+            return
+        self._entries[tuple(input_ids)] = past_key_values
+        self._entries.move_to_end(tuple(input_ids))
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+
+def _sample(logits: Tensor, temperature: float, top_p: float) -> int:
+    if temperature <= 0:
+        return int(logits.argmax())
+    probabilities = softmax(logits.float() / temperature, dim=-1)
+    sorted_probabilities, indices = sort(probabilities, descending=True)
+    # Nucleus sampling: keep the smallest set of tokens whose probability exceeds top-p.
+    cumulative_probabilities = cumsum(sorted_probabilities, dim=-1)
+    sorted_probabilities[
+        cumulative_probabilities - sorted_probabilities > top_p] = 0
+    sorted_probabilities /= sorted_probabilities.sum()
+    return int(indices[multinomial(sorted_probabilities, 1)])
+
+
+class LocalInferenceEngine:
+    """
+    Generate completions with a local Hugging Face model on the CPU.
+
+    Prompts submitted concurrently (e.g., when answering questions concurrently) are collected for a short time and generated as one batch. Single prompts reuse the keys and values (KV cache) of the longest prefix shared with previous prompts, e.g., when a prediction is retried with feedback, when answers are sampled repeatedly for the same question, or when the exact and ideal answers are predicted jointly.
+    """
+
+    _model: PreTrainedModel
+    _tokenizer: PreTrainedTokenizerBase
+    _max_batch_size: int
+    _max_batch_wait: float
+    _min_prefix_tokens: int
+    _queue: "Queue[_GenerationRequest]"
+    _prefix_cache: _PrefixCache
+    _lock: Lock
+    _stats: LocalInferenceStats
+
+    def __init__(
+        self,
+        model_name: str,
+        inference_backend: InferenceBackend = "torch",
+        max_batch_size: int = 8,
+        max_batch_wait: float = 0.05,
+        prefix_cache_size: int = 4,
+        min_prefix_tokens: int = 32,
+    ) -> None:
+        """
+        :param model_name: Name of the model on the Hugging Face Hub.
+        :param inference_backend: Run the model in bfloat16 (`torch`), or quantized to int8 (`torch-int8`).
+        :param max_batch_size: Maximum number of prompts to generate at once.
+        :param max_batch_wait: Maximum time (in seconds) to wait for more prompts before generating a batch.
+        :param prefix_cache_size: Number of prompts to keep the keys and values of.
+        :param min_prefix_tokens: Minimum number of shared prefix tokens to reuse keys and values.
+        """
+        self._tokenizer = AutoTokenizer.from_pretrained(model_name)
+        if inference_backend == "torch":
+            self._model = AutoModelForCausalLM.from_pretrained(
+                model_name,
+                torch_dtype=bfloat16,
+                low_cpu_mem_usage=True,
+            ).eval()
+        elif inference_backend == "torch-int8":
+            # Dynamic quantization requires full-precision linear layers.
+            self._model = cast(PreTrainedModel, quantize_int8(
+                model_name=model_name,
+                load=lambda: AutoModelForCausalLM.from_pretrained(
+                    model_name,
+                    torch_dtype=float32,
+                    low_cpu_mem_usage=True,
+                ),
+                skeleton=lambda: _empty_model(model_name),
+            )).eval()
+        else:
+            raise ValueError(
+                f"Unknown inference backend: {inference_backend}")
+        self._max_batch_size = max_batch_size
+        self._max_batch_wait = max_batch_wait
+        self._min_prefix_tokens = min_prefix_tokens
+        self._queue = Queue()
+        self._prefix_cache = _PrefixCache(prefix_cache_size)
+        self._lock = Lock()
+        self._stats = LocalInferenceStats(0, 0, 0, 0)
+        Thread(target=self._run, daemon=True).start()
+
+    @property
+    def stats(self) -> LocalInferenceStats:
+        with self._lock:
+            return self._stats
+
+    def _count(self, requests: int, prompt_tokens: int, reused_prompt_tokens: int) -> None:
+        with self._lock:
+            self._stats = LocalInferenceStats(
+                requests=self._stats.requests + requests,
+                batches=self._stats.batches + 1,
+                prompt_tokens=self._stats.prompt_tokens + prompt_tokens,
+                reused_prompt_tokens=self._stats.reused_prompt_tokens +
+                reused_prompt_tokens,
+            )
+
+    def _input_ids(self, prompt: str) -> list[int]:
+        # Only tokenize on the generation thread, as tokenizers are not thread-safe.
+        if getattr(self._tokenizer, "chat_template", None) is not None:
+            return cast(list[int], self._tokenizer.apply_chat_template(
+                [{"role": "user", "content": prompt}],
+                add_generation_prompt=True,
+            ))
+        return self._tokenizer.encode(prompt)
+
+    def submit(
+        self,
+        prompt: str,
+        max_new_tokens: int,
+        temperature: float = 0,
+        top_p: float = 1,
+    ) -> "Future[str]":
+        future: Future[str] = Future()
+        self._queue.put(_GenerationRequest(
+            prompt=prompt,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            future=future,
+        ))
+        return future
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = perf_counter() + self._max_batch_wait
+            while len(batch) < self._max_batch_size:
+                timeout = deadline - perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except Empty:
+                    break
+            # Only prompts with the same sampling parameters can be generated together.
+            groups: dict[tuple[float, float], list[_GenerationRequest]] = {}
+            for request in batch:
+                groups.setdefault(
+                    (request.temperature, request.top_p), []).append(request)
+            for requests in groups.values():
+                try:
+                    if len(requests) == 1:
+                        completions = [self._generate_single(requests[0])]
+                    else:
+                        completions = self._generate_batch(requests)
+                except Exception as error:
+                    for request in requests:
+                        request.future.set_exception(error)
+                    continue
+                for request, completion in zip(requests, completions):
+                    request.future.set_result(completion)
+
+    @inference_mode()
+    def _generate_single(self, request: _GenerationRequest) -> str:
+        input_ids = self._input_ids(request.prompt)
+        prefix_length, past_key_values = self._prefix_cache.get(input_ids)
+        if prefix_length < self._min_prefix_tokens:
+            prefix_length, past_key_values = 0, None
+        self._count(1, len(input_ids), prefix_length)
+
+        output = self._model(
+            input_ids=tensor([input_ids[prefix_length:]]),
+            past_key_values=_model_cache(past_key_values),
+            use_cache=True,
+        )
+        self._prefix_cache.put(
+            input_ids, _legacy_cache(output.past_key_values))
+
+        eos_token_id = self._tokenizer.eos_token_id
+        generated: list[int] = []
+        logits = output.logits[0, -1]
+        while len(generated) < request.max_new_tokens:
+            token = _sample(logits, request.temperature, request.top_p)
+            if token == eos_token_id:
+                break
+            generated.append(token)
+            output = self._model(
+                input_ids=tensor([[token]]),
+                past_key_values=output.past_key_values,
+                use_cache=True,
+            )
+            logits = output.logits[0, -1]
+        return self._tokenizer.decode(generated, skip_special_tokens=True)
+
+    @inference_mode()
+    def _generate_batch(self, requests: Sequence[_GenerationRequest]) -> list[str]:
+        batch_input_ids = [
+            self._input_ids(request.prompt)
+            for request in requests
+        ]
+        self._count(
+            len(requests),
+            sum(len(input_ids) for input_ids in batch_input_ids),
+            0,
+        )
+        pad_token_id = self._tokenizer.pad_token_id
+        if pad_token_id is None:
+            pad_token_id = self._tokenizer.eos_token_id
+        # Pad on the left, so that all prompts end right before the generated tokens.
+        input_length = max(len(input_ids) for input_ids in batch_input_ids)
+        input_ids = tensor([
+            [pad_token_id] * (input_length - len(request_input_ids)) +
+            request_input_ids
+            for request_input_ids in batch_input_ids
+        ])
+        attention_mask = tensor([
+            [0] * (input_length - len(request_input_ids)) +
+            [1] * len(request_input_ids)
+            for request_input_ids in batch_input_ids
+        ])
+        temperature = requests[0].temperature
+        sampling_kwargs: dict[str, Any] = dict(
+            do_sample=True,
+            temperature=temperature,
+            top_p=requests[0].top_p,
+        ) if temperature > 0 else dict(do_sample=False)
+        # Without `return_dict_in_generate`, only the output IDs are returned.
+        output_ids = cast(Tensor, cast(GenerationMixin, self._model).generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            max_new_tokens=max(request.max_new_tokens for request in requests),
+            pad_token_id=pad_token_id,
+            **sampling_kwargs,
+        ))
+        return [
+            self._tokenizer.decode(
+                output_ids[index, input_length:input_length + request.max_new_tokens],
+                skip_special_tokens=True,
+            )
+            for index, request in enumerate(requests)
+        ]
+
+
+class LocalLM(LM):
+    """
+    Language model that runs a Hugging Face model locally, with dynamic batching of concurrent prompts, optional int8 quantization, and reuse of the keys and values of shared prompt prefixes (see `LocalInferenceEngine`).
+    The model is loaded only once per process.
+    """
+
+    engine: LocalInferenceEngine
+
+    def __init__(
+        self,
+        model: str,
+        inference_backend: InferenceBackend = "torch",
+        max_batch_size: int = 8,
+    ) -> None:
+        """
+        :param model: Name of the model, e.g., `local/Mistral-7B-Instruct-v0.2`.
+        """
+        super().__init__(model=model)
+        self.provider = "local"
+        model_name = model.removeprefix("local/")
+        model_name = HUGGING_FACE_MODEL_NAMES.get(model_name, model_name)
+        self.engine = model_registry.get(
+            f"local-lm:{model_name}:{inference_backend}:{max_batch_size}",
+            lambda: LocalInferenceEngine(
+                model_name=model_name,
+                inference_backend=inference_backend,
+                max_batch_size=max_batch_size,
+            ),
+        )
+
+    def basic_request(self, prompt: str, **kwargs) -> Any:
+        raw_kwargs = kwargs
+        kwargs = {**self.kwargs, **kwargs}
+        futures = [
+            self.engine.submit(
+                prompt=prompt,
+                max_new_tokens=kwargs["max_tokens"],
+                temperature=kwargs.get("temperature", 0),
+                top_p=kwargs.get("top_p", 1),
+            )
+            for _ in range(kwargs.get("n", 1))
+        ]
+        response = {
+            "prompt": prompt,
+            "choices": [
+                {"text": future.result()}
+                for future in futures
+            ],
+        }
+        self.history.append({
+            "prompt": prompt,
+            "response": response,
+            "kwargs": kwargs,
+            "raw_kwargs": raw_kwargs,
+        })
+        return response
+
+    def __call__(
+        self,
+        prompt: str,
+        only_completed: bool = True,
+        return_sorted: bool = False,
+        **kwargs,
+    ) -> list[Any]:
+        response = self.basic_request(prompt, **kwargs)
+        return [choice["text"] for choice in response["choices"]]
@@ -1,9 +1,10 @@
 from abc import abstractmethod
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Generic, TypeVar
+from time import perf_counter
+from typing import Any, Generic, NamedTuple, TypeVar
 
-from pandas import DataFrame, concat
+from pandas import DataFrame, Series, concat
 from pyterrier.transformer import Transformer
 from pyterrier.model import add_ranks
 
@@ -14,6 +15,67 @@ from mibi.modules import ABCModule
 _T = TypeVar("_T")
 
 
+PASSAGE_SEPARATOR = "%p"
+
+# Typed columns that passages carry in addition to their docno.
+PASSAGE_COLUMNS = (
+    "pmid",
+    "snippet_begin_section",
+    "snippet_offset_in_begin_section",
+    "snippet_end_section",
+    "snippet_offset_in_end_section",
+)
+
+
+def passage_docno(docno: str, snippet: Snippet) -> str:
+    return (
+        f"{docno}{PASSAGE_SEPARATOR}("
+        f"{snippet.begin_section},"
+        f"{snippet.offset_in_begin_section:d},"
+        f"{snippet.end_section},"
+        f"{snippet.offset_in_end_section:d})"
+    )
+
+
+def is_passage(topics_or_res: DataFrame) -> Series:
+    """
+    Whether the rows are passages, i.e., have a snippet section (documents have none).
+    """
+    if "snippet_begin_section" not in topics_or_res.columns:
+        return Series(False, index=topics_or_res.index)
+    return topics_or_res["snippet_begin_section"].notna()
+
+
+def pmids(topics_or_res: DataFrame) -> Series:
+    """
+    Get the PubMed IDs of documents or passages, from the typed `pmid` column of passages or the docno of documents.
+    """
+    if "pmid" not in topics_or_res.columns:
+        return topics_or_res["docno"]
+    return topics_or_res["pmid"].fillna(topics_or_res["docno"])
+
+
+def _deduplicate(topics_or_res: DataFrame) -> DataFrame:
+    """
+    Keep only the first row per query and docno.
+    """
+    subset = ["qid", "docno"] if "qid" in topics_or_res.columns else ["docno"]
+    is_duplicate = topics_or_res.duplicated(subset=subset, keep="first")
+    if is_duplicate.any():
+        topics_or_res = topics_or_res[~is_duplicate]
+    return topics_or_res
+
+
+def _sort_and_rank(topics_or_res: DataFrame) -> DataFrame:
+    if "score" in topics_or_res.columns:
+        topics_or_res = topics_or_res.sort_values(
+            by=["qid", "score"],
+            ascending=[True, False],
+        )
+        topics_or_res = add_ranks(topics_or_res)
+    return topics_or_res.reset_index(drop=True)
+
+
 @dataclass(frozen=True)
 class PyTerrierModule(Generic[_T], ABCModule):
     transformer: Transformer
@@ -61,7 +123,8 @@ class PyTerrierModule(Generic[_T], ABCModule):
         docno = document_data.pop("docno")
         return {
             **document_data,
-            "docno": f"{docno}%p({snippet.begin_section},{snippet.offset_in_begin_section:d},{snippet.end_section},{snippet.offset_in_end_section:d})",
+            "docno": passage_docno(docno, snippet),
+            "pmid": docno,
             "text": snippet.text,
             "snippet_begin_section": snippet.begin_section,
             "snippet_offset_in_begin_section": snippet.offset_in_begin_section,
@@ -213,6 +276,192 @@ class CutoffRerank(Transformer):
         return topics_or_res
 
 
+class CascadeStage(NamedTuple):
+    """
+    Stage of a re-ranking cascade.
+
+    :param name: Name of the stage (used when printing timings).
+    :param reranker: Re-ranker to apply to the top candidates.
+    :param cutoff: Number of top candidates to re-rank.
+    :param skip_margin: Skip the stage for queries where all adjacent scores of the top candidates differ by at least this margin. Defaults to never skipping.
+    """
+    name: str
+    reranker: Transformer
+    cutoff: int
+    skip_margin: float | None = None
+
+
+def _min_score_margin(res: DataFrame, cutoff: int) -> float:
+    scores = res["score"].nlargest(cutoff)
+    if len(scores) < 2:
+        return float("inf")
+    return float((scores.shift(1) - scores).iloc[1:].min())
+
+
+@dataclass(frozen=True)
+class Cascade(Transformer):
+    """
+    Generalization of `CutoffRerank` to multiple re-ranking stages, each with its own cutoff.
+    Stages can be skipped per query if the current scores already separate the top candidates clearly.
+
+    :param candidates: Transformer to retrieve the initial candidates.
+    :param stages: Re-ranking stages, applied in order.
+    :param verbose: Whether to print the time spent per stage. Defaults to `False`.
+    """
+
+    candidates: Transformer
+    stages: tuple[CascadeStage, ...]
+    verbose: bool = False
+
+    def _transform_stage(self, stage: CascadeStage, topics_or_res: DataFrame) -> DataFrame:
+        skipped_qids: set[Any] = set()
+        if stage.skip_margin is not None and "score" in topics_or_res.columns:
+            skipped_qids = {
+                qid
+                for qid, res in topics_or_res.groupby(by="qid", sort=False)
+                if _min_score_margin(res, stage.cutoff) >= stage.skip_margin
+            }
+        is_skipped = topics_or_res["qid"].isin(skipped_qids)
+
+        start = perf_counter()
+        reranked: DataFrame | None = None
+        if not is_skipped.all():
+            res = topics_or_res[~is_skipped]
+            pipeline = Transformer.from_df(
+                input=res,
+                uniform=True,
+            )
+            pipeline = ((pipeline % stage.cutoff) >> stage.reranker) ^ pipeline
+            reranked = pipeline.transform(res)
+        duration = perf_counter() - start
+
+        if self.verbose:
+            num_queries = topics_or_res["qid"].nunique()
+            print(
+                f"Cascade stage '{stage.name}' took {duration:.3f}s "
+                f"({num_queries - len(skipped_qids)} queries re-ranked, "
+                f"{len(skipped_qids)} skipped).")
+
+        if reranked is None:
+            return topics_or_res
+        elif len(skipped_qids) == 0:
+            return reranked
+        topics_or_res = concat([reranked, topics_or_res[is_skipped]])
+        topics_or_res.reset_index(drop=True, inplace=True)
+        return topics_or_res
+
+    def transform(self, topics_or_res: DataFrame) -> DataFrame:
+        start = perf_counter()
+        topics_or_res = self.candidates.transform(topics_or_res)
+        if self.verbose:
+            print(
+                f"Cascade candidates took {perf_counter() - start:.3f}s.")
+
+        for stage in self.stages:
+            if len(topics_or_res) == 0:
+                break
+            topics_or_res = self._transform_stage(stage, topics_or_res)
+
+        return topics_or_res
+
+
+def sliding_windows(
+    num_candidates: int,
+    window_size: int,
+    stride: int,
+    max_comparisons: int | None = None,
+) -> list[tuple[int, int]]:
+    """
+    Get the (start, end) positions of the windows to re-rank pairwise, from the bottom to the top of the ranking.
+    If the number of comparisons is limited, the windows closest to the top are kept. If not even one window fits the limit, only the top window is kept, shrunk to fit.
+    """
+    if window_size < 2:
+        raise ValueError("Window size must be at least 2.")
+    if not 0 < stride < window_size:
+        raise ValueError("Stride must be positive and smaller than the window size.")
+    if max_comparisons is not None and max_comparisons < 2:
+        raise ValueError("Maximum comparisons must be at least 2.")
+    if num_candidates < 2:
+        return []
+    window_size = min(window_size, num_candidates)
+    starts = [*range(num_candidates - window_size, 0, -stride), 0]
+    if max_comparisons is not None:
+        max_windows = max_comparisons // (window_size * (window_size - 1))
+        if max_windows == 0:
+            # Shrink the top window to the largest size within the limit.
+            while window_size * (window_size - 1) > max_comparisons:
+                window_size -= 1
+            return [(0, window_size)]
+        starts = starts[max(0, len(starts) - max_windows):]
+    return [(start, start + window_size) for start in starts]
+
+
+def num_pairwise_comparisons(windows: list[tuple[int, int]]) -> int:
+    """
+    Number of (ordered) pairwise comparisons needed to re-rank all windows.
+    """
+    return sum(
+        (end - start) * (end - start - 1)
+        for start, end in windows
+    )
+
+
+@dataclass(frozen=True)
+class SlidingWindowPairwiseRerank(Transformer):
+    """
+    Re-rank the candidates with a pairwise re-ranker (e.g., duoT5) in overlapping windows that slide from the bottom to the top of the current ranking.
+    Each window is re-ranked with all pairs, so the number of comparisons grows linearly with the number of candidates instead of quadratically.
+
+    :param reranker: Pairwise re-ranker that compares all pairs of its input.
+    :param window_size: Number of candidates per window. Defaults to 4 candidates.
+    :param stride: Number of candidates to slide the window by. Must be smaller than the window size. Defaults to 2 candidates.
+    :param max_comparisons: Maximum number of pairwise comparisons per query. Defaults to no limit.
+    """
+
+    reranker: Transformer
+    window_size: int = 4
+    stride: int = 2
+    max_comparisons: int | None = None
+
+    def _transform_query(self, res: DataFrame) -> DataFrame:
+        if "score" in res.columns:
+            res = res.sort_values(by="score", ascending=False)
+        res = res.reset_index(drop=True)
+
+        ranking: list[int] = list(res.index)
+        for start, end in sliding_windows(
+            num_candidates=len(ranking),
+            window_size=self.window_size,
+            stride=self.stride,
+            max_comparisons=self.max_comparisons,
+        ):
+            window = res.loc[ranking[start:end]]
+            window_index = dict(zip(window["docno"], ranking[start:end]))
+            reranked = self.reranker.transform(window)
+            reranked = reranked.sort_values(by="score", ascending=False)
+            ranking[start:end] = [
+                window_index[docno] for docno in reranked["docno"]
+            ]
+
+        res = res.loc[ranking].reset_index(drop=True)
+        res["score"] = [float(len(res) - rank) for rank in range(len(res))]
+        return res
+
+    def transform(self, topics_or_res: DataFrame) -> DataFrame:
+        if not {"qid", "docno"}.issubset(topics_or_res.columns):
+            raise RuntimeError("Needs qid and docno columns.")
+        if len(topics_or_res) == 0:
+            return topics_or_res
+
+        topics_or_res = concat([
+            self._transform_query(res)
+            for _, res in topics_or_res.groupby(by="qid", sort=False)
+        ])
+        topics_or_res.reset_index(drop=True, inplace=True)
+        topics_or_res = add_ranks(topics_or_res)
+        return topics_or_res
+
+
 @dataclass(frozen=True)
 class MaybeDePassager(Transformer):
     """
@@ -229,28 +478,23 @@ class MaybeDePassager(Transformer):
         if topics_or_res["docno"].isna().any():
             raise RuntimeError("Empty docno found.")
 
-        topics_or_res = topics_or_res.copy()
-
-        is_passage = topics_or_res["docno"].str.contains("%p")
-        topics_or_res = concat([
-            topics_or_res[~is_passage],
-            self.de_passager.transform(
-                topics_or_res[is_passage].reset_index()
-            ) if len(topics_or_res[is_passage]) else topics_or_res[is_passage],
-        ])
-
-        topics_or_res = topics_or_res.groupby("docno").first().reset_index()
-
-        if "score" in topics_or_res.columns:
-            topics_or_res.sort_values(
-                by=["qid", "score"],
-                ascending=[True, False],
-                inplace=True,
-            )
-            topics_or_res = add_ranks(topics_or_res)
-
-        topics_or_res.reset_index(drop=True, inplace=True)
-        return topics_or_res
+        passages = is_passage(topics_or_res)
+        if passages.any():
+            de_passaged = self.de_passager.transform(
+                topics_or_res[passages].reset_index(drop=True))
+            # De-passaged rows are documents, so drop the passage columns.
+            de_passaged = de_passaged.drop(columns=[
+                col for col in PASSAGE_COLUMNS if col in de_passaged.columns])
+            if passages.all():
+                topics_or_res = de_passaged
+            else:
+                topics_or_res = concat(
+                    [topics_or_res[~passages], de_passaged],
+                    ignore_index=True,
+                )
+
+        topics_or_res = _deduplicate(topics_or_res)
+        return _sort_and_rank(topics_or_res)
 
 
 @dataclass(frozen=True)
@@ -269,28 +513,20 @@ class MaybePassager(Transformer):
         if topics_or_res["docno"].isna().any():
             raise RuntimeError("Empty docno found.")
 
-        topics_or_res = topics_or_res.copy()
-
-        is_passage = topics_or_res["docno"].str.contains("%p")
-        topics_or_res = concat([
-            topics_or_res[is_passage],
-            self.passager.transform(
-                topics_or_res[~is_passage].reset_index()
-            ) if len(topics_or_res[~is_passage]) else topics_or_res[~is_passage],
-        ])
-
-        topics_or_res = topics_or_res.groupby("docno").first().reset_index()
+        passages = is_passage(topics_or_res)
+        if not passages.all():
+            passaged = self.passager.transform(
+                topics_or_res[~passages].reset_index(drop=True))
+            if not passages.any():
+                topics_or_res = passaged
+            else:
+                topics_or_res = concat(
+                    [topics_or_res[passages], passaged],
+                    ignore_index=True,
+                )
 
-        if "score" in topics_or_res.columns:
-            topics_or_res.sort_values(
-                by=["qid", "score"],
-                ascending=[True, False],
-                inplace=True,
-            )
-            topics_or_res = add_ranks(topics_or_res)
-
-        topics_or_res.reset_index(drop=True, inplace=True)
-        return topics_or_res
+        topics_or_res = _deduplicate(topics_or_res)
+        return _sort_and_rank(topics_or_res)
 
 
 @dataclass(frozen=True)
@@ -302,16 +538,13 @@ class WithDocumentIds(Transformer):
     transformer: Transformer
 
     def transform(self, topics_or_res: DataFrame) -> DataFrame:
-        topics_or_res = topics_or_res.copy()
-
-        topics_or_res["olddocno"] = topics_or_res["docno"]
-        topics_or_res[["docno", "pid"]] = \
-            topics_or_res["olddocno"].str.split("%p", expand=True)
+        # Shallow copy, so that replacing the docno column does not copy the data.
+        topics_or_res = topics_or_res.copy(deep=False)
+        topics_or_res["passage_docno"] = topics_or_res["docno"]
+        topics_or_res["docno"] = pmids(topics_or_res)
 
         topics_or_res = self.transformer.transform(topics_or_res)
 
-        topics_or_res["docno"] = topics_or_res["olddocno"]
-        topics_or_res.drop(columns=["olddocno", "pid"], inplace=True)
-
-        topics_or_res.reset_index(drop=True, inplace=True)
-        return topics_or_res
+        topics_or_res["docno"] = topics_or_res["passage_docno"]
+        topics_or_res = topics_or_res.drop(columns="passage_docno")
+        return topics_or_res.reset_index(drop=True)
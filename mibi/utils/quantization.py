@@ -0,0 +1,132 @@
+from pathlib import Path
+from typing import Callable, Literal, TypeAlias
+from warnings import warn
+
+from pyterrier.transformer import Transformer
+from torch import Tensor, __version__ as torch_version, device as torch_device, load as torch_load, save as torch_save, qint8
+from torch.ao.nn.quantized.dynamic import Linear as DynamicQuantizedLinear
+from torch.nn import Linear, Module
+from torch.quantization import quantize_dynamic
+from transformers import __version__ as transformers_version
+
+from mibi import PROJECT_DIR
+
+
+InferenceBackend: TypeAlias = Literal[
+    "torch",
+    "torch-int8",
+]
+
+
+_CACHE_DIR = PROJECT_DIR / "data" / "cache" / "models"
+
+
+def _cache_path(model_name: str, backend: InferenceBackend) -> Path:
+    safe_model_name = model_name.replace("/", "--")
+    # The serialized modules depend on the PyTorch and Transformers versions.
+    return _CACHE_DIR / (
+        f"{safe_model_name}.{backend}."
+        f"torch-{torch_version}.transformers-{transformers_version}.pt"
+    )
+
+
+def _replace_linear_layers(module: Module) -> None:
+    # Swap the same layers as `quantize_dynamic`, but with empty int8 weights.
+    for name, child in list(module.named_children()):
+        if type(child) is Linear:
+            setattr(module, name, DynamicQuantizedLinear(
+                child.in_features,
+                child.out_features,
+                bias_=child.bias is not None,
+                dtype=qint8,
+            ))
+        else:
+            _replace_linear_layers(child)
+
+
+def _save_quantized(model: Module, cache_path: Path) -> None:
+    state_dict = model.state_dict()
+    # Non-persistent buffers (e.g., rotary embeddings) are not part of the state dict, but cannot be restored on the meta device.
+    buffers = {
+        name: buffer
+        for name, buffer in model.named_buffers()
+        if name not in state_dict.keys()
+    }
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    torch_save({"state_dict": state_dict, "buffers": buffers}, cache_path)
+
+
+def _load_quantized(skeleton: Module, cache_path: Path) -> Module:
+    cached: dict[str, dict[str, Tensor]] = torch_load(
+        cache_path, weights_only=True)
+    _replace_linear_layers(skeleton)
+    skeleton.to_empty(device="cpu")
+    skeleton.load_state_dict(cached["state_dict"])
+    for name, buffer in cached["buffers"].items():
+        module_name, _, buffer_name = name.rpartition(".")
+        skeleton.get_submodule(module_name).register_buffer(
+            buffer_name, buffer, persistent=False)
+    return skeleton
+
+
+def quantize_int8(
+    model_name: str,
+    load: Callable[[], Module],
+    skeleton: Callable[[], Module] | None = None,
+) -> Module:
+    """
+    Quantize the linear layers of a model to int8 (dynamic quantization for CPU inference).
+    The quantized weights are cached on disk and re-used on subsequent calls. Then, the full-precision weights are not loaded if a skeleton of the model can be built without them.
+
+    :param model_name: Name of the model, used as the cache key.
+    :param load: Load the full-precision model to quantize.
+    :param skeleton: Build the model's (full-precision) modules without loading the weights, e.g., on the meta device. By default, the full-precision model is loaded.
+    """
+    cache_path = _cache_path(model_name, "torch-int8")
+    if cache_path.exists():
+        print(f"Loading quantized model from: {cache_path}")
+        return _load_quantized(
+            skeleton() if skeleton is not None else load(),
+            cache_path,
+        ).eval()
+    print(f"Quantizing model '{model_name}' to int8.")
+    quantized_model = quantize_dynamic(
+        load().eval(),
+        {Linear},
+        dtype=qint8,
+    )
+    _save_quantized(quantized_model, cache_path)
+    return quantized_model
+
+
+def with_inference_backend(
+    reranker: Transformer,
+    model_name: str,
+    inference_backend: InferenceBackend,
+) -> Transformer:
+    """
+    Switch the model of a PyTerrier neural re-ranker (e.g., `TasB`, `MonoT5ReRanker`, or `DuoT5ReRanker`) to the given inference backend.
+    The re-ranker is expected to expose its PyTorch model as the `model` attribute.
+
+    :param reranker: The re-ranker that should use the inference backend.
+    :param model_name: Name of the re-ranker's model, used as the cache key.
+    :param inference_backend: The inference backend to use.
+    """
+    if inference_backend == "torch":
+        return reranker
+    elif inference_backend == "torch-int8":
+        model = getattr(reranker, "model", None)
+        if not isinstance(model, Module):
+            raise ValueError(
+                f"Cannot quantize re-ranker without PyTorch model: {reranker}")
+        device = torch_device(getattr(reranker, "device", "cpu"))
+        if device.type != "cpu":
+            warn(RuntimeWarning(
+                f"Quantized inference is only supported on the CPU, "
+                f"but model '{model_name}' runs on: {device}"))
+            return reranker
+        # The re-ranker has already loaded the full-precision weights, so the cache only saves quantizing them.
+        setattr(reranker, "model", quantize_int8(model_name, lambda: model))
+        return reranker
+    else:
+        raise ValueError(f"Unknown inference backend: {inference_backend}")
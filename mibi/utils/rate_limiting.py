@@ -1,17 +1,220 @@
-from typing import Callable, ParamSpec, TypeVar
-from pyrate_limiter.limiter import Limiter, ItemMapping
+from dataclasses import dataclass
+from os import getpid
+from pathlib import Path
+from sqlite3 import Connection, connect
+from threading import Lock
+from time import sleep, time
+from typing import Any, Mapping
 
-_T = TypeVar("_T")
-_P = ParamSpec("_P")
+from toml import load as toml_load
 
 
-def _default_mapping(*_args, **_kwargs):
-    return "default", 1
+@dataclass(frozen=True)
+class RateLimit:
+    requests_per_second: float | None = None
+    tokens_per_minute: float | None = None
 
 
-def rate_limit(limiter: Limiter, mapping: ItemMapping = _default_mapping) -> Callable[[Callable[_P, _T]], Callable[_P, _T]]:
+@dataclass(frozen=True)
+class RateLimitStats:
+    requests: int
+    delayed: int
+    delay_seconds: float
 
-    def _limit(f: Callable[_P, _T]) -> Callable[_P, _T]:
-        return limiter.as_decorator()(mapping)(f)  # type: ignore
+    @property
+    def mean_delay_seconds(self) -> float:
+        if self.requests == 0:
+            return 0
+        return self.delay_seconds / self.requests
 
-    return _limit
+    def __str__(self) -> str:
+        return (
+            f"{self.requests} requests, {self.delayed} delayed, "
+            f"{self.mean_delay_seconds:.2f} s delay per request"
+        )
+
+
+class RateLimiter:
+    """
+    Named rate limits (e.g., per backend) shared by all processes and threads that use the same SQLite database.
+    Each request reserves the earliest time slot that conforms to the requests per second and tokens per minute (generic cell rate algorithm), and then waits exactly until its slot. Short bursts (of one second's requests and one minute's tokens) are allowed.
+    Token counts are usually only estimated before the request, and can be corrected after the request with the actual usage.
+    """
+
+    _path: Path
+    _limits: Mapping[str, RateLimit]
+    _connection: Connection | None
+    _pid: int | None
+    _lock: Lock
+    _stats: dict[str, RateLimitStats]
+
+    def __init__(self, path: Path, limits: Mapping[str, RateLimit]) -> None:
+        """
+        :param path: Path of the SQLite database file that holds the shared schedule.
+        :param limits: Rate limits by name. Requests with other names are not limited.
+        """
+        self._path = path
+        self._limits = limits
+        self._connection = None
+        self._pid = None
+        self._lock = Lock()
+        self._stats = {}
+
+    @classmethod
+    def from_config(cls, config_path: Path) -> "RateLimiter | None":
+        """
+        Load the rate limits from the `[rate_limits]` table of a TOML config file, or return `None` if no rate limits are configured.
+        The `path` key sets the database path (relative to the config file), and each sub-table sets the `requests_per_second` and `tokens_per_minute` of a named limit.
+        """
+        config = toml_load(config_path).get("rate_limits")
+        if not isinstance(config, dict):
+            return None
+        limits = {
+            name: RateLimit(
+                requests_per_second=limit.get("requests_per_second"),
+                tokens_per_minute=limit.get("tokens_per_minute"),
+            )
+            for name, limit in config.items()
+            if isinstance(limit, dict)
+        }
+        if len(limits) == 0:
+            return None
+        path = config_path.parent / config.get("path", "rate_limits.sqlite")
+        return cls(path=path, limits=limits)
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def limits(self) -> Mapping[str, RateLimit]:
+        return self._limits
+
+    @property
+    def stats(self) -> dict[str, RateLimitStats]:
+        """
+        Requests and delays per named limit in this process.
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def _connect(self) -> Connection:
+        # SQLite connections must not be shared with forked processes.
+        if self._connection is None or self._pid != getpid():
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = connect(
+                self._path,
+                timeout=60,
+                check_same_thread=False,
+                isolation_level=None,
+            )
+            self._pid = getpid()
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS schedules ("
+                "name TEXT NOT NULL, "
+                "resource TEXT NOT NULL, "
+                "arrival REAL NOT NULL, "
+                "PRIMARY KEY (name, resource))"
+            )
+        return self._connection
+
+    @staticmethod
+    def _resources(
+        limit: RateLimit,
+        tokens: int,
+    ) -> list[tuple[str, float, float, float]]:
+        # Resource name, emission interval, burst tolerance, and cost.
+        resources: list[tuple[str, float, float, float]] = []
+        if limit.requests_per_second is not None:
+            resources.append(
+                ("requests", 1 / limit.requests_per_second, 1, 1))
+        if limit.tokens_per_minute is not None and tokens > 0:
+            resources.append(
+                ("tokens", 60 / limit.tokens_per_minute, 60, tokens))
+        return resources
+
+    def _reserve(self, name: str, limit: RateLimit, tokens: int) -> float:
+        resources = self._resources(limit, tokens)
+        if len(resources) == 0:
+            return 0
+        with self._lock:
+            connection = self._connect()
+            # Lock the database, so that concurrent processes do not reserve the same slot.
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                now = time()
+                arrivals: dict[str, float] = {}
+                start = now
+                for resource, interval, tolerance, _ in resources:
+                    row = connection.execute(
+                        "SELECT arrival FROM schedules "
+                        "WHERE name = ? AND resource = ?",
+                        (name, resource),
+                    ).fetchone()
+                    arrival = row[0] if row is not None else now
+                    arrivals[resource] = arrival
+                    start = max(start, arrival - tolerance)
+                for resource, interval, _, cost in resources:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO schedules "
+                        "(name, resource, arrival) VALUES (?, ?, ?)",
+                        (
+                            name,
+                            resource,
+                            max(arrivals[resource], start) + cost * interval,
+                        ),
+                    )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            delay = start - now
+            stats = self._stats.get(name, RateLimitStats(0, 0, 0))
+            self._stats[name] = RateLimitStats(
+                requests=stats.requests + 1,
+                delayed=stats.delayed + (1 if delay > 0 else 0),
+                delay_seconds=stats.delay_seconds + delay,
+            )
+        return delay
+
+    def acquire(self, name: str, tokens: int = 0) -> None:
+        """
+        Wait until the request conforms to the named rate limit.
+
+        :param name: Name of the rate limit, e.g., the backend.
+        :param tokens: (Estimated) number of tokens used by the request.
+        """
+        limit = self._limits.get(name)
+        if limit is None:
+            return
+        delay = self._reserve(name, limit, tokens)
+        if delay > 0:
+            sleep(delay)
+
+    def adjust(self, name: str, tokens: int) -> None:
+        """
+        Correct the tokens reserved for a previous request, e.g., by the difference of the actual and the estimated usage.
+        """
+        limit = self._limits.get(name)
+        if limit is None or limit.tokens_per_minute is None or tokens == 0:
+            return
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "UPDATE schedules SET arrival = arrival + ? "
+                "WHERE name = ? AND resource = 'tokens'",
+                (tokens * 60 / limit.tokens_per_minute, name),
+            )
+
+    def __getstate__(self) -> dict[str, Any]:
+        # Locks and connections cannot be pickled or copied.
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_connection"] = None
+        state["_pid"] = None
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = Lock()
@@ -0,0 +1,117 @@
+import os
+from pathlib import Path
+from threading import RLock
+from typing import Any, Callable, TypeVar, cast
+
+try:
+    from resource import getrusage, RUSAGE_SELF
+except ImportError:
+    # The `resource` module is only available on Unix.
+    getrusage = None  # type: ignore
+
+
+_T = TypeVar("_T")
+
+
+def _resident_memory() -> int | None:
+    statm_path = Path("/proc/self/statm")
+    if statm_path.exists() and hasattr(os, "sysconf"):
+        resident_pages = int(statm_path.read_text().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    if getrusage is not None:
+        # Fall back to the peak resident memory (in KiB on Linux).
+        return getrusage(RUSAGE_SELF).ru_maxrss * 1024
+    return None
+
+
+def _tensor_memory(model: Any) -> int | None:
+    # PyTerrier re-rankers expose their PyTorch model as `model`.
+    module = getattr(model, "model", model)
+    parameters = getattr(module, "parameters", None)
+    buffers = getattr(module, "buffers", None)
+    modules = getattr(module, "modules", None)
+    if not callable(parameters) or not callable(buffers) or \
+            not callable(modules):
+        return None
+    tensors = [*parameters(), *buffers()]
+    # Dynamically quantized layers keep their int8 weights in packed parameters, which are neither parameters nor buffers.
+    for submodule in modules():
+        packed_params = getattr(submodule, "_packed_params", None)
+        weight_bias = getattr(packed_params, "_weight_bias", None)
+        if callable(weight_bias):
+            tensors.extend(
+                tensor for tensor in weight_bias() if tensor is not None)
+    if len(tensors) == 0:
+        return None
+    return sum(
+        tensor.numel() * tensor.element_size()
+        for tensor in tensors
+    )
+
+
+class ModelRegistry:
+    """
+    Process-wide registry that loads each model only once and shares it across pipelines.
+    Models that are (pre-)loaded before forking worker processes are shared copy-on-write with the workers.
+    """
+
+    _models: dict[str, Any]
+    _memory: dict[str, int | None]
+    _lock: RLock
+
+    def __init__(self) -> None:
+        self._models = {}
+        self._memory = {}
+        self._lock = RLock()
+
+    def get(self, key: str, load: Callable[[], _T]) -> _T:
+        """
+        Get the model registered under the key, or load and register it.
+
+        :param key: Unique key of the model, e.g., including the model name and configuration.
+        :param load: Function to load the model if it is not yet registered.
+        """
+        if key in self._models:
+            return cast(_T, self._models[key])
+        with self._lock:
+            if key not in self._models:
+                print(f"Loading model '{key}'.")
+                memory_before = _resident_memory()
+                model = load()
+                memory_after = _resident_memory()
+                memory = _tensor_memory(model)
+                if memory is None and memory_before is not None and \
+                        memory_after is not None:
+                    memory = max(0, memory_after - memory_before)
+                self._models[key] = model
+                self._memory[key] = memory
+            return cast(_T, self._models[key])
+
+    def preload(self, key: str, load: Callable[[], Any]) -> None:
+        """
+        Load and register the model, e.g., at startup or before forking worker processes.
+        """
+        self.get(key, load)
+
+    def memory_usage(self) -> dict[str, int | None]:
+        """
+        Approximate memory usage (in bytes) per registered model, or `None` if it cannot be measured.
+        For PyTorch models (and PyTerrier re-rankers wrapping them), the size of the parameters and buffers is counted, including the packed weights of int8-quantized layers. For other models, the growth of the resident memory while loading is counted instead, which includes any other allocations made meanwhile and is not available on all platforms.
+        """
+        with self._lock:
+            return dict(self._memory)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._models.clear()
+            self._memory.clear()
+
+    def _after_fork(self) -> None:
+        # The lock might have been held by another thread while forking.
+        self._lock = RLock()
+
+
+model_registry = ModelRegistry()
+if hasattr(os, "register_at_fork"):
+    # Forking is only available on Unix.
+    os.register_at_fork(after_in_child=model_registry._after_fork)
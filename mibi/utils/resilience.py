@@ -0,0 +1,256 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from math import ceil, inf
+from random import uniform
+from threading import Lock
+from time import perf_counter, sleep
+from typing import Callable, Generic, Sequence, TypeVar
+
+
+_T = TypeVar("_T")
+
+
+# Upper bounds (in seconds) of the latency histogram's buckets.
+LATENCY_BUCKETS: Sequence[float] = (0.5, 1, 2, 5, 10, 20, 60, inf)
+
+
+@dataclass(frozen=True)
+class ResiliencePolicy:
+    """
+    :param timeout: Maximum time (in seconds) to wait for a call (including its hedged duplicate), or `None` to wait indefinitely.
+    :param max_retries: Maximum number of retries after failed or timed out calls.
+    :param backoff_base: Base delay (in seconds) of the exponential backoff between retries.
+    :param backoff_max: Maximum delay (in seconds) between retries.
+    :param hedge_quantile: Latency quantile of previous calls after which a duplicate call is started, or `None` to not hedge calls.
+    :param hedge_min_samples: Minimum number of previous calls before calls are hedged.
+    """
+
+    timeout: float | None = None
+    max_retries: int = 0
+    backoff_base: float = 1
+    backoff_max: float = 60
+    hedge_quantile: float | None = None
+    hedge_min_samples: int = 20
+
+
+def backoff_delay(attempt: int, base: float, maximum: float) -> float:
+    """
+    Delay before the next retry, with exponential backoff and "full jitter", so that concurrent callers do not retry in lockstep.
+    """
+    return uniform(0, min(maximum, base * 2 ** attempt))  # nosec: B311
+
+
+def latency_quantile(latencies: Sequence[float], quantile: float) -> float:
+    """
+    Nearest-rank quantile of the latencies.
+    """
+    if len(latencies) == 0:
+        raise ValueError("No latencies.")
+    ranked = sorted(latencies)
+    index = max(0, ceil(quantile * len(ranked)) - 1)
+    return ranked[index]
+
+
+@dataclass(frozen=True)
+class ResilienceStats:
+    calls: int
+    retries: int
+    timeouts: int
+    hedges: int
+    hedge_wins: int
+    histogram: tuple[int, ...]
+    p50_seconds: float | None
+    p95_seconds: float | None
+
+    def __str__(self) -> str:
+        histogram = ", ".join(
+            f"<={bound:g} s: {count}" if bound != inf
+            else f">{LATENCY_BUCKETS[-2]:g} s: {count}"
+            for bound, count in zip(LATENCY_BUCKETS, self.histogram)
+        )
+        p50 = f"{self.p50_seconds:.2f} s" if self.p50_seconds is not None else "n/a"
+        p95 = f"{self.p95_seconds:.2f} s" if self.p95_seconds is not None else "n/a"
+        return (
+            f"{self.calls} calls, {self.retries} retries, "
+            f"{self.timeouts} timeouts, {self.hedges} hedges "
+            f"({self.hedge_wins} won), p50 {p50}, p95 {p95} "
+            f"[{histogram}]"
+        )
+
+
+class ResilientCaller(Generic[_T]):
+    """
+    Call functions with a timeout, retry failed calls with exponential backoff, and hedge slow calls with a duplicate call once they take longer than usual (i.e., the latency quantile of the previous calls). The first successful call wins.
+    Calls run on a thread pool. Calls that time out cannot be cancelled, and finish in the background.
+    """
+
+    _policy: ResiliencePolicy
+    _executor: ThreadPoolExecutor
+    _lock: Lock
+    _latencies: deque[float]
+    _histogram: list[int]
+    _calls: int
+    _retries: int
+    _timeouts: int
+    _hedges: int
+    _hedge_wins: int
+
+    def __init__(
+        self,
+        policy: ResiliencePolicy,
+        max_workers: int = 64,
+        window: int = 1000,
+    ) -> None:
+        """
+        :param max_workers: Maximum number of concurrent calls (including hedged and timed out calls).
+        :param window: Number of recent latencies to estimate the hedging threshold from.
+        """
+        self._policy = policy
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = Lock()
+        self._latencies = deque(maxlen=window)
+        self._histogram = [0] * len(LATENCY_BUCKETS)
+        self._calls = 0
+        self._retries = 0
+        self._timeouts = 0
+        self._hedges = 0
+        self._hedge_wins = 0
+
+    @property
+    def policy(self) -> ResiliencePolicy:
+        return self._policy
+
+    @property
+    def stats(self) -> ResilienceStats:
+        with self._lock:
+            latencies = list(self._latencies)
+            return ResilienceStats(
+                calls=self._calls,
+                retries=self._retries,
+                timeouts=self._timeouts,
+                hedges=self._hedges,
+                hedge_wins=self._hedge_wins,
+                histogram=tuple(self._histogram),
+                p50_seconds=latency_quantile(latencies, 0.5)
+                if len(latencies) > 0 else None,
+                p95_seconds=latency_quantile(latencies, 0.95)
+                if len(latencies) > 0 else None,
+            )
+
+    def _hedge_threshold(self) -> float | None:
+        quantile = self._policy.hedge_quantile
+        if quantile is None:
+            return None
+        with self._lock:
+            if len(self._latencies) < self._policy.hedge_min_samples:
+                return None
+            return latency_quantile(list(self._latencies), quantile)
+
+    def _record(self, latency: float, succeeded: bool, hedge_won: bool) -> None:
+        with self._lock:
+            self._calls += 1
+            if not succeeded:
+                return
+            self._latencies.append(latency)
+            bucket = next(
+                index
+                for index, bound in enumerate(LATENCY_BUCKETS)
+                if latency <= bound
+            )
+            self._histogram[bucket] += 1
+            if hedge_won:
+                self._hedge_wins += 1
+
+    def _call_once(
+        self,
+        function: Callable[[], _T],
+        acquire: Callable[[], None] | None,
+    ) -> _T:
+        if acquire is not None:
+            acquire()
+        start = perf_counter()
+        deadline = start + self._policy.timeout \
+            if self._policy.timeout is not None else None
+        hedge_threshold = self._hedge_threshold()
+        primary = self._executor.submit(function)
+        pending: set[Future[_T]] = {primary}
+        hedged = False
+        while True:
+            now = perf_counter()
+            wait_until = deadline
+            if not hedged and hedge_threshold is not None:
+                hedge_at = start + hedge_threshold
+                wait_until = hedge_at if wait_until is None \
+                    else min(wait_until, hedge_at)
+            done, pending = wait(
+                pending,
+                timeout=max(0, wait_until - now)
+                if wait_until is not None else None,
+                return_when=FIRST_COMPLETED,
+            )
+            succeeded = [
+                future
+                for future in done
+                if future.exception() is None
+            ]
+            if len(succeeded) > 0 or (len(done) > 0 and len(pending) == 0):
+                # Prefer any successful call, even if another call finished at the same time but failed. Only fail if no call is pending anymore.
+                future = succeeded[0] if len(succeeded) > 0 \
+                    else next(iter(done))
+                self._record(
+                    latency=perf_counter() - start,
+                    succeeded=len(succeeded) > 0,
+                    hedge_won=future is not primary,
+                )
+                return future.result()
+            now = perf_counter()
+            if deadline is not None and now >= deadline:
+                with self._lock:
+                    self._timeouts += 1
+                raise TimeoutError(
+                    f"Call did not finish within {self._policy.timeout} s.")
+            if not hedged and hedge_threshold is not None and \
+                    now >= start + hedge_threshold:
+                with self._lock:
+                    self._hedges += 1
+                if acquire is not None:
+                    # Exclude waiting for the rate limit from the latency and the timeout.
+                    acquire_start = perf_counter()
+                    acquire()
+                    acquire_seconds = perf_counter() - acquire_start
+                    start += acquire_seconds
+                    if deadline is not None:
+                        deadline += acquire_seconds
+                pending.add(self._executor.submit(function))
+                hedged = True
+
+    def call(
+        self,
+        function: Callable[[], _T],
+        retry_after: Callable[[Exception], float | None],
+        acquire: Callable[[], None] | None = None,
+    ) -> _T:
+        """
+        Call the function, and retry it if it times out or fails with a retryable error.
+
+        :param retry_after: Minimum delay (in seconds) before retrying after the error, or `None` if the error should not be retried.
+        :param acquire: Function that blocks before each call, including retries and hedged calls, e.g., to wait for a rate limit. The time spent waiting is not counted towards the latency.
+        """
+        attempt = 0
+        while True:
+            try:
+                return self._call_once(function, acquire)
+            except Exception as error:
+                min_delay = 0 if isinstance(error, TimeoutError) \
+                    else retry_after(error)
+                if min_delay is None or attempt >= self._policy.max_retries:
+                    raise
+                with self._lock:
+                    self._retries += 1
+                sleep(max(min_delay, backoff_delay(
+                    attempt=attempt,
+                    base=self._policy.backoff_base,
+                    maximum=self._policy.backoff_max,
+                )))
+                attempt += 1
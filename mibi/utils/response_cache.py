@@ -0,0 +1,187 @@
+from dataclasses import dataclass
+from datetime import timedelta
+from json import dumps, loads
+from pathlib import Path
+from sqlite3 import Connection, connect
+from threading import Lock
+from time import time
+
+from pydantic import JsonValue
+
+from mibi.utils.content_store import ContentStore
+
+
+@dataclass(frozen=True)
+class ResponseCacheStats:
+    hits: int
+    misses: int
+    evictions: int
+
+    @property
+    def hit_rate(self) -> float:
+        requests = self.hits + self.misses
+        if requests == 0:
+            return 0
+        return self.hits / requests
+
+    def __str__(self) -> str:
+        return (
+            f"{self.hits} hits, {self.misses} misses "
+            f"({self.hit_rate:.0%} hit rate), {self.evictions} evictions"
+        )
+
+
+class ResponseCache:
+    """
+    Persistent key-value cache in an SQLite database, where each value is addressed by the hash of its (JSON) key.
+    Entries older than the time-to-live are ignored and removed. If the total size of the cached values exceeds the maximum size, the least recently used entries are evicted.
+    The database can be shared by multiple processes and threads.
+    """
+
+    _path: Path
+    _ttl: timedelta | None
+    _max_size: int | None
+    _connection: Connection
+    _lock: Lock
+    _hits: int
+    _misses: int
+    _evictions: int
+
+    def __init__(
+        self,
+        path: Path,
+        ttl: timedelta | None = None,
+        max_size: int | None = None,
+    ) -> None:
+        """
+        :param path: Path of the SQLite database file.
+        :param ttl: Time-to-live of the cached entries, or `None` to keep entries indefinitely.
+        :param max_size: Maximum total size of the cached values in bytes, or `None` for no limit.
+        """
+        self._path = path
+        self._ttl = ttl
+        self._max_size = max_size
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = connect(
+            path,
+            timeout=60,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "address TEXT PRIMARY KEY, "
+                "value TEXT NOT NULL, "
+                "size INTEGER NOT NULL, "
+                "created REAL NOT NULL, "
+                "accessed REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed "
+                "ON entries (accessed)"
+            )
+            self._remove_expired()
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def stats(self) -> ResponseCacheStats:
+        """
+        Cache hits, misses, and evictions of this instance.
+        """
+        with self._lock:
+            return ResponseCacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            count, = self._connection.execute(
+                "SELECT COUNT(*) FROM entries").fetchone()
+        return count
+
+    def _remove_expired(self) -> None:
+        if self._ttl is None:
+            return
+        self._connection.execute(
+            "DELETE FROM entries WHERE created < ?",
+            (time() - self._ttl.total_seconds(),),
+        )
+
+    def _evict(self) -> None:
+        if self._max_size is None:
+            return
+        size, = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if size <= self._max_size:
+            return
+        # Evict the least recently used entries until the cache fits.
+        evicted: list[str] = []
+        for address, entry_size in self._connection.execute(
+            "SELECT address, size FROM entries ORDER BY accessed ASC"
+        ):
+            if size <= self._max_size:
+                break
+            evicted.append(address)
+            size -= entry_size
+        self._connection.executemany(
+            "DELETE FROM entries WHERE address = ?",
+            ((address,) for address in evicted),
+        )
+        self._evictions += len(evicted)
+
+    def get(self, key: JsonValue) -> JsonValue | None:
+        """
+        Get the value cached for the key, or `None` if no (unexpired) value is cached.
+        """
+        address = ContentStore.address(key)
+        now = time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, created FROM entries WHERE address = ?",
+                (address,),
+            ).fetchone()
+            if row is None:
+                self._misses += 1
+                return None
+            value, created = row
+            if self._ttl is not None and created < now - self._ttl.total_seconds():
+                self._connection.execute(
+                    "DELETE FROM entries WHERE address = ?",
+                    (address,),
+                )
+                self._misses += 1
+                return None
+            self._connection.execute(
+                "UPDATE entries SET accessed = ? WHERE address = ?",
+                (now, address),
+            )
+            self._hits += 1
+        return loads(value)
+
+    def put(self, key: JsonValue, value: JsonValue) -> None:
+        address = ContentStore.address(key)
+        value_json = dumps(value, ensure_ascii=False)
+        now = time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO entries "
+                "(address, value, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (address, value_json, len(value_json.encode("utf-8")), now, now),
+            )
+            self._evict()
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,91 @@
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from graphlib import TopologicalSorter
+from typing import Callable, Collection, Mapping, Sequence
+
+from mibi.utils.concurrency import with_dspy_settings
+
+
+def _topological_sorter(
+    tasks: Collection[str],
+    dependencies: Mapping[str, Collection[str]],
+) -> TopologicalSorter[str]:
+    sorter: TopologicalSorter[str] = TopologicalSorter()
+    for name in tasks:
+        task_dependencies = dependencies.get(name, ())
+        for dependency in task_dependencies:
+            if dependency not in tasks:
+                raise ValueError(
+                    f"Unknown dependency of task '{name}': {dependency}")
+        sorter.add(name, *task_dependencies)
+    for name in dependencies.keys():
+        if name not in tasks:
+            raise ValueError(f"Unknown task: {name}")
+    # Raises a `CycleError` if the dependencies are cyclic.
+    sorter.prepare()
+    return sorter
+
+
+def topological_order(
+    tasks: Collection[str],
+    dependencies: Mapping[str, Collection[str]],
+) -> Sequence[str]:
+    """
+    Order the tasks such that each task comes after all its dependencies.
+
+    :param tasks: Names of the tasks to order.
+    :param dependencies: Names of the tasks that must come before a task, by task name. Tasks without dependencies can be omitted.
+    """
+    sorter = _topological_sorter(tasks, dependencies)
+    order: list[str] = []
+    while sorter.is_active():
+        ready = sorter.get_ready()
+        order.extend(ready)
+        sorter.done(*ready)
+    return order
+
+
+def run_dag(
+    tasks: Mapping[str, Callable[[], None]],
+    dependencies: Mapping[str, Collection[str]],
+    executor: Executor | None = None,
+) -> None:
+    """
+    Run tasks as soon as all their dependencies have finished, running independent tasks concurrently (with the caller's DSPy settings). Tasks without concurrent tasks run in the calling thread.
+    If a task fails, no further tasks are started and the exception is re-raised once the running tasks have finished.
+
+    :param tasks: The tasks to run, by name.
+    :param dependencies: Names of the tasks that must finish before a task can start, by task name. Tasks without dependencies can be omitted.
+    :param executor: Executor to run the tasks in. If not given, a new thread pool is created. Do not pass an executor whose workers run the calling function, as waiting for the tasks would then block a worker and can deadlock.
+    """
+    sorter = _topological_sorter(tasks.keys(), dependencies)
+    with (
+        nullcontext(executor)
+        if executor is not None
+        else ThreadPoolExecutor(
+            max_workers=max(1, len(tasks)),
+            thread_name_prefix="mibi-stage",
+        )
+    ) as task_executor:
+        running: dict[Future[None], str] = {}
+        try:
+            while sorter.is_active():
+                ready = sorter.get_ready()
+                if len(ready) == 1 and len(running) == 0:
+                    # No concurrent tasks, so run the task in the calling thread.
+                    name, = ready
+                    tasks[name]()
+                    sorter.done(name)
+                    continue
+                for name in ready:
+                    running[task_executor.submit(
+                        with_dspy_settings(tasks[name]))] = name
+                done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    future.result()
+                    sorter.done(name)
+        finally:
+            for future in running.keys():
+                future.cancel()
+            wait(running.keys())
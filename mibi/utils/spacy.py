@@ -0,0 +1,31 @@
+from warnings import catch_warnings, simplefilter
+
+from spacy import load as spacy_load
+from spacy.language import Language
+from spacy.tokenizer import Tokenizer
+
+from mibi.utils.registry import model_registry
+
+
+def _load_language(name: str) -> Language:
+    with catch_warnings():
+        simplefilter(action="ignore", category=FutureWarning)
+        return spacy_load(name)
+
+
+def spacy_language(name: str = "en_core_sci_sm") -> Language:
+    """
+    Get the spaCy language pipeline, shared process-wide.
+    """
+    return model_registry.get(
+        f"spacy:{name}",
+        lambda: _load_language(name),
+    )
+
+
+def spacy_tokenizer(name: str = "en_core_sci_sm") -> Tokenizer:
+    """
+    Get the tokenizer of the shared spaCy language pipeline.
+    Tokenizing is much faster than running the full pipeline (tagger, parser, etc.), and yields the same tokens.
+    """
+    return spacy_language(name).tokenizer
@@ -0,0 +1,173 @@
+from json import dumps
+from re import Pattern, compile as re_compile, escape
+from typing import Protocol
+
+
+_ESCAPES = {
+    "\"": "\"",
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+
+# Sentence boundaries, i.e., punctuation followed by whitespace and the (upper-case) start of the next sentence.
+_SENTENCE_BOUNDARY_PATTERN = re_compile(r"[.!?][\"')\]]*(?=\s+[A-Z0-9])")
+
+
+class IncrementalJsonStringParser:
+    """
+    Parse the string value of a field in a JSON object incrementally, while the JSON text is streamed.
+    The value is decoded as far as it is streamed, even before its closing quote.
+    """
+
+    _field: str
+    _text: str
+    _key_pattern: Pattern[str]
+    _position: int | None
+    _value: list[str]
+    _closed: bool
+
+    def __init__(self, field: str) -> None:
+        self._field = field
+        self._text = ""
+        self._key_pattern = re_compile(escape(dumps(field)) + r"\s*:\s*\"")
+        self._position = None
+        self._value = []
+        self._closed = False
+
+    @property
+    def field(self) -> str:
+        return self._field
+
+    @property
+    def text(self) -> str:
+        """
+        The JSON text streamed so far.
+        """
+        return self._text
+
+    @property
+    def started(self) -> bool:
+        """
+        Whether the field's value has started.
+        """
+        return self._position is not None
+
+    @property
+    def closed(self) -> bool:
+        """
+        Whether the field's value is complete.
+        """
+        return self._closed
+
+    @property
+    def value(self) -> str | None:
+        """
+        The field's value decoded so far, or `None` if the value has not yet started.
+        """
+        if self._position is None:
+            return None
+        return "".join(self._value)
+
+    def feed(self, chunk: str) -> None:
+        self._text += chunk
+        if self._closed:
+            return
+        if self._position is None:
+            match = self._key_pattern.search(self._text)
+            if match is None:
+                return
+            self._position = match.end()
+        self._decode()
+
+    def _decode(self) -> None:
+        text = self._text
+        position = self._position
+        assert position is not None
+        while position < len(text):
+            char = text[position]
+            if char == "\"":
+                self._closed = True
+                position += 1
+                break
+            elif char == "\\":
+                if position + 1 >= len(text):
+                    # Incomplete escape sequence.
+                    break
+                escaped = text[position + 1]
+                if escaped == "u":
+                    if position + 6 > len(text):
+                        break
+                    self._value.append(
+                        chr(int(text[position + 2:position + 6], 16)))
+                    position += 6
+                else:
+                    self._value.append(_ESCAPES.get(escaped, escaped))
+                    position += 2
+            else:
+                self._value.append(char)
+                position += 1
+        self._position = position
+
+
+class StreamTerminator(Protocol):
+    def feed(self, chunk: str) -> bool:
+        """
+        Feed the next chunk of the streamed completion, and return whether the generation can be stopped.
+        """
+        raise NotImplementedError()
+
+    def completion(self) -> str:
+        """
+        The completion to use for the text streamed so far.
+        """
+        raise NotImplementedError()
+
+
+class JsonStringFieldTerminator(StreamTerminator):
+    """
+    Stop streaming a JSON object once a string field is complete or exceeds a number of sentences.
+    The completion is then a JSON object with just that field, such that also truncated completions are valid JSON.
+    """
+
+    _parser: IncrementalJsonStringParser
+    _max_sentences: int | None
+
+    def __init__(self, field: str, max_sentences: int | None = None) -> None:
+        self._parser = IncrementalJsonStringParser(field)
+        self._max_sentences = max_sentences
+
+    def _truncated_value(self, value: str) -> str:
+        if self._max_sentences is None:
+            return value
+        boundaries = list(_SENTENCE_BOUNDARY_PATTERN.finditer(value))
+        if len(boundaries) < self._max_sentences:
+            return value
+        return value[:boundaries[self._max_sentences - 1].end()]
+
+    def feed(self, chunk: str) -> bool:
+        self._parser.feed(chunk)
+        if self._parser.closed:
+            return True
+        value = self._parser.value
+        if value is None:
+            return False
+        return len(self._truncated_value(value)) < len(value)
+
+    def completion(self) -> str:
+        value = self._parser.value
+        if value is None:
+            return self._parser.text
+        if not self._parser.closed:
+            # Drop the incomplete last sentence, e.g., if the token limit was reached.
+            boundaries = list(_SENTENCE_BOUNDARY_PATTERN.finditer(value))
+            if len(boundaries) > 0:
+                value = value[:boundaries[-1].end()]
+        return dumps(
+            {self._parser.field: self._truncated_value(value)},
+            ensure_ascii=False,
+        )
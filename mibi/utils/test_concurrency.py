@@ -0,0 +1,77 @@
+from time import sleep
+from typing import Sequence
+
+from pytest import mark, warns
+
+from mibi.utils.concurrency import map_batched, map_concurrently
+
+
+def _slow_square(value: int) -> int:
+    # Later items finish first.
+    sleep((10 - value) / 1000)
+    if value == 3:
+        raise ValueError("Failed.")
+    return value * value
+
+
+@mark.parametrize("concurrency", [1, 2, 8])
+def test_map_concurrently_keeps_order(concurrency: int) -> None:
+    results = list(map_concurrently(
+        _slow_square, range(10), concurrency=concurrency))
+    assert len(results) == 10
+    for value, result in enumerate(results):
+        if value == 3:
+            assert isinstance(result, ValueError)
+        else:
+            assert result == value * value
+
+
+def test_map_concurrently_dspy_settings() -> None:
+    from dspy import settings as dspy_settings
+
+    for lm in ("first-lm", "second-lm"):
+        # New thread pools reuse thread identifiers of earlier pools.
+        with dspy_settings.context(lm=lm):
+            results = list(map_concurrently(
+                lambda _: dspy_settings.config.get("lm"),
+                range(4),
+                concurrency=2,
+            ))
+        assert results == [lm] * 4
+
+
+def _batch_squares(values: Sequence[int]) -> Sequence[int | Exception]:
+    if 7 in values:
+        raise ValueError("Failed.")
+    return [
+        ValueError("Failed.") if value == 3 else value * value
+        for value in values
+    ]
+
+
+@mark.parametrize("concurrency", [1, 2])
+def test_map_batched(concurrency: int) -> None:
+    results = list(map_batched(
+        _batch_squares, range(10), batch_size=3, concurrency=concurrency))
+    assert len(results) == 10
+    for value, result in enumerate(results):
+        if value in (3, 6, 7, 8):
+            # Value 3 fails individually, values 6 to 8 fail as a batch.
+            assert isinstance(result, ValueError)
+        else:
+            assert result == value * value
+
+
+def _batch_squares_dropping_last(values: Sequence[int]) -> Sequence[int]:
+    results = [value * value for value in values]
+    if len(values) > 1:
+        # Drop the last result of larger batches.
+        return results[:-1]
+    return results
+
+
+def test_map_batched_mismatch_falls_back_to_single_items() -> None:
+    with warns(RuntimeWarning):
+        results = list(map_batched(
+            _batch_squares_dropping_last, range(5), batch_size=2))
+    assert results == [value * value for value in range(5)]
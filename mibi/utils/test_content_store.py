@@ -0,0 +1,31 @@
+from pathlib import Path
+
+from pydantic import JsonValue
+
+from mibi.utils.content_store import ContentStore
+
+
+def test_content_store(tmp_path: Path) -> None:
+    store = ContentStore(tmp_path)
+    key: dict[str, JsonValue] = {"stage": "documents", "question": "1"}
+    assert key not in store
+    assert store.get(key) is None
+    store.put(key, ["a", "b"])
+    assert key in store
+    assert store.get(key) == ["a", "b"]
+    # Key order does not matter.
+    reordered_key: dict[str, JsonValue] = {
+        "question": "1", "stage": "documents"}
+    assert store.get(reordered_key) == ["a", "b"]
+    other_key: dict[str, JsonValue] = {"stage": "snippets", "question": "1"}
+    assert store.get(other_key) is None
+
+
+def test_content_store_persistent(tmp_path: Path) -> None:
+    ContentStore(tmp_path).put("key", "value")
+    assert ContentStore(tmp_path).get("key") == "value"
+
+
+def test_content_store_non_ascii(tmp_path: Path) -> None:
+    ContentStore(tmp_path).put("Schlüssel", ["Größe", "μ"])
+    assert ContentStore(tmp_path).get("Schlüssel") == ["Größe", "μ"]
@@ -0,0 +1,32 @@
+from pathlib import Path
+
+from elasticsearch7 import ConnectionError as ElasticsearchConnectionError
+from pytest import raises
+
+from mibi.utils.elasticsearch import elasticsearch_connection
+from mibi.utils.rate_limiting import RateLimit, RateLimiter
+
+
+def test_elasticsearch_connection_rate_limits_retries(tmp_path: Path) -> None:
+    limiter = RateLimiter(
+        path=tmp_path / "rate-limits.sqlite",
+        limits={"elasticsearch": RateLimit(requests_per_second=1000)},
+    )
+    # Nothing listens on the discard port, so each attempt fails quickly.
+    elasticsearch = elasticsearch_connection(
+        elasticsearch_url="http://127.0.0.1:9",
+        elasticsearch_username=None,
+        elasticsearch_password=None,
+        rate_limiter=limiter,
+    )
+    with raises(ElasticsearchConnectionError):
+        elasticsearch.info()
+    # The product check waits for the rate limit.
+    assert limiter.stats["elasticsearch"].requests == 1
+
+    # Skip the product check.
+    setattr(elasticsearch.transport, "_verified_elasticsearch", True)
+    with raises(ElasticsearchConnectionError):
+        elasticsearch.info()
+    # The first attempt and the 10 retries each wait for the rate limit.
+    assert limiter.stats["elasticsearch"].requests == 12
@@ -0,0 +1,227 @@
+from json import dumps
+from pathlib import Path
+from typing import Any, Iterator
+
+from dsp import LM
+from dspy import OpenAI as DSPyOpenAI, OllamaLocal
+from pydantic import TypeAdapter
+from pytest import MonkeyPatch, raises
+from requests import ConnectionError as RequestsConnectionError, HTTPError, Response
+
+from mibi.modules.exact_answer.llm import ListOutput
+from mibi.utils import language_models
+from mibi.utils.language_models import CountingLM, InstrumentedLM, PooledLM, RateLimitedLM, StreamingLM, _response_usage, _retry_after, find_language_model, init_draft_language_model, with_json_schema, with_kwargs
+from mibi.utils.rate_limiting import RateLimit, RateLimiter
+
+
+def test_with_json_schema_openai() -> None:
+    lm = DSPyOpenAI(model="gpt-3.5-turbo", api_key="test")
+    json_schema = TypeAdapter(ListOutput).json_schema()
+    constrained_lm = with_json_schema(lm, "ListOutput", json_schema)
+    response_format = constrained_lm.kwargs["response_format"]
+    assert response_format["type"] == "json_schema"
+    assert response_format["json_schema"]["name"] == "ListOutput"
+    schema = response_format["json_schema"]["schema"]
+    assert schema["additionalProperties"] is False
+    assert schema["properties"]["answer"]["minItems"] == 2
+    # The original language model is not constrained.
+    assert "response_format" not in lm.kwargs
+
+
+def test_with_json_schema_wrapped() -> None:
+    lm = CountingLM(DSPyOpenAI(model="gpt-3.5-turbo", api_key="test"))
+    constrained_lm = with_json_schema(lm, "ListOutput", {"type": "object"})
+    assert isinstance(constrained_lm, CountingLM)
+    assert "response_format" in constrained_lm.kwargs
+    assert "response_format" in constrained_lm.lm.kwargs
+    assert "response_format" not in lm.kwargs
+
+
+def test_response_usage_openai() -> None:
+    response = {
+        "usage": {
+            "prompt_tokens": 2048,
+            "completion_tokens": 20,
+            "prompt_tokens_details": {"cached_tokens": 1024},
+        },
+    }
+    assert _response_usage(response) == (2048, 1024, 0)
+
+
+def test_response_usage_ollama() -> None:
+    response = {
+        "usage": {"prompt_tokens": 100},
+        "additional_kwargs": {"prompt_eval_duration": 500_000_000},
+    }
+    assert _response_usage(response) == (100, 0, 0.5)
+    assert _response_usage(None) == (0, 0, 0)
+
+
+class _OllamaStreamResponse:
+    def __init__(self, contents: list[str]) -> None:
+        self.contents = contents
+
+    def __enter__(self) -> "_OllamaStreamResponse":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+    def raise_for_status(self) -> None:
+        pass
+
+    def iter_lines(self) -> Iterator[bytes]:
+        for content in self.contents:
+            yield dumps({"response": content, "done": False}).encode()
+        yield dumps({"response": "", "done": True}).encode()
+
+
+def test_instrumented_lm_first_token_seconds(monkeypatch: MonkeyPatch) -> None:
+    monkeypatch.setattr(
+        language_models,
+        "post",
+        lambda *args, **kwargs: _OllamaStreamResponse(
+            ["", '{"answer": "Hi', '!"}']),
+    )
+    lm = InstrumentedLM(StreamingLM(
+        OllamaLocal(model="llama3", model_type="text"),
+        field="answer",
+    ))
+    assert lm("Hello") == ['{"answer": "Hi!"}']
+    stats = lm.stats
+    assert stats.requests == 1
+    assert stats.streamed_requests == 1
+    assert 0 <= stats.first_token_seconds <= stats.seconds
+
+
+class _HistoryLM(LM):
+    def __init__(self, prompt_suffix: str = "") -> None:
+        super().__init__(model="test")
+        self.prompt_suffix = prompt_suffix
+
+    def basic_request(self, prompt: str, **kwargs) -> Any:
+        raise NotImplementedError()
+
+    def __call__(self, prompt: str, only_completed: bool = True, return_sorted: bool = False, **kwargs) -> list[Any]:
+        # Record an equal (but not identical) or modified prompt.
+        self.history.append({
+            "prompt": "".join([prompt, self.prompt_suffix]),
+            "response": {"usage": {"prompt_tokens": len(prompt)}},
+        })
+        return ["Hi!"]
+
+
+def test_instrumented_lm_finds_usage_in_history() -> None:
+    lm = InstrumentedLM(_HistoryLM())
+    assert lm("Hello") == ["Hi!"]
+    assert lm.stats.prompt_tokens == 5
+    # The only entry added during the request is used even if the prompt was modified.
+    lm = InstrumentedLM(_HistoryLM(prompt_suffix=" (JSON)"))
+    assert lm("Hello") == ["Hi!"]
+    assert lm.stats.prompt_tokens == 5
+
+
+def test_draft_language_model_shares_rate_limiter(
+    monkeypatch: MonkeyPatch,
+    tmp_path: Path,
+) -> None:
+    monkeypatch.setenv("OLLAMA_API_BASE", "http://localhost:11434")
+    rate_limiter = RateLimiter(
+        path=tmp_path / "rate-limits.sqlite",
+        limits={"ollama": RateLimit(requests_per_second=1)},
+    )
+    lm = RateLimitedLM(
+        lm=_HistoryLM(),
+        language_model_name="test",
+        rate_limiter=rate_limiter,
+        rate_limit_name="ollama",
+    )
+    draft_lm = init_draft_language_model("llama3", lm)
+    rate_limited_draft_lm = find_language_model(draft_lm, RateLimitedLM)
+    assert rate_limited_draft_lm is not None
+    assert rate_limited_draft_lm.rate_limiter is rate_limiter
+    assert find_language_model(draft_lm, OllamaLocal) is not None
+
+
+def _http_error(
+    status_code: int,
+    headers: dict[str, str] | None = None,
+) -> HTTPError:
+    response = Response()
+    response.status_code = status_code
+    if headers is not None:
+        response.headers.update(headers)
+    return HTTPError(response=response)
+
+
+def test_retry_after() -> None:
+    assert _retry_after(_http_error(429, {"Retry-After": "2"})) == 2
+    assert _retry_after(_http_error(503)) == 0
+    assert _retry_after(_http_error(400)) is None
+    assert _retry_after(ValueError()) is None
+
+
+class _EndpointLM(LM):
+    def __init__(self, completion: str, healthy: bool = True) -> None:
+        super().__init__(model="test")
+        self.completion = completion
+        self.healthy = healthy
+
+    def basic_request(self, prompt: str, **kwargs) -> Any:
+        raise NotImplementedError()
+
+    def __call__(self, prompt: str, only_completed: bool = True, return_sorted: bool = False, **kwargs) -> list[Any]:
+        if not self.healthy:
+            raise RequestsConnectionError("Connection refused.")
+        return [self.completion]
+
+
+def test_pooled_lm_round_robin() -> None:
+    lm = PooledLM(
+        lms=[_EndpointLM("a"), _EndpointLM("b")],
+        endpoints=["a", "b"],
+    )
+    completions = [lm("Hello")[0] for _ in range(4)]
+    assert sorted(completions) == ["a", "a", "b", "b"]
+    assert lm.stats["a"].requests == 2
+    assert lm.stats["b"].requests == 2
+
+
+def test_pooled_lm_ejects_unhealthy_endpoint() -> None:
+    lm = PooledLM(
+        lms=[_EndpointLM("a", healthy=False), _EndpointLM("b")],
+        endpoints=["a", "b"],
+        eject_after=2,
+    )
+    # Failed requests are retried on the healthy endpoint.
+    assert [lm("Hello")[0] for _ in range(6)] == ["b"] * 6
+    stats = lm.stats
+    assert stats["a"].failures == 2
+    assert stats["a"].ejections == 1
+    assert stats["b"].requests == 6
+
+
+def test_pooled_lm_all_unhealthy() -> None:
+    lm = PooledLM(
+        lms=[_EndpointLM("a", healthy=False), _EndpointLM("b", healthy=False)],
+        endpoints=["a", "b"],
+    )
+    with raises(RequestsConnectionError):
+        lm("Hello")
+
+
+def test_pooled_lm_with_kwargs() -> None:
+    lm = PooledLM(
+        lms=[_EndpointLM("a"), _EndpointLM("b")],
+        endpoints=["a", "b"],
+    )
+    copied_lm = with_kwargs(lm, temperature=0.5)
+    assert isinstance(copied_lm, PooledLM)
+    assert all(
+        endpoint_lm.kwargs["temperature"] == 0.5
+        for endpoint_lm in copied_lm.lms
+    )
+    assert lm.kwargs["temperature"] != 0.5
+    # Copies share the endpoints' state.
+    copied_lm("Hello")
+    assert sum(stats.requests for stats in lm.stats.values()) == 1
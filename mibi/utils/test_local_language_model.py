@@ -0,0 +1,137 @@
+from concurrent.futures import Future
+from queue import Queue
+from threading import Lock
+from typing import Sequence
+
+from torch import Tensor, manual_seed, tensor, zeros
+from transformers import LlamaConfig, LlamaForCausalLM
+
+from mibi.utils.local_language_model import LocalInferenceEngine, LocalInferenceStats, _GenerationRequest, _PrefixCache, _common_prefix_length
+
+
+def _past_key_values(length: int) -> tuple[tuple[Tensor, Tensor], ...]:
+    # One layer with batch size 1, one attention head, and a hidden size of 2.
+    return ((zeros(1, 1, length, 2), zeros(1, 1, length, 2)),)
+
+
+def test_common_prefix_length() -> None:
+    assert _common_prefix_length([1, 2, 3], [1, 2, 4]) == 2
+    assert _common_prefix_length([1, 2], [1, 2, 3]) == 2
+    assert _common_prefix_length([1], [2]) == 0
+
+
+def test_prefix_cache_reuses_longest_prefix() -> None:
+    cache = _PrefixCache(max_size=2)
+    cache.put([1, 2, 3, 4], _past_key_values(4))
+    cache.put([1, 2, 5], _past_key_values(3))
+
+    length, past_key_values = cache.get([1, 2, 3, 6])
+    assert length == 3
+    assert past_key_values is not None
+    assert past_key_values[0][0].shape[2] == 3
+
+    # The last token is never reused, as its logits are needed.
+    length, _ = cache.get([1, 2, 3, 4])
+    assert length == 3
+
+
+def test_prefix_cache_evicts_least_recently_used() -> None:
+    cache = _PrefixCache(max_size=2)
+    cache.put([1, 2], _past_key_values(2))
+    cache.put([3, 4], _past_key_values(2))
+    cache.get([1, 2, 5])
+    cache.put([5, 6], _past_key_values(2))
+
+    assert cache.get([3, 4, 5]) == (0, None)
+    assert cache.get([1, 2, 5])[0] == 2
+
+
+class _CharacterTokenizer:
+    # Tokenize each character, without any special tokens.
+    chat_template = None
+    eos_token_id = None
+    pad_token_id = 0
+
+    def encode(self, text: str) -> list[int]:
+        return [1 + ord(character) % 63 for character in text]
+
+    def decode(
+        self,
+        token_ids: Sequence[int] | Tensor,
+        skip_special_tokens: bool = False,
+    ) -> str:
+        return " ".join(str(int(token_id)) for token_id in token_ids)
+
+
+def _engine() -> tuple[LocalInferenceEngine, LlamaForCausalLM]:
+    manual_seed(0)
+    model = LlamaForCausalLM(LlamaConfig(
+        vocab_size=64,
+        hidden_size=16,
+        intermediate_size=32,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        num_key_value_heads=1,
+        max_position_embeddings=128,
+    )).eval()
+    # Set up the engine without loading a model from the Hub nor starting the generation thread.
+    engine = LocalInferenceEngine.__new__(LocalInferenceEngine)
+    engine._model = model
+    engine._tokenizer = _CharacterTokenizer()  # type: ignore
+    engine._max_batch_size = 8
+    engine._max_batch_wait = 0
+    engine._min_prefix_tokens = 4
+    engine._queue = Queue()
+    engine._prefix_cache = _PrefixCache(4)
+    engine._lock = Lock()
+    engine._stats = LocalInferenceStats(0, 0, 0, 0)
+    return engine, model
+
+
+def _request(prompt: str, max_new_tokens: int = 5) -> _GenerationRequest:
+    return _GenerationRequest(
+        prompt=prompt,
+        max_new_tokens=max_new_tokens,
+        temperature=0,
+        top_p=1,
+        future=Future(),
+    )
+
+
+def _greedy(model: LlamaForCausalLM, prompt: str, max_new_tokens: int = 5) -> str:
+    input_ids = _CharacterTokenizer().encode(prompt)
+    output_ids = model.generate(
+        input_ids=tensor([input_ids]),
+        max_new_tokens=max_new_tokens,
+        do_sample=False,
+        pad_token_id=0,
+    )
+    return _CharacterTokenizer().decode(output_ids[0, len(input_ids):])
+
+
+def test_local_inference_engine_generate_single() -> None:
+    engine, model = _engine()
+    assert engine._generate_single(_request("Hello world")) == \
+        _greedy(model, "Hello world")
+    # The second prompt reuses the keys and values of the shared prefix.
+    assert engine._generate_single(_request("Hello there")) == \
+        _greedy(model, "Hello there")
+    stats = engine.stats
+    assert stats.requests == 2
+    assert stats.reused_prompt_tokens == len("Hello ")
+    # Reusing the full prompt (except the last token) gives the same completion.
+    assert engine._generate_single(_request("Hello there")) == \
+        _greedy(model, "Hello there")
+    assert engine.stats.reused_prompt_tokens == \
+        len("Hello ") + len("Hello there") - 1
+
+
+def test_local_inference_engine_generate_batch() -> None:
+    engine, model = _engine()
+    prompts = ["Hello world", "Hi"]
+    assert engine._generate_batch([
+        _request(prompt) for prompt in prompts
+    ]) == [_greedy(model, prompt) for prompt in prompts]
+    stats = engine.stats
+    assert stats.requests == 2
+    assert stats.batches == 1
@@ -0,0 +1,125 @@
+from pandas import DataFrame
+from pyterrier import started, init
+from pytest import raises
+
+from mibi.utils.pyterrier import num_pairwise_comparisons, sliding_windows
+
+
+def test_sliding_windows_cover_all_candidates() -> None:
+    windows = sliding_windows(num_candidates=10, window_size=4, stride=2)
+    assert windows == [(6, 10), (4, 8), (2, 6), (0, 4)]
+    assert num_pairwise_comparisons(windows) == 4 * 12
+
+
+def test_sliding_windows_few_candidates() -> None:
+    assert sliding_windows(num_candidates=1, window_size=4, stride=2) == []
+    assert sliding_windows(num_candidates=3, window_size=4, stride=2) == [(0, 3)]
+
+
+def test_sliding_windows_budget_keeps_top() -> None:
+    windows = sliding_windows(
+        num_candidates=10, window_size=4, stride=2, max_comparisons=30)
+    assert windows == [(2, 6), (0, 4)]
+    assert num_pairwise_comparisons(windows) <= 30
+
+
+def test_sliding_windows_small_budget_shrinks_top_window() -> None:
+    windows = sliding_windows(
+        num_candidates=10, window_size=4, stride=2, max_comparisons=7)
+    assert windows == [(0, 3)]
+    assert num_pairwise_comparisons(windows) <= 7
+    assert sliding_windows(
+        num_candidates=10, window_size=4, stride=2, max_comparisons=2,
+    ) == [(0, 2)]
+    with raises(ValueError):
+        sliding_windows(
+            num_candidates=10, window_size=4, stride=2, max_comparisons=1)
+
+
+def test_sliding_window_pairwise_rerank() -> None:
+    if not started():
+        init()
+    from pyterrier.transformer import Transformer
+    from mibi.utils.pyterrier import SlidingWindowPairwiseRerank
+
+    class _TextLengthReranker(Transformer):
+        def transform(self, topics_or_res: DataFrame) -> DataFrame:
+            return topics_or_res.assign(
+                score=topics_or_res["text"].str.len())
+
+    res = DataFrame([
+        {"qid": "1", "query": "q", "docno": str(i), "text": "x" * i, "score": -i}
+        for i in range(10)
+    ])
+    reranker = SlidingWindowPairwiseRerank(
+        reranker=_TextLengthReranker(),
+        window_size=4,
+        stride=2,
+    )
+    reranked = reranker.transform(res)
+    assert len(reranked) == 10
+    assert reranked.iloc[0]["docno"] == "9"
+    assert list(reranked["rank"]) == list(range(10))
+
+
+def test_cascade_skips_separated_queries() -> None:
+    if not started():
+        init()
+    from pyterrier.model import add_ranks
+    from pyterrier.transformer import Transformer
+    from mibi.utils.pyterrier import Cascade, CascadeStage
+
+    class _ReverseReranker(Transformer):
+        def transform(self, topics_or_res: DataFrame) -> DataFrame:
+            return topics_or_res.assign(score=-topics_or_res["score"])
+
+    res = DataFrame([
+        {"qid": "separated", "query": "q", "docno": str(i), "score": 10.0 * -i}
+        for i in range(3)
+    ] + [
+        {"qid": "close", "query": "q", "docno": str(i), "score": 0.1 * -i}
+        for i in range(3)
+    ])
+    res = add_ranks(res)
+    cascade = Cascade(
+        candidates=Transformer.identity(),
+        stages=(CascadeStage(
+            name="reverse",
+            reranker=_ReverseReranker(),
+            cutoff=3,
+            skip_margin=1,
+        ),),
+    )
+    reranked = cascade.transform(res)
+    separated = reranked[reranked["qid"] == "separated"].sort_values(
+        "score", ascending=False)
+    close = reranked[reranked["qid"] == "close"].sort_values(
+        "score", ascending=False)
+    assert list(separated["docno"]) == ["0", "1", "2"]
+    assert list(close["docno"]) == ["2", "1", "0"]
+
+
+def test_passage_columns() -> None:
+    from pydantic_core import Url
+    from mibi.model import Snippet
+    from mibi.utils.pyterrier import PyTerrierModule, is_passage, passage_docno, pmids
+
+    snippet = Snippet(
+        document=Url("http://www.ncbi.nlm.nih.gov/pubmed/12345"),
+        text="Lorem ipsum.",
+        begin_section="abstract",
+        offset_in_begin_section=10,
+        end_section="abstract",
+        offset_in_end_section=22,
+    )
+    res = DataFrame([
+        PyTerrierModule._snippet_data(snippet),
+        {"docno": "67890", "score": 0},
+    ])
+    assert res["docno"].iloc[0] == passage_docno("12345", snippet)
+    assert list(is_passage(res)) == [True, False]
+    assert list(pmids(res)) == ["12345", "67890"]
+
+    documents = DataFrame([{"docno": "67890", "score": 0}])
+    assert list(is_passage(documents)) == [False]
+    assert list(pmids(documents)) == ["67890"]
@@ -0,0 +1,47 @@
+from pathlib import Path
+
+from pytest import MonkeyPatch, fail
+from torch import allclose, device as torch_device, manual_seed, tensor
+from transformers import LlamaConfig, LlamaForCausalLM
+
+from mibi.utils import quantization
+from mibi.utils.quantization import quantize_int8
+
+
+_CONFIG = LlamaConfig(
+    vocab_size=64,
+    hidden_size=16,
+    intermediate_size=32,
+    num_hidden_layers=2,
+    num_attention_heads=2,
+    num_key_value_heads=1,
+    max_position_embeddings=128,
+)
+
+
+def _load() -> LlamaForCausalLM:
+    manual_seed(0)
+    return LlamaForCausalLM(_CONFIG)
+
+
+def _skeleton() -> LlamaForCausalLM:
+    with torch_device("meta"):
+        return LlamaForCausalLM(_CONFIG)
+
+
+def _fail_load() -> LlamaForCausalLM:
+    fail("The full-precision model should not be loaded.")
+
+
+def test_quantize_int8_cache(tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+    monkeypatch.setattr(quantization, "_CACHE_DIR", tmp_path)
+    quantized_model = quantize_int8("test/llama", _load, _skeleton)
+    assert len(list(tmp_path.iterdir())) == 1
+
+    # Cached weights are loaded into the skeleton without loading the full-precision model.
+    cached_model = quantize_int8("test/llama", _fail_load, _skeleton)
+    input_ids = tensor([[1, 2, 3, 4]])
+    assert allclose(
+        quantized_model(input_ids).logits,
+        cached_model(input_ids).logits,
+    )
@@ -0,0 +1,63 @@
+from pathlib import Path
+from pickle import dumps, loads  # nosec: B403
+
+from mibi.utils.rate_limiting import RateLimit, RateLimiter
+
+
+def test_rate_limiter_burst(tmp_path: Path) -> None:
+    limiter = RateLimiter(
+        path=tmp_path / "rate-limits.sqlite",
+        limits={"test": RateLimit(requests_per_second=20)},
+    )
+    # A burst of one second's requests (plus one) is not delayed.
+    for _ in range(21):
+        limiter.acquire("test")
+    assert limiter.stats["test"].delayed == 0
+    limiter.acquire("test")
+    stats = limiter.stats["test"]
+    assert stats.requests == 22
+    assert stats.delayed == 1
+    assert stats.delay_seconds > 0
+
+
+def test_rate_limiter_unlimited(tmp_path: Path) -> None:
+    limiter = RateLimiter(
+        path=tmp_path / "rate-limits.sqlite",
+        limits={"test": RateLimit(requests_per_second=1)},
+    )
+    for _ in range(10):
+        limiter.acquire("other")
+    assert "other" not in limiter.stats
+
+
+def test_rate_limiter_shared(tmp_path: Path) -> None:
+    limits = {"test": RateLimit(tokens_per_minute=6000)}
+    limiter = RateLimiter(tmp_path / "rate-limits.sqlite", limits)
+    other_limiter = RateLimiter(tmp_path / "rate-limits.sqlite", limits)
+    # Use up one minute's tokens (plus one).
+    limiter.acquire("test", tokens=6001)
+    other_limiter.acquire("test", tokens=1)
+    assert other_limiter.stats["test"].delayed == 1
+
+
+def test_rate_limiter_adjust(tmp_path: Path) -> None:
+    limiter = RateLimiter(
+        path=tmp_path / "rate-limits.sqlite",
+        limits={"test": RateLimit(tokens_per_minute=6000)},
+    )
+    limiter.acquire("test", tokens=6001)
+    # Correct the estimate, such that tokens for one more request are left.
+    limiter.adjust("test", tokens=-1)
+    limiter.acquire("test", tokens=1)
+    assert limiter.stats["test"].delayed == 0
+
+
+def test_rate_limiter_picklable(tmp_path: Path) -> None:
+    limiter = RateLimiter(
+        path=tmp_path / "rate-limits.sqlite",
+        limits={"test": RateLimit(requests_per_second=20)},
+    )
+    limiter.acquire("test")
+    copied_limiter: RateLimiter = loads(dumps(limiter))  # nosec: B301
+    copied_limiter.acquire("test")
+    assert copied_limiter.stats["test"].requests == 2
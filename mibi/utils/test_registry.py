@@ -0,0 +1,43 @@
+from mibi.utils.registry import ModelRegistry
+
+
+def test_registry_loads_once() -> None:
+    registry = ModelRegistry()
+    loads: list[str] = []
+
+    def load() -> str:
+        loads.append("model")
+        return "model"
+
+    assert registry.get("test", load) == "model"
+    assert registry.get("test", load) == "model"
+    assert loads == ["model"]
+
+
+def test_registry_preload() -> None:
+    registry = ModelRegistry()
+    registry.preload("test", lambda: "model")
+    assert registry.get("test", lambda: "other") == "model"
+    assert "test" in registry.memory_usage()
+    memory = registry.memory_usage()["test"]
+    assert memory is None or memory >= 0
+
+
+def test_registry_memory_counts_quantized_weights() -> None:
+    from torch.nn import Linear, Sequential
+    from torch.ao.quantization import quantize_dynamic
+    from torch import qint8
+
+    registry = ModelRegistry()
+    registry.preload("test", lambda: quantize_dynamic(
+        Sequential(Linear(64, 64, bias=False)), dtype=qint8))
+    memory = registry.memory_usage()["test"]
+    assert memory is not None
+    assert memory >= 64 * 64
+
+
+def test_registry_clear() -> None:
+    registry = ModelRegistry()
+    registry.preload("test", lambda: "model")
+    registry.clear()
+    assert registry.get("test", lambda: "other") == "other"
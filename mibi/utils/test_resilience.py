@@ -0,0 +1,172 @@
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, Future, wait
+from threading import Event
+from time import sleep
+
+from pytest import MonkeyPatch, raises
+
+from mibi.utils.resilience import ResilienceStats, ResiliencePolicy, ResilientCaller, backoff_delay, latency_quantile
+
+
+def _not_retryable(_error: Exception) -> float | None:
+    return None
+
+
+def _retryable(_error: Exception) -> float | None:
+    return 0
+
+
+def test_latency_quantile() -> None:
+    latencies = [float(latency) for latency in range(1, 101)]
+    assert latency_quantile(latencies, 0.5) == 50
+    assert latency_quantile(latencies, 0.95) == 95
+    assert latency_quantile([3.0], 0.95) == 3
+
+
+def test_backoff_delay() -> None:
+    for attempt in range(10):
+        delay = backoff_delay(attempt, base=0.1, maximum=1)
+        assert 0 <= delay <= min(1, 0.1 * 2 ** attempt)
+
+
+def test_resilient_caller_retries() -> None:
+    caller: ResilientCaller[str] = ResilientCaller(ResiliencePolicy(
+        max_retries=2,
+        backoff_base=0.001,
+    ))
+    attempts: list[int] = []
+
+    def flaky() -> str:
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise RuntimeError("Server error.")
+        return "ok"
+
+    assert caller.call(flaky, _retryable) == "ok"
+    assert caller.stats.retries == 2
+
+
+def test_resilient_caller_acquires_each_attempt() -> None:
+    caller: ResilientCaller[str] = ResilientCaller(ResiliencePolicy(
+        max_retries=2,
+        backoff_base=0.001,
+    ))
+    attempts: list[int] = []
+    acquired: list[int] = []
+
+    def flaky() -> str:
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise RuntimeError("Server error.")
+        return "ok"
+
+    assert caller.call(flaky, _retryable, lambda: acquired.append(1)) == "ok"
+    assert len(acquired) == 3
+
+
+def test_resilient_caller_excludes_acquire_from_latency() -> None:
+    caller: ResilientCaller[str] = ResilientCaller(ResiliencePolicy(
+        timeout=0.1,
+    ))
+    # Waiting longer than the timeout for the rate limit does not time out the call.
+    assert caller.call(lambda: "ok", _not_retryable, lambda: sleep(0.2)) == "ok"
+    stats = caller.stats
+    assert stats.timeouts == 0
+    assert stats.p50_seconds is not None
+    assert stats.p50_seconds < 0.1
+
+
+def test_resilient_caller_not_retryable() -> None:
+    caller: ResilientCaller[str] = ResilientCaller(ResiliencePolicy(
+        max_retries=2,
+    ))
+
+    def fail() -> str:
+        raise RuntimeError("Bad request.")
+
+    with raises(RuntimeError):
+        caller.call(fail, _not_retryable)
+    assert caller.stats.retries == 0
+
+
+def test_resilient_caller_timeout() -> None:
+    caller: ResilientCaller[str] = ResilientCaller(ResiliencePolicy(
+        timeout=0.01,
+        max_retries=1,
+        backoff_base=0.001,
+    ))
+    release = Event()
+    with raises(TimeoutError):
+        caller.call(lambda: "ok" if release.wait(1) else "", _retryable)
+    release.set()
+    stats = caller.stats
+    assert stats.timeouts == 2
+    assert stats.retries == 1
+
+
+def test_resilient_caller_hedges() -> None:
+    caller: ResilientCaller[str] = ResilientCaller(ResiliencePolicy(
+        hedge_quantile=0.95,
+        hedge_min_samples=5,
+    ))
+    for _ in range(5):
+        assert caller.call(lambda: "fast", _not_retryable) == "fast"
+    # The first (slow) call is hedged by a second (fast) call.
+    slow = Event()
+
+    def first_slow() -> str:
+        if not slow.is_set():
+            slow.set()
+            sleep(1)
+            return "slow"
+        return "fast"
+
+    acquired: list[int] = []
+    assert caller.call(
+        first_slow,
+        _not_retryable,
+        lambda: acquired.append(1),
+    ) == "fast"
+    # The hedged call waits for the rate limit, too.
+    assert len(acquired) == 2
+    stats: ResilienceStats = caller.stats
+    assert stats.hedges == 1
+    assert stats.hedge_wins == 1
+    assert stats.calls == 6
+    assert sum(stats.histogram) == 6
+
+
+def test_resilient_caller_prefers_success_finished_at_same_time(
+    monkeypatch: MonkeyPatch,
+) -> None:
+    import mibi.utils.resilience
+
+    def wait_for_all(
+        futures: set[Future[str]],
+        timeout: float | None = None,
+        return_when: str = FIRST_COMPLETED,
+    ) -> tuple[set[Future[str]], set[Future[str]]]:
+        if len(futures) == 2:
+            # Let the primary and the hedged call finish in the same wait.
+            return_when = ALL_COMPLETED
+        done, pending = wait(futures, timeout=timeout, return_when=return_when)
+        return done, pending
+
+    monkeypatch.setattr(mibi.utils.resilience, "wait", wait_for_all)
+    caller: ResilientCaller[str] = ResilientCaller(ResiliencePolicy(
+        hedge_quantile=0.95,
+        hedge_min_samples=5,
+    ))
+    for _ in range(5):
+        assert caller.call(lambda: "fast", _not_retryable) == "fast"
+    # The first (slow) call fails, but the hedged call succeeds.
+    slow = Event()
+
+    def first_slow_failing() -> str:
+        if not slow.is_set():
+            slow.set()
+            sleep(0.5)
+            raise ValueError("Failed.")
+        return "fast"
+
+    assert caller.call(first_slow_failing, _not_retryable) == "fast"
+    assert caller.stats.hedge_wins == 1
@@ -0,0 +1,59 @@
+from datetime import timedelta
+from pathlib import Path
+from time import sleep
+
+from pydantic import JsonValue
+
+from mibi.utils.response_cache import ResponseCache
+
+
+def test_response_cache(tmp_path: Path) -> None:
+    cache = ResponseCache(tmp_path / "cache.sqlite")
+    key: dict[str, JsonValue] = {"model": "gpt-3.5-turbo", "prompt": "Hello world!"}
+    assert cache.get(key) is None
+    cache.put(key, ["Hi!"])
+    assert cache.get(key) == ["Hi!"]
+    # Key order does not matter.
+    reordered_key: dict[str, JsonValue] = {
+        "prompt": "Hello world!", "model": "gpt-3.5-turbo"}
+    assert cache.get(reordered_key) == ["Hi!"]
+    other_key: dict[str, JsonValue] = {
+        "model": "gpt-4", "prompt": "Hello world!"}
+    assert cache.get(other_key) is None
+    stats = cache.stats
+    assert stats.hits == 2
+    assert stats.misses == 2
+    assert stats.hit_rate == 0.5
+
+
+def test_response_cache_persistent(tmp_path: Path) -> None:
+    ResponseCache(tmp_path / "cache.sqlite").put("key", "value")
+    assert ResponseCache(tmp_path / "cache.sqlite").get("key") == "value"
+
+
+def test_response_cache_ttl(tmp_path: Path) -> None:
+    cache = ResponseCache(
+        tmp_path / "cache.sqlite",
+        ttl=timedelta(seconds=0.1),
+    )
+    cache.put("key", "value")
+    assert cache.get("key") == "value"
+    sleep(0.2)
+    assert cache.get("key") is None
+    assert len(cache) == 0
+
+
+def test_response_cache_max_size(tmp_path: Path) -> None:
+    # Each value takes 7 bytes as JSON.
+    cache = ResponseCache(tmp_path / "cache.sqlite", max_size=20)
+    cache.put("a", "value")
+    cache.put("b", "value")
+    sleep(0.01)
+    # Access the first entry, so that the second entry is the least recently used.
+    assert cache.get("a") == "value"
+    cache.put("c", "value")
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == "value"
+    assert cache.get("c") == "value"
+    assert cache.stats.evictions == 1
@@ -0,0 +1,120 @@
+from graphlib import CycleError
+from threading import Barrier
+from typing import Any, Callable
+
+from pytest import raises
+
+from mibi.utils.scheduling import run_dag, topological_order
+
+
+def test_run_dag_order() -> None:
+    order: list[str] = []
+    # Both middle tasks must run at the same time to pass the barrier.
+    barrier = Barrier(2, timeout=5)
+
+    def middle(name: str) -> None:
+        barrier.wait()
+        order.append(name)
+
+    run_dag(
+        tasks={
+            "first": lambda: order.append("first"),
+            "left": lambda: middle("left"),
+            "right": lambda: middle("right"),
+            "last": lambda: order.append("last"),
+        },
+        dependencies={
+            "left": ["first"],
+            "right": ["first"],
+            "last": ["left", "right"],
+        },
+    )
+    assert order[0] == "first"
+    assert set(order[1:3]) == {"left", "right"}
+    assert order[3] == "last"
+
+
+def test_topological_order() -> None:
+    order = topological_order(
+        tasks=["last", "left", "right", "first"],
+        dependencies={
+            "left": ["first"],
+            "right": ["first"],
+            "last": ["left", "right"],
+        },
+    )
+    assert order[0] == "first"
+    assert set(order[1:3]) == {"left", "right"}
+    assert order[3] == "last"
+
+
+def test_run_dag_failure() -> None:
+    order: list[str] = []
+
+    def fail() -> None:
+        raise RuntimeError("Failed.")
+
+    with raises(RuntimeError):
+        run_dag(
+            tasks={
+                "first": fail,
+                "second": lambda: order.append("second"),
+            },
+            dependencies={
+                "second": ["first"],
+            },
+        )
+    assert order == []
+
+
+def test_run_dag_invalid() -> None:
+    with raises(CycleError):
+        run_dag(
+            tasks={
+                "first": lambda: None,
+                "second": lambda: None,
+            },
+            dependencies={
+                "first": ["second"],
+                "second": ["first"],
+            },
+        )
+    with raises(ValueError):
+        run_dag(
+            tasks={
+                "first": lambda: None,
+            },
+            dependencies={
+                "first": ["second"],
+            },
+        )
+
+
+def test_run_dag_dspy_settings() -> None:
+    from dspy import settings as dspy_settings
+
+    seen: list[tuple[str, Any]] = []
+
+    def task(name: str) -> Callable[[], None]:
+        return lambda: seen.append((name, dspy_settings.config.get("lm")))
+
+    for lm in ("first-lm", "second-lm"):
+        # New thread pools reuse thread identifiers of earlier pools.
+        with dspy_settings.context(lm=lm):
+            run_dag(
+                tasks={
+                    "first": task("first"),
+                    "left": task("left"),
+                    "right": task("right"),
+                },
+                dependencies={
+                    "left": ["first"],
+                    "right": ["first"],
+                },
+            )
+        assert sorted(seen) == [
+            ("first", lm),
+            ("left", lm),
+            ("right", lm),
+        ]
+        seen.clear()
@@ -0,0 +1,65 @@
+from json import loads
+
+from mibi.utils.streaming import IncrementalJsonStringParser, JsonStringFieldTerminator
+
+
+def _chunks(text: str, size: int = 3) -> list[str]:
+    return [text[index:index + size] for index in range(0, len(text), size)]
+
+
+def test_incremental_json_string_parser() -> None:
+    parser = IncrementalJsonStringParser("answer")
+    text = '```json\n{"answer": "BCG \\"works\\".\\nIt\\u00e9s fine."}\n```'
+    values: list[str | None] = []
+    for chunk in _chunks(text):
+        parser.feed(chunk)
+        values.append(parser.value)
+    assert values[0] is None
+    assert parser.started
+    assert parser.closed
+    assert parser.value == 'BCG "works".\nItés fine.'
+    # Partial values grow monotonically.
+    partial_values = [value for value in values if value is not None]
+    for value, next_value in zip(partial_values, partial_values[1:]):
+        assert next_value.startswith(value)
+
+
+def test_incremental_json_string_parser_other_field() -> None:
+    parser = IncrementalJsonStringParser("answer")
+    parser.feed('{"reasoning": "The answer is short.", "answer"')
+    assert not parser.started
+    parser.feed(': "Yes')
+    assert parser.value == "Yes"
+    assert not parser.closed
+
+
+def test_json_string_field_terminator_closed() -> None:
+    terminator = JsonStringFieldTerminator("answer", max_sentences=3)
+    stopped = False
+    for chunk in _chunks('{"answer": "Yes. It works."}\n\nSome rambling.'):
+        if terminator.feed(chunk):
+            stopped = True
+            break
+    assert stopped
+    assert loads(terminator.completion()) == {"answer": "Yes. It works."}
+
+
+def test_json_string_field_terminator_max_sentences() -> None:
+    terminator = JsonStringFieldTerminator("answer", max_sentences=2)
+    text = '{"answer": "First one. Second one, e.g. with this. Third one. Fourth one."}'
+    consumed = ""
+    for chunk in _chunks(text):
+        consumed += chunk
+        if terminator.feed(chunk):
+            break
+    assert len(consumed) < len(text)
+    assert loads(terminator.completion()) == {
+        "answer": "First one. Second one, e.g. with this.",
+    }
+
+
+def test_json_string_field_terminator_truncated() -> None:
+    terminator = JsonStringFieldTerminator("answer")
+    for chunk in _chunks('{"answer": "First one. Second o'):
+        assert not terminator.feed(chunk)
+    assert loads(terminator.completion()) == {"answer": "First one."}
@@ -0,0 +1,55 @@
+from typing import Callable
+from warnings import warn
+
+from tiktoken import Encoding, encoding_for_model, get_encoding
+from transformers import AutoTokenizer, PreTrainedTokenizerBase
+
+from mibi.utils.registry import model_registry
+
+
+TokenCounter = Callable[[str], int]
+
+HUGGING_FACE_MODEL_NAMES = {
+    "Mistral-7B-Instruct-v0.2": "mistralai/Mistral-7B-Instruct-v0.2",
+    "Mixtral-8x7B-Instruct-v0.1": "mistralai/Mixtral-8x7B-Instruct-v0.1",
+}
+
+
+def _load_tokenizer(
+    language_model_name: str,
+) -> Encoding | PreTrainedTokenizerBase:
+    # Local models use the same tokenizer as the remote models.
+    language_model_name = language_model_name.removeprefix("local/")
+    try:
+        return encoding_for_model(language_model_name)
+    except KeyError:
+        pass
+    try:
+        return AutoTokenizer.from_pretrained(
+            HUGGING_FACE_MODEL_NAMES.get(
+                language_model_name, language_model_name),
+        )
+    except OSError:
+        pass
+    warn(RuntimeWarning(
+        f"Could not find tokenizer for language model "
+        f"'{language_model_name}'. Approximating token counts "
+        f"with the 'cl100k_base' encoding."))
+    return get_encoding("cl100k_base")
+
+
+def token_counter(language_model_name: str) -> TokenCounter:
+    """
+    Get a function that counts the tokens of a text with the language model's tokenizer (shared process-wide).
+    OpenAI models use their tiktoken encoding, other models their Hugging Face tokenizer. If no tokenizer is found, the counts are approximated.
+    """
+    tokenizer = model_registry.get(
+        f"tokenizer:{language_model_name}",
+        lambda: _load_tokenizer(language_model_name),
+    )
+    if isinstance(tokenizer, Encoding):
+        return lambda text: len(tokenizer.encode(
+            text, disallowed_special=()))
+    else:
+        return lambda text: len(tokenizer.encode(
+            text, add_special_tokens=False))
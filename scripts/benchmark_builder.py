@@ -0,0 +1,166 @@
+"""
+Benchmark the overhead of the answer builder per question, i.e., without the cost of the modules themselves.
+The modules return fixed answers with 10 documents and 10 snippets each.
+
+Usage:
+    python scripts/benchmark_builder.py --repeat 1000
+"""
+
+from contextlib import redirect_stdout
+from io import StringIO
+from timeit import timeit
+
+from click import IntRange, command, echo, option
+from pydantic_core import Url
+
+from mibi.builder import AnswerBuilder
+from mibi.model import Documents, ExactAnswer, IdealAnswer, PartialAnswer, PartiallyAnsweredQuestion, Question, Snippet, Snippets
+from mibi.modules import DocumentsModule, ExactAnswerModule, IdealAnswerModule, SnippetsModule
+from mibi.modules.standard import RetrieveThenGenerateAnswerModule
+
+
+_QUESTION = Question(
+    id="6415c252690f196b51000011",
+    type="list",
+    body="Which cancers is the BCG vaccine used for?",
+)
+_DOCUMENTS: Documents = [
+    Url(f"http://www.ncbi.nlm.nih.gov/pubmed/{12345678 + i}")
+    for i in range(10)
+]
+_SNIPPETS: Snippets = [
+    Snippet(
+        document=document,
+        text="The BCG vaccine is used to treat bladder cancer. " * 3,
+        begin_section="abstract",
+        offset_in_begin_section=0,
+        end_section="abstract",
+        offset_in_end_section=150,
+    )
+    for document in _DOCUMENTS
+]
+_EXACT_ANSWER: ExactAnswer = ["bladder cancer", "melanoma"]
+_IDEAL_ANSWER: IdealAnswer = "The BCG vaccine is used for bladder cancer and melanoma."
+
+
+class _FixedDocumentsModule(DocumentsModule):
+    def forward(self, question: Question, partial_answer: PartialAnswer) -> Documents:
+        PartiallyAnsweredQuestion.from_question(question, partial_answer)
+        return _DOCUMENTS
+
+
+class _FixedSnippetsModule(SnippetsModule):
+    def forward(self, question: Question, partial_answer: PartialAnswer) -> Snippets:
+        PartiallyAnsweredQuestion.from_question(question, partial_answer)
+        return _SNIPPETS
+
+
+class _FixedExactAnswerModule(ExactAnswerModule):
+    def forward(self, question: Question, partial_answer: PartialAnswer) -> ExactAnswer:
+        PartiallyAnsweredQuestion.from_question(question, partial_answer)
+        return _EXACT_ANSWER
+
+
+class _FixedIdealAnswerModule(IdealAnswerModule):
+    def forward(self, question: Question, partial_answer: PartialAnswer) -> IdealAnswer:
+        PartiallyAnsweredQuestion.from_question(question, partial_answer)
+        return _IDEAL_ANSWER
+
+
+def _builder() -> AnswerBuilder:
+    return AnswerBuilder(
+        question=_QUESTION,
+        documents_module=_FixedDocumentsModule(),
+        snippets_module=_FixedSnippetsModule(),
+        exact_answer_module=_FixedExactAnswerModule(),
+        ideal_answer_module=_FixedIdealAnswerModule(),
+    )
+
+
+def _build_answer() -> None:
+    builder = _builder()
+    builder.make_documents()
+    builder.make_snippets()
+    builder.make_exact_answer()
+    builder.make_ideal_answer()
+    builder.answer
+
+
+def _validated_partial_answer() -> None:
+    # Previous approach: re-validate all fields on each update.
+    PartialAnswer(
+        documents=_DOCUMENTS,
+        snippets=_SNIPPETS,
+        exact_answer=_EXACT_ANSWER,
+        ideal_answer=_IDEAL_ANSWER,
+    )
+
+
+def _validated_from_question() -> None:
+    # Previous approach: re-validate the question and partial answer.
+    PartiallyAnsweredQuestion(
+        id=_QUESTION.id,
+        type=_QUESTION.type,
+        body=_QUESTION.body,
+        documents=_DOCUMENTS,
+        snippets=_SNIPPETS,
+        exact_answer=_EXACT_ANSWER,
+        ideal_answer=_IDEAL_ANSWER,
+    )
+
+
+@command()
+@option("--repeat", "num_repeat", type=IntRange(min=1), default=1000)
+def benchmark(num_repeat: int) -> None:
+    partial_answer = PartialAnswer(
+        documents=_DOCUMENTS,
+        snippets=_SNIPPETS,
+        exact_answer=_EXACT_ANSWER,
+        ideal_answer=_IDEAL_ANSWER,
+    )
+    builder = _builder()
+    with redirect_stdout(StringIO()):
+        builder.make_documents()
+        builder.make_snippets()
+    answer_module = RetrieveThenGenerateAnswerModule(
+        documents_module=_FixedDocumentsModule(),
+        snippets_module=_FixedSnippetsModule(),
+        exact_answer_module=_FixedExactAnswerModule(),
+        ideal_answer_module=_FixedIdealAnswerModule(),
+    )
+
+    benchmarks = [
+        (
+            "update (validate all fields)",
+            _validated_partial_answer,
+        ),
+        (
+            "update (validate new field)",
+            lambda: builder._update_partial_answer("ideal_answer", _IDEAL_ANSWER),
+        ),
+        (
+            "from_question (validated)",
+            _validated_from_question,
+        ),
+        (
+            "from_question (constructed)",
+            lambda: PartiallyAnsweredQuestion.from_question(_QUESTION, partial_answer),
+        ),
+        (
+            "builder per question",
+            _build_answer,
+        ),
+        (
+            "rtg module per question",
+            lambda: answer_module.forward(_QUESTION),
+        ),
+    ]
+    for name, function in benchmarks:
+        # Suppress the builder's progress messages.
+        with redirect_stdout(StringIO()):
+            duration = timeit(function, number=num_repeat) / num_repeat
+        echo(f"{name}: {duration * 1_000_000:.1f} µs")
+
+
+if __name__ == "__main__":
+    benchmark()
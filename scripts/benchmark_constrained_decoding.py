@@ -0,0 +1,63 @@
+"""
+Benchmark the retries of the LLM exact answer module with and without constrained decoding.
+
+Each training question is answered based on its ground-truth snippets, once with unconstrained and once with schema-constrained decoding. The LLM backend is configured as for `mibi run` (e.g., via `OPENAI_API_KEY` or `OLLAMA_API_BASE`).
+
+Usage:
+    python scripts/benchmark_constrained_decoding.py data/training12b_new.json --first 100
+"""
+
+from pathlib import Path
+from time import perf_counter
+
+from click import IntRange, argument, command, echo, option, Path as PathType
+
+from benchmark_utils import load_questions
+from mibi.model import PartialAnswer, Question
+from mibi.modules.exact_answer.llm import LlmExactAnswerModule
+from mibi.utils.language_models import init_language_model_clients
+
+
+@command()
+@argument(
+    "training_data_path",
+    type=PathType(path_type=Path, exists=True, dir_okay=False),
+)
+@option("-n", "--first", "first_questions", type=IntRange(min=1), default=100)
+@option("-l", "--llm", "language_model_name", type=str, default="gpt-3.5-turbo-0125")
+def benchmark(
+    training_data_path: Path,
+    first_questions: int,
+    language_model_name: str,
+) -> None:
+    questions = [
+        question
+        for question in load_questions(training_data_path, first_questions)
+        if question.type != "summary"
+    ]
+    echo(f"Benchmarking on {len(questions)} questions.")
+    init_language_model_clients(language_model_name)
+
+    for constrained_decoding in (False, True):
+        module = LlmExactAnswerModule(
+            constrained_decoding=constrained_decoding,
+        )
+        start = perf_counter()
+        for question in questions:
+            module.forward(
+                Question(
+                    id=question.id,
+                    type=question.type,
+                    body=question.body,
+                ),
+                PartialAnswer(snippets=question.snippets),
+            )
+        duration = perf_counter() - start
+        name = "constrained" if constrained_decoding else "unconstrained"
+        echo(f"{name}: {duration / len(questions):.2f} s per question")
+        for question_type, stats in module.prediction_stats.items():
+            echo(f"  {question_type}: {stats}")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,113 @@
+"""
+Benchmark the pairwise re-ranking strategies (all pairs vs. sliding windows) by number of comparisons, latency, and effectiveness.
+
+For each training question, the ground-truth snippets are mixed with the ground-truth snippets of other questions (as non-relevant candidates), re-ranked pointwise, and then the top candidates are re-ranked pairwise.
+
+Usage:
+    python scripts/benchmark_pairwise.py data/training12b_new.json --first 100
+"""
+
+from pathlib import Path
+from time import perf_counter
+
+from click import IntRange, argument, command, echo, option, Path as PathType
+from pyterrier import started, init
+
+if not started():
+    init()
+
+from benchmark_utils import load_questions, mean_ndcg, rankings, snippet_candidates  # noqa: E402
+from mibi.modules.snippets.pipelines import SnippetsPipeline, build_pairwise_reranker, build_pointwise_reranker  # noqa: E402
+from mibi.utils.pyterrier import SlidingWindowPairwiseRerank, num_pairwise_comparisons, sliding_windows  # noqa: E402
+
+
+@command()
+@argument(
+    "training_data_path",
+    type=PathType(path_type=Path, exists=True, dir_okay=False),
+)
+@option("-n", "--first", "first_questions", type=IntRange(min=1), default=100)
+@option("--negatives", "num_negatives", type=IntRange(min=0), default=50)
+@option("--window-size", type=IntRange(min=2), default=4)
+@option("--stride", type=IntRange(min=1), default=2)
+def benchmark(
+    training_data_path: Path,
+    first_questions: int,
+    num_negatives: int,
+    window_size: int,
+    stride: int,
+) -> None:
+    questions = load_questions(training_data_path, first_questions)
+    echo(f"Benchmarking on {len(questions)} questions.")
+    candidates, relevance = snippet_candidates(questions, num_negatives)
+
+    defaults = SnippetsPipeline(
+        elasticsearch_url="",
+        elasticsearch_username=None,
+        elasticsearch_password=None,
+        elasticsearch_index=None,
+    )
+    pointwise_reranker = build_pointwise_reranker(defaults.pointwise_model)
+    pairwise_reranker = build_pairwise_reranker(defaults.pairwise_model)
+    if pointwise_reranker is None or pairwise_reranker is None:
+        raise RuntimeError("Could not build re-rankers.")
+
+    pointwise_res = pointwise_reranker.transform(candidates)
+    pointwise_rankings = rankings(pointwise_res)
+    echo(f"pointwise: nDCG@10 {mean_ndcg(pointwise_rankings, relevance):.4f}")
+
+    strategies = [
+        ("all-pairs", 5, None),
+        ("all-pairs", 10, None),
+        ("sliding-window", 10, None),
+        ("sliding-window", 20, None),
+        ("sliding-window", 20, 60),
+    ]
+    for strategy, cutoff, max_comparisons in strategies:
+        top_candidates = pointwise_res.sort_values(
+            ["qid", "score"], ascending=[True, False],
+        ).groupby("qid").head(cutoff)
+
+        comparisons = 0
+        for _, res in top_candidates.groupby("qid"):
+            if strategy == "all-pairs":
+                comparisons += len(res) * (len(res) - 1)
+            else:
+                comparisons += num_pairwise_comparisons(sliding_windows(
+                    num_candidates=len(res),
+                    window_size=window_size,
+                    stride=stride,
+                    max_comparisons=max_comparisons,
+                ))
+
+        reranker = pairwise_reranker
+        if strategy == "sliding-window":
+            reranker = SlidingWindowPairwiseRerank(
+                reranker=pairwise_reranker,
+                window_size=window_size,
+                stride=stride,
+                max_comparisons=max_comparisons,
+            )
+        start = perf_counter()
+        pairwise_res = reranker.transform(top_candidates)
+        latency = perf_counter() - start
+
+        pairwise_rankings = rankings(pairwise_res)
+        combined_rankings = {
+            qid: pairwise_rankings.get(qid, []) + [
+                docno for docno in ranking
+                if docno not in pairwise_rankings.get(qid, [])
+            ]
+            for qid, ranking in pointwise_rankings.items()
+        }
+        budget = f", budget {max_comparisons}" if max_comparisons is not None else ""
+        echo(
+            f"{strategy} (top-{cutoff}{budget}): "
+            f"{comparisons / len(questions):.1f} comparisons/question, "
+            f"{latency / len(questions) * 1000:.1f} ms/question, "
+            f"nDCG@10 {mean_ndcg(combined_rankings, relevance):.4f}"
+        )
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,178 @@
+"""
+Benchmark the overhead of the passaging helpers (`MaybePassager`, `MaybeDePassager`, and `WithDocumentIds`) on realistic candidate set sizes, compared to the previous implementations that copied the full frame.
+
+Usage:
+    python scripts/benchmark_passaging.py --passages 1000
+"""
+
+from dataclasses import dataclass
+from timeit import repeat
+
+from click import IntRange, command, echo, option
+from pandas import DataFrame, concat
+from pyterrier import started, init
+
+if not started():
+    init()
+
+from pyterrier.model import add_ranks  # noqa: E402
+from pyterrier.transformer import Transformer  # noqa: E402
+
+from mibi.utils.pyterrier import MaybeDePassager, MaybePassager, WithDocumentIds  # noqa: E402
+
+
+@dataclass(frozen=True)
+class _SplitPassager(Transformer):
+    num_passages: int = 3
+
+    def transform(self, topics_or_res: DataFrame) -> DataFrame:
+        return concat([
+            topics_or_res.assign(
+                docno=topics_or_res["docno"] + f"%p(abstract,{i * 100:d},abstract,{(i + 1) * 100:d})",
+                pmid=topics_or_res["docno"],
+                snippet_begin_section="abstract",
+                snippet_offset_in_begin_section=i * 100,
+                snippet_end_section="abstract",
+                snippet_offset_in_end_section=(i + 1) * 100,
+                score=topics_or_res["score"] - i,
+            )
+            for i in range(self.num_passages)
+        ], ignore_index=True)
+
+
+@dataclass(frozen=True)
+class _FirstPassageDePassager(Transformer):
+    def transform(self, topics_or_res: DataFrame) -> DataFrame:
+        topics_or_res = topics_or_res.assign(
+            docno=topics_or_res["docno"].str.split("%p").str[0])
+        return topics_or_res.groupby(["qid", "docno"], as_index=False).first()
+
+
+@dataclass(frozen=True)
+class _LegacyMaybePassager(Transformer):
+    passager: Transformer
+
+    def transform(self, topics_or_res: DataFrame) -> DataFrame:
+        topics_or_res = topics_or_res.copy()
+        is_passage = topics_or_res["docno"].str.contains("%p")
+        topics_or_res = concat([
+            topics_or_res[is_passage],
+            self.passager.transform(
+                topics_or_res[~is_passage].reset_index()
+            ) if len(topics_or_res[~is_passage]) else topics_or_res[~is_passage],
+        ])
+        topics_or_res = topics_or_res.groupby("docno").first().reset_index()
+        topics_or_res.sort_values(
+            by=["qid", "score"], ascending=[True, False], inplace=True)
+        topics_or_res = add_ranks(topics_or_res)
+        topics_or_res.reset_index(drop=True, inplace=True)
+        return topics_or_res
+
+
+@dataclass(frozen=True)
+class _LegacyMaybeDePassager(Transformer):
+    de_passager: Transformer
+
+    def transform(self, topics_or_res: DataFrame) -> DataFrame:
+        topics_or_res = topics_or_res.copy()
+        is_passage = topics_or_res["docno"].str.contains("%p")
+        topics_or_res = concat([
+            topics_or_res[~is_passage],
+            self.de_passager.transform(
+                topics_or_res[is_passage].reset_index()
+            ) if len(topics_or_res[is_passage]) else topics_or_res[is_passage],
+        ])
+        topics_or_res = topics_or_res.groupby("docno").first().reset_index()
+        topics_or_res.sort_values(
+            by=["qid", "score"], ascending=[True, False], inplace=True)
+        topics_or_res = add_ranks(topics_or_res)
+        topics_or_res.reset_index(drop=True, inplace=True)
+        return topics_or_res
+
+
+@dataclass(frozen=True)
+class _LegacyWithDocumentIds(Transformer):
+    transformer: Transformer
+
+    def transform(self, topics_or_res: DataFrame) -> DataFrame:
+        topics_or_res = topics_or_res.copy()
+        topics_or_res["olddocno"] = topics_or_res["docno"]
+        topics_or_res[["docno", "pid"]] = \
+            topics_or_res["olddocno"].str.split("%p", expand=True)
+        topics_or_res = self.transformer.transform(topics_or_res)
+        topics_or_res["docno"] = topics_or_res["olddocno"]
+        topics_or_res.drop(columns=["olddocno", "pid"], inplace=True)
+        topics_or_res.reset_index(drop=True, inplace=True)
+        return topics_or_res
+
+
+def _candidates(num_passages: int, num_documents: int) -> DataFrame:
+    text = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 5
+    return DataFrame([
+        {
+            "qid": "1",
+            "query": "lorem ipsum",
+            "docno": f"{10000000 + i}%p(abstract,0,abstract,{len(text)})",
+            "pmid": f"{10000000 + i}",
+            "snippet_begin_section": "abstract",
+            "snippet_offset_in_begin_section": 0,
+            "snippet_end_section": "abstract",
+            "snippet_offset_in_end_section": len(text),
+            "text": text,
+            "url": f"http://www.ncbi.nlm.nih.gov/pubmed/{10000000 + i}",
+            "score": float(num_passages - i),
+        }
+        for i in range(num_passages)
+    ] + [
+        {
+            "qid": "1",
+            "query": "lorem ipsum",
+            "docno": f"{20000000 + i}",
+            "text": text,
+            "url": f"http://www.ncbi.nlm.nih.gov/pubmed/{20000000 + i}",
+            "score": float(num_documents - i),
+        }
+        for i in range(num_documents)
+    ])
+
+
+@command()
+@option("--passages", "num_passages", type=IntRange(min=0), default=1000)
+@option("--documents", "num_documents", type=IntRange(min=0), default=100)
+@option("--repeat", "num_repeat", type=IntRange(min=1), default=10)
+def benchmark(num_passages: int, num_documents: int, num_repeat: int) -> None:
+    candidates = _candidates(num_passages, num_documents)
+    echo(f"Benchmarking on {len(candidates)} candidates.")
+
+    transformers: list[tuple[str, Transformer, Transformer]] = [
+        (
+            "MaybePassager",
+            _LegacyMaybePassager(_SplitPassager()),
+            MaybePassager(_SplitPassager()),
+        ),
+        (
+            "MaybeDePassager",
+            _LegacyMaybeDePassager(_FirstPassageDePassager()),
+            MaybeDePassager(_FirstPassageDePassager()),
+        ),
+        (
+            "WithDocumentIds",
+            _LegacyWithDocumentIds(Transformer.identity()),
+            WithDocumentIds(Transformer.identity()),
+        ),
+    ]
+    for name, legacy, current in transformers:
+        legacy_time = min(repeat(
+            lambda: legacy.transform(candidates), number=1, repeat=num_repeat))
+        current_time = min(repeat(
+            lambda: current.transform(candidates), number=1, repeat=num_repeat))
+        echo(
+            f"{name}: "
+            f"previous {legacy_time * 1000:.2f} ms, "
+            f"current {current_time * 1000:.2f} ms "
+            f"({legacy_time / current_time:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,104 @@
+"""
+Benchmark the latency and ranking quality of the snippet re-rankers per inference backend.
+
+For each training question, the ground-truth snippets are mixed with the ground-truth snippets of other questions (as non-relevant candidates) and re-ranked with each backend.
+Effectiveness is reported as nDCG@10 against the ground-truth relevance and against the ranking of the full-precision `torch` backend.
+
+Usage:
+    python scripts/benchmark_rerankers.py data/training12b_new.json --first 100
+"""
+
+from pathlib import Path
+from time import perf_counter
+
+from click import IntRange, argument, command, echo, option, Path as PathType
+from pyterrier import started, init
+
+if not started():
+    init()
+
+from benchmark_utils import load_questions, mean_ndcg, rankings, snippet_candidates  # noqa: E402
+from mibi.modules.snippets.pipelines import SnippetsPipeline, build_pairwise_reranker, build_pointwise_reranker  # noqa: E402
+
+
+@command()
+@argument(
+    "training_data_path",
+    type=PathType(path_type=Path, exists=True, dir_okay=False),
+)
+@option("-n", "--first", "first_questions", type=IntRange(min=1), default=100)
+@option("--negatives", "num_negatives", type=IntRange(min=0), default=50)
+@option("--pairwise-cutoff", type=IntRange(min=2), default=5)
+def benchmark(
+    training_data_path: Path,
+    first_questions: int,
+    num_negatives: int,
+    pairwise_cutoff: int,
+) -> None:
+    questions = load_questions(training_data_path, first_questions)
+    echo(f"Benchmarking on {len(questions)} questions.")
+    candidates, relevance = snippet_candidates(questions, num_negatives)
+    echo(f"Re-ranking {len(candidates)} candidates.")
+
+    defaults = SnippetsPipeline(
+        elasticsearch_url="",
+        elasticsearch_username=None,
+        elasticsearch_password=None,
+        elasticsearch_index=None,
+    )
+
+    reference_rankings: dict[str, list[str]] = {}
+    for inference_backend in ("torch", "torch-int8"):
+        pointwise_reranker = build_pointwise_reranker(
+            model_name=defaults.pointwise_model,
+            inference_backend=inference_backend,
+        )
+        pairwise_reranker = build_pairwise_reranker(
+            model_name=defaults.pairwise_model,
+            inference_backend=inference_backend,
+        )
+        if pointwise_reranker is None or pairwise_reranker is None:
+            raise RuntimeError("Could not build re-rankers.")
+
+        start = perf_counter()
+        pointwise_res = pointwise_reranker.transform(candidates)
+        pointwise_latency = perf_counter() - start
+
+        top_candidates = pointwise_res.sort_values(
+            ["qid", "score"], ascending=[True, False],
+        ).groupby("qid").head(pairwise_cutoff)
+        start = perf_counter()
+        pairwise_res = pairwise_reranker.transform(top_candidates)
+        pairwise_latency = perf_counter() - start
+
+        pointwise_rankings = rankings(pointwise_res)
+        pairwise_rankings = rankings(pairwise_res)
+        combined_rankings = {
+            qid: pairwise_rankings.get(qid, []) + [
+                docno for docno in ranking
+                if docno not in pairwise_rankings.get(qid, [])
+            ]
+            for qid, ranking in pointwise_rankings.items()
+        }
+        if inference_backend == "torch":
+            reference_rankings = combined_rankings
+
+        ndcg = mean_ndcg(combined_rankings, relevance)
+        ndcg_reference = mean_ndcg(combined_rankings, {
+            qid: {
+                docno: 10 - rank
+                for rank, docno in enumerate(ranking[:10])
+            }
+            for qid, ranking in reference_rankings.items()
+        })
+        echo(
+            f"{inference_backend}: "
+            f"pointwise {pointwise_latency / len(questions) * 1000:.1f} ms/question, "
+            f"pairwise {pairwise_latency / len(questions) * 1000:.1f} ms/question, "
+            f"nDCG@10 {ndcg:.4f}, "
+            f"nDCG@10 vs. torch {ndcg_reference:.4f}"
+        )
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,95 @@
+"""
+Shared helpers for the benchmark scripts.
+"""
+
+from math import log2
+from pathlib import Path
+from random import Random
+
+from pandas import DataFrame
+
+from mibi.model import PartiallyAnsweredQuestion, PartiallyAnsweredQuestionData
+
+
+def load_questions(
+    training_data_path: Path,
+    first_questions: int,
+) -> list[PartiallyAnsweredQuestion]:
+    with training_data_path.open("rb") as input_file:
+        data = PartiallyAnsweredQuestionData.model_validate_json(
+            input_file.read())
+    return [
+        question
+        for question in data.questions
+        if question.snippets is not None and len(question.snippets) > 0
+    ][:first_questions]
+
+
+def snippet_candidates(
+    questions: list[PartiallyAnsweredQuestion],
+    num_negatives: int,
+    seed: int = 0,
+) -> tuple[DataFrame, dict[str, dict[str, float]]]:
+    """
+    Mix the ground-truth snippets of each question with ground-truth snippets of other questions (as non-relevant candidates).
+    Returns the candidates and the relevance judgments per question.
+    """
+    random = Random(seed)  # nosec: B311
+    all_texts = [
+        snippet.text
+        for question in questions
+        for snippet in question.snippets or []
+    ]
+    rows = []
+    relevance: dict[str, dict[str, float]] = {}
+    for question in questions:
+        relevant_texts = {snippet.text for snippet in question.snippets or []}
+        negative_texts = [
+            text
+            for text in random.sample(all_texts, min(len(all_texts), num_negatives))
+            if text not in relevant_texts
+        ]
+        relevance[question.id] = {}
+        for i, text in enumerate([*relevant_texts, *negative_texts]):
+            docno = f"{question.id}-{i}"
+            rows.append({
+                "qid": question.id,
+                "query": question.body,
+                "docno": docno,
+                "text": text,
+                "score": 0,
+            })
+            if text in relevant_texts:
+                relevance[question.id][docno] = 1
+    return DataFrame(rows), relevance
+
+
+def ndcg(ranked_docnos: list[str], gains: dict[str, float], k: int = 10) -> float:
+    dcg = sum(
+        gains.get(docno, 0) / log2(rank + 2)
+        for rank, docno in enumerate(ranked_docnos[:k])
+    )
+    ideal_gains = sorted(gains.values(), reverse=True)[:k]
+    idcg = sum(
+        gain / log2(rank + 2)
+        for rank, gain in enumerate(ideal_gains)
+    )
+    return dcg / idcg if idcg > 0 else 0
+
+
+def rankings(res: DataFrame) -> dict[str, list[str]]:
+    return {
+        str(qid): list(group.sort_values("score", ascending=False)["docno"])
+        for qid, group in res.groupby("qid")
+    }
+
+
+def mean_ndcg(
+    rankings: dict[str, list[str]],
+    relevance: dict[str, dict[str, float]],
+    k: int = 10,
+) -> float:
+    return sum(
+        ndcg(ranking, relevance[qid], k)
+        for qid, ranking in rankings.items()
+    ) / len(rankings)